@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+""" Compare loading records directly into the tables of tweets-to-sqlite.py
+with loading them into staging tables first (--bulk).
+
+Synthetic records are generated in memory, so that only the database is
+measured: tweets with random IDs, as when tweets arrive from many files,
+posted by a smaller number of users with random IDs, each with a URL and a
+hashtag. Records are loaded in transactions of `--file-size` tweets, as if
+each transaction were an input file. Optionally, the indexes that
+tweets-to-sqlite-postprocessing.py creates are created before loading, as
+when importing into a database that was already postprocessed.
+
+For each mode, the time spent in the database and the size of the database
+are reported; for the bulk mode, the time of the final sorted insert is also
+reported separately.
+"""
+
+import importlib.util
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import typing
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+# tweets-to-sqlite.py can't be imported by name because of the hyphens
+SPEC = importlib.util.spec_from_file_location(
+    "tweets_to_sqlite",
+    os.path.join(os.path.dirname(__file__), "..", "tweets-to-sqlite.py")
+)
+tweets_to_sqlite = importlib.util.module_from_spec(SPEC)
+SPEC.loader.exec_module(tweets_to_sqlite)
+
+DEFAULT_TWEETS = 10000000
+DEFAULT_FILE_SIZE = 100000
+DEFAULT_TWEETS_PER_USER = 20
+DEFAULT_PLACES = 10000
+
+# the indexes created by tweets-to-sqlite-postprocessing.py
+POSTPROCESSING_INDEXES = {
+    "tweets": ["user_id", "place_id", "timestamp", "lat", "lon"],
+    "places": ["country"]
+}
+
+def generate_batches(tweets: int,
+                     file_size: int,
+                     tweets_per_user: int,
+                     places: int,
+                     seed: int = 0
+                     ) -> typing.Iterator[typing.Dict[str, typing.List[tuple]]]:
+    """ Generate synthetic records in batches of `file_size` tweets.
+
+    Yields:
+        Dicts where keys are table names and values are lists of the values
+        of records, in the order of `TABLE_COLUMNS`.
+    """
+
+    rng = random.Random(seed)
+    users = max(tweets // tweets_per_user, 1)
+    user_ids = [rng.getrandbits(40) for _ in range(users)]
+    place_ids = ["{:016x}".format(rng.getrandbits(64)) for _ in range(places)]
+
+    for start in range(0, tweets, file_size):
+        batch = {
+            table_name: [] for table_name in tweets_to_sqlite.TABLE_COLUMNS
+        } # type: typing.Dict[str, typing.List[tuple]]
+        for _ in range(min(file_size, tweets - start)):
+            tweet_id = rng.getrandbits(62)
+            user_id = rng.choice(user_ids)
+            place_id = rng.choice(place_ids)
+            (lon, lat) = (rng.uniform(-125, -65), rng.uniform(25, 50))
+            batch["users"].append((
+                user_id, "u", "u", "description", 0, 1, 2, 3, None, "en", "x"
+            ))
+            batch["places"].append((
+                place_id, "United States", "X, Y", lon - 1, lat - 1, lon + 1,
+                lat + 1
+            ))
+            batch["tweets"].append((
+                tweet_id, user_id, place_id, "Tue Jan 09 12:00:00 +0000 2020",
+                tweets_to_sqlite.snowflake2utc(tweet_id), "en", None, None,
+                None, lat, lon, "hello world #tag"
+            ))
+            batch["urls"].append((
+                tweet_id, "https://example.com/", "https://t.co/x"
+            ))
+            batch["hashtags"].append((tweet_id, "tag"))
+        yield batch
+
+def load(db_path: str,
+         bulk: bool,
+         indexes: bool,
+         **generate_kwargs) -> typing.Dict[str, float]:
+    """ Load synthetic records into a new database.
+
+    Args:
+        db_path: The path to the database, which must not exist.
+        bulk: If True, load into staging tables and finalize them at the end.
+        indexes: If True, create the postprocessing indexes first.
+        **generate_kwargs: Passed to `generate_batches`.
+
+    Returns:
+        A dict containing the total time ("seconds"), the time of finalizing
+        the staging tables ("finalize_seconds") and the size of the database
+        ("bytes").
+    """
+
+    db = sqlite3.connect(db_path)
+    db.executescript(tweets_to_sqlite.SQL_INIT_SCHEMA)
+    if indexes:
+        for (table_name, columns) in POSTPROCESSING_INDEXES.items():
+            for column in columns:
+                db.execute("CREATE INDEX idx_{0}_{1} ON {0}({1})".format(
+                    table_name, column
+                ))
+    if bulk:
+        tweets_to_sqlite.create_staging_tables(db)
+
+    # generating records is not timed
+    seconds = 0.0
+    for batch in generate_batches(**generate_kwargs):
+        start = time.perf_counter()
+        with db:
+            inserter = tweets_to_sqlite.BatchInserter(db, staging=bulk)
+            for (table_name, rows) in batch.items():
+                inserter.add_rows(table_name, rows)
+            inserter.flush()
+        seconds += time.perf_counter() - start
+    start = time.perf_counter()
+    if bulk:
+        tweets_to_sqlite.finalize_staging_tables(db)
+    finalize_seconds = time.perf_counter() - start
+    db.close()
+
+    return {
+        "seconds": seconds + finalize_seconds,
+        "finalize_seconds": finalize_seconds,
+        "bytes": os.path.getsize(db_path)
+    }
+
+if __name__ == "__main__":
+    #pylint: disable=invalid-name
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-n", "--tweets", default=DEFAULT_TWEETS, type=int,
+        help="the number of tweets to load; default is {}."
+             .format(DEFAULT_TWEETS)
+    )
+    parser.add_argument(
+        "--file-size", default=DEFAULT_FILE_SIZE, type=int,
+        help="the number of tweets per transaction; default is {}."
+             .format(DEFAULT_FILE_SIZE)
+    )
+    parser.add_argument(
+        "--indexes", action="store_true",
+        help="create the indexes of tweets-to-sqlite-postprocessing.py before"
+             " loading."
+    )
+    parser.add_argument(
+        "-d", "--directory",
+        help="the directory to create the databases in; default is the"
+             " system's temporary directory. it needs room for two copies of"
+             " the database."
+    )
+    args = parser.parse_args()
+
+    print("{} tweets, {} per transaction, {}".format(
+        args.tweets, args.file_size,
+        "with indexes" if args.indexes else "without indexes"
+    ))
+    print("{:<8} {:>12} {:>14} {:>12} {:>10}".format(
+        "mode", "seconds", "tweets/s", "finalize s", "size MB"
+    ))
+    for (name, bulk) in [("direct", False), ("bulk", True)]:
+        with tempfile.TemporaryDirectory(dir=args.directory) as directory:
+            result = load(
+                os.path.join(directory, "benchmark.db"), bulk, args.indexes,
+                tweets=args.tweets, file_size=args.file_size,
+                tweets_per_user=DEFAULT_TWEETS_PER_USER, places=DEFAULT_PLACES
+            )
+        print("{:<8} {:>12.1f} {:>14.0f} {:>12.1f} {:>10.1f}".format(
+            name, result["seconds"], args.tweets / result["seconds"],
+            result["finalize_seconds"], result["bytes"] / 1e6
+        ))
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+""" Compare the codecs available for chunk files on a sample of tweets.
+
+For each codec and compression level, the sample is written the way that
+chunker.py writes chunks (in blocks of `write_buffer_size` bytes) and read back
+line by line the way that the other tools read their inputs. The write and read
+throughput, in uncompressed megabytes per second, and the compression ratio are
+reported for each.
+"""
+
+import os
+import sys
+import tempfile
+import time
+import typing
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import chunker # pylint: disable=wrong-import-position
+import tweetio # pylint: disable=wrong-import-position
+
+DEFAULT_SAMPLE_SIZE = 64 * 1024 * 1024
+
+DEFAULT_SETTINGS = [
+    "none",
+    "gzip:1",
+    "gzip:6",
+    "gzip:9",
+    "zstd:1",
+    "zstd:3",
+    "zstd:9",
+    "lz4:0",
+    "lz4:9"
+]
+
+def read_sample(inputs: typing.List[str], sample_size: int) -> typing.List[bytes]:
+    """ Read lines from the inputs until `sample_size` bytes have been read. """
+
+    lines = []
+    size = 0
+    for path in inputs:
+        with tweetio.open_input(path) as input_fp:
+            for line in input_fp:
+                lines.append(line)
+                size += len(line)
+                if size >= sample_size:
+                    return lines
+    return lines
+
+def benchmark_codec(lines: typing.List[bytes],
+                    codec: tweetio.Codec,
+                    level: int = None,
+                    threads: int = 0,
+                    block_size: int = chunker.DEFAULT_WRITE_BUFFER_SIZE
+                    ) -> typing.Dict[str, float]:
+    """ Write and read back a sample with a codec.
+
+    Args:
+        lines: The lines of the sample.
+        codec: The codec to benchmark.
+        level: The compression level.
+        threads: The number of extra compression threads.
+        block_size: The size of the blocks that the sample is written in.
+
+    Returns:
+        A dict containing the write and read throughput in MB/s ("write_mbps",
+        "read_mbps"), the size of the written file ("bytes") and the ratio of
+        the uncompressed to the compressed size ("ratio").
+    """
+
+    blocks = []
+    block = []
+    block_bytes = 0
+    for line in lines:
+        block.append(line)
+        block_bytes += len(line)
+        if block_bytes >= block_size:
+            blocks.append(b"".join(block))
+            block = []
+            block_bytes = 0
+    blocks.append(b"".join(block))
+    size = sum(len(block) for block in blocks)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "sample.json" + codec.suffix)
+
+        start = time.perf_counter()
+        with codec.open(path, "wb", level, threads) as output_fp:
+            for block in blocks:
+                output_fp.write(block)
+        write_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        with tweetio.open_input(path) as input_fp:
+            for _ in input_fp:
+                pass
+        read_time = time.perf_counter() - start
+
+        compressed_size = os.path.getsize(path)
+
+    return {
+        "write_mbps": size / 1e6 / write_time,
+        "read_mbps": size / 1e6 / read_time,
+        "bytes": compressed_size,
+        "ratio": size / compressed_size
+    }
+
+if __name__ == "__main__":
+    #pylint: disable=invalid-name
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "inputs", nargs="+",
+        help="newline-delimited JSON files to take the sample from."
+    )
+    parser.add_argument(
+        "-s", "--sample-size", type=float,
+        default=DEFAULT_SAMPLE_SIZE / 1024 / 1024, metavar="MB",
+        help="the size of the sample, uncompressed; default is {} MB."
+             .format(DEFAULT_SAMPLE_SIZE // 1024 // 1024)
+    )
+    parser.add_argument(
+        "-c", "--codecs", default=",".join(DEFAULT_SETTINGS),
+        help="a comma-separated list of codecs to compare, each optionally"
+             " followed by a colon and a compression level; codecs that are"
+             " not installed are skipped. default is {}."
+             .format(",".join(DEFAULT_SETTINGS))
+    )
+    parser.add_argument(
+        "-t", "--threads", default=0, type=int,
+        help="the number of extra compression threads, for codecs that"
+             " support them."
+    )
+    args = parser.parse_args()
+
+    sample = read_sample(args.inputs, int(args.sample_size * 1024 * 1024))
+    print("sample: {} tweets, {:.1f} MB".format(
+        len(sample), sum(len(line) for line in sample) / 1e6
+    ))
+    print("{:<10} {:>12} {:>12} {:>12} {:>8}".format(
+        "codec", "write MB/s", "read MB/s", "size MB", "ratio"
+    ))
+    for setting in args.codecs.split(","):
+        (name, _, level_str) = setting.partition(":")
+        try:
+            codec = tweetio.get_codec(name)
+        except ValueError as error:
+            print("{:<10} skipped: {}".format(setting, error))
+            continue
+        result = benchmark_codec(
+            sample, codec, int(level_str) if level_str else None,
+            args.threads if codec.threads else 0
+        )
+        print("{:<10} {:>12.1f} {:>12.1f} {:>12.2f} {:>8.2f}".format(
+            setting, result["write_mbps"], result["read_mbps"],
+            result["bytes"] / 1e6, result["ratio"]
+        ))
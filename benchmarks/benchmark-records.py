@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+""" Compare the record representations of tweets-to-sqlite.py on a sample of
+tweets.
+
+The current representation, where each record is an `SqlRecord` with
+`__slots__` holding a tuple of values in a fixed column order, is compared with
+the previous one, where each record held a dict of column names to values and
+was inserted with its own INSERT statement. For each, the following are
+reported:
+
+* the memory held by the records of the sample, per record, as measured by
+  tracemalloc;
+* the throughput of generating records, in tweets per second, including
+  parsing; and
+* the throughput of generating and inserting records into an in-memory
+  database, in tweets per second; the current representation is inserted in
+  batches with `BatchInserter`.
+"""
+
+import importlib.util
+import os
+import sqlite3
+import sys
+import time
+import tracemalloc
+import typing
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import tweetio # pylint: disable=wrong-import-position
+
+# tweets-to-sqlite.py can't be imported by name because of the hyphens
+SPEC = importlib.util.spec_from_file_location(
+    "tweets_to_sqlite",
+    os.path.join(os.path.dirname(__file__), "..", "tweets-to-sqlite.py")
+)
+tweets_to_sqlite = importlib.util.module_from_spec(SPEC)
+SPEC.loader.exec_module(tweets_to_sqlite)
+json = tweets_to_sqlite.json
+
+DEFAULT_SAMPLE_SIZE = 100000
+
+class DictSqlRecord(): # pylint: disable=too-few-public-methods
+    """ The previous, dict-based SqlRecord of tweets-to-sqlite.py. """
+
+    def __init__(self, table_name: str, data: dict):
+        self.table_name = table_name
+        self.data = data
+
+    def insert_into(self, target_db: sqlite3.Connection) -> None:
+        """ Insert this record with its own INSERT statement. """
+
+        sql = "INSERT INTO {}({}) VALUES({})".format(
+            self.table_name,
+            ",".join(self.data.keys()),
+            ",".join("?" * len(self.data))
+        )
+        try:
+            target_db.execute(sql, tuple(self.data.values()))
+        except sqlite3.IntegrityError:
+            pass
+
+def generate_dict_records(tweet_str: bytes) -> typing.List[DictSqlRecord]:
+    """ The previous `generate_records` of tweets-to-sqlite.py. """
+    #pylint: disable=too-many-locals
+
+    convert_nlong = tweets_to_sqlite.convert_nlong
+    records = []
+
+    tweet = json.loads(tweet_str)
+    tweet_id = int(convert_nlong(tweet["id"]))
+    entities = tweet["entities"]
+
+    user = tweet["user"]
+    user_id = int(convert_nlong(user["id"]))
+    records.append(DictSqlRecord("users", {
+        "id": user_id,
+        "verified": int(user["verified"]),
+        **{
+            key: user[key]
+            for key in [
+                "name", "screen_name", "description",
+                "statuses_count", "followers_count", "friends_count",
+                "time_zone", "lang", "location"
+            ]
+        }
+    }))
+
+    place = tweet["place"]
+    place_id = None
+    if place:
+        place_id = place["id"]
+        try:
+            place_bbox = place["bounding_box"]["coordinates"][0]
+            (min_lon, min_lat) = place_bbox[0]
+            (max_lon, max_lat) = place_bbox[2]
+        except (KeyError, TypeError, IndexError, ValueError):
+            (min_lon, min_lat, max_lon, max_lat) = (None, None, None, None)
+        records.append(DictSqlRecord("places", {
+            "id": place_id,
+            "country": place["country"],
+            "full_name": place["full_name"],
+            "min_lon": min_lon,
+            "min_lat": min_lat,
+            "max_lon": max_lon,
+            "max_lat": max_lat
+        }))
+
+    (tweet_lon, tweet_lat) = tweet["coordinates"]["coordinates"]
+    converted_ids = {
+        key: tweet.get(key)
+        for key in [
+            "quoted_status_id", "in_reply_to_status_id", "in_reply_to_user_id"
+        ]
+    }
+    for (key, value) in converted_ids.items():
+        if value:
+            converted_ids[key] = int(convert_nlong(value))
+    records.append(DictSqlRecord("tweets", {
+        "id": tweet_id,
+        "user_id": user_id,
+        "place_id": place_id,
+        "created_at": tweet["created_at"],
+        "timestamp": tweets_to_sqlite.snowflake2utc(tweet_id),
+        "lang": tweet.get("lang"),
+        "quoted_status_id": converted_ids["quoted_status_id"],
+        "in_reply_to_status_id": converted_ids["in_reply_to_status_id"],
+        "in_reply_to_user_id": converted_ids["in_reply_to_user_id"],
+        "lat": tweet_lat,
+        "lon": tweet_lon,
+        "text": tweet["text"]
+    }))
+
+    for url in entities.get("urls", []):
+        records.append(DictSqlRecord("urls", {
+            "tweet_id": tweet_id,
+            "url": url["expanded_url"],
+            "shortened_url": url["url"]
+        }))
+    for media in entities.get("media", []):
+        records.append(DictSqlRecord("media", {
+            "tweet_id": tweet_id,
+            "type": media["type"],
+            "url": media["media_url"],
+            "shortened_url": media["url"]
+        }))
+    for hashtag in entities.get("hashtags", []):
+        records.append(DictSqlRecord("hashtags", {
+            "tweet_id": tweet_id,
+            "text": hashtag["text"]
+        }))
+    for mention in entities.get("mentions", []):
+        records.append(DictSqlRecord("mentions", {
+            "tweet_id": tweet_id,
+            "user_id": mention["id"]
+        }))
+
+    return records
+
+def read_sample(inputs: typing.List[str], sample_size: int) -> typing.List[bytes]:
+    """ Read up to `sample_size` tweets from the inputs. """
+
+    lines = []
+    for path in inputs:
+        with tweetio.open_input(path) as input_fp:
+            for line in input_fp:
+                lines.append(line)
+                if len(lines) >= sample_size:
+                    return lines
+    return lines
+
+def measure_memory(lines: typing.List[bytes],
+                   generate: typing.Callable[[bytes], list]
+                   ) -> typing.Tuple[int, int]:
+    """ Measure the memory held by the records of a sample.
+
+    Returns:
+        A tuple of (number of records, bytes allocated for them). The parsed
+        tweets are freed once their records have been generated, so only
+        memory that the records keep alive is counted.
+    """
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    records = [generate(line) for line in lines]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (sum(len(tweet_records) for tweet_records in records),
+            after - before)
+
+def measure_generation(lines: typing.List[bytes],
+                       generate: typing.Callable[[bytes], list]) -> float:
+    """ Measure the throughput of generating records, in tweets per second. """
+
+    start = time.perf_counter()
+    for line in lines:
+        generate(line)
+    return len(lines) / (time.perf_counter() - start)
+
+def measure_import(lines: typing.List[bytes], batched: bool) -> float:
+    """ Measure the throughput of generating and inserting records into an
+    in-memory database, in tweets per second. """
+
+    db = sqlite3.connect(":memory:")
+    db.executescript(tweets_to_sqlite.SQL_INIT_SCHEMA)
+    start = time.perf_counter()
+    with db:
+        if batched:
+            with tweets_to_sqlite.BatchInserter(db) as inserter:
+                for line in lines:
+                    for record in tweets_to_sqlite.generate_records(line):
+                        inserter.add(record)
+        else:
+            for line in lines:
+                for record in generate_dict_records(line):
+                    record.insert_into(db)
+    elapsed = time.perf_counter() - start
+    db.close()
+    return len(lines) / elapsed
+
+if __name__ == "__main__":
+    #pylint: disable=invalid-name
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "inputs", nargs="+",
+        help="newline-delimited JSON files to take the sample from."
+    )
+    parser.add_argument(
+        "-s", "--sample-size", default=DEFAULT_SAMPLE_SIZE, type=int,
+        help="the number of tweets in the sample; default is {}."
+             .format(DEFAULT_SAMPLE_SIZE)
+    )
+    args = parser.parse_args()
+
+    sample = read_sample(args.inputs, args.sample_size)
+    print("sample: {} tweets".format(len(sample)))
+    print("{:<8} {:>10} {:>14} {:>16} {:>16}".format(
+        "records", "records", "bytes/record", "generate tw/s", "import tw/s"
+    ))
+    for (name, generate, batched) in [
+            ("dict", generate_dict_records, False),
+            ("tuple", tweets_to_sqlite.generate_records, True)
+        ]:
+        (n_records, size) = measure_memory(sample, generate)
+        print("{:<8} {:>10} {:>14.1f} {:>16.0f} {:>16.0f}".format(
+            name, n_records, size / n_records,
+            measure_generation(sample, generate),
+            measure_import(sample, batched)
+        ))
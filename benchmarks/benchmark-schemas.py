@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+""" Compare the schemas of tweets-to-sqlite.py (--schema) on a sample of
+tweets.
+
+The inputs are imported into a new database with each schema, which is then
+vacuumed so that its size doesn't depend on the order of inserts. For each
+schema, the import throughput, the size of the database and the latency of a
+set of queries are reported. The queries are written against the tables of
+the standard schema, which the other schemas expose as views, so that they
+measure what existing queries would see:
+
+* lang: the number of tweets per language;
+* hashtags: the 10 most common hashtags;
+* country: the number of places per country;
+* created_at: the number of tweets whose created_at matches a pattern, which
+  derives created_at for every tweet in the compact schema;
+* tweet: looking up tweets by ID; and
+* children: looking up the hashtags and URLs of tweets by ID.
+
+The lookups are repeated for `--lookups` random tweet IDs from the sample and
+their total is reported. Each query is run `--repeat` times and the fastest
+run is reported, so that the page cache is warm.
+"""
+
+import importlib.util
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import typing
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+# tweets-to-sqlite.py can't be imported by name because of the hyphens
+SPEC = importlib.util.spec_from_file_location(
+    "tweets_to_sqlite",
+    os.path.join(os.path.dirname(__file__), "..", "tweets-to-sqlite.py")
+)
+tweets_to_sqlite = importlib.util.module_from_spec(SPEC)
+SPEC.loader.exec_module(tweets_to_sqlite)
+
+DEFAULT_LOOKUPS = 1000
+DEFAULT_REPEAT = 3
+
+QUERIES = {
+    "lang": "SELECT lang, count(*) FROM tweets GROUP BY lang",
+    "hashtags": "SELECT text, count(*) AS n FROM hashtags GROUP BY text"
+                " ORDER BY n DESC LIMIT 10",
+    "country": "SELECT country, count(*) FROM places GROUP BY country",
+    "created_at": "SELECT count(*) FROM tweets WHERE created_at LIKE 'Mon %'"
+}
+
+LOOKUPS = {
+    "tweet": ["SELECT * FROM tweets WHERE id = ?"],
+    "children": [
+        "SELECT text FROM hashtags WHERE tweet_id = ?",
+        "SELECT url FROM urls WHERE tweet_id = ?"
+    ]
+}
+
+def import_sample(db_path: str,
+                  schema: str,
+                  inputs: typing.List[str]) -> float:
+    """ Import the inputs into a new database with a schema and vacuum it.
+
+    Returns:
+        The time spent importing, in seconds, not including the vacuum.
+    """
+
+    db = sqlite3.connect(db_path)
+    tweets_to_sqlite.init_schema(db, schema)
+    interner = (
+        tweets_to_sqlite.Interner(schema) if schema != "standard" else None
+    )
+    start = time.perf_counter()
+    for path in inputs:
+        tweets_to_sqlite.import_file(db, path, interner=interner)
+    seconds = time.perf_counter() - start
+    db.execute("VACUUM")
+    db.close()
+    return seconds
+
+def time_query(db: sqlite3.Connection,
+               statements: typing.List[str],
+               parameters: typing.List[tuple],
+               repeat: int) -> float:
+    """ Time running each statement with each set of parameters.
+
+    Returns:
+        The time of the fastest of `repeat` runs, in milliseconds.
+    """
+
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for values in parameters:
+            for statement in statements:
+                db.execute(statement, values).fetchall()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+def benchmark_schema(directory: str,
+                     schema: str,
+                     inputs: typing.List[str],
+                     lookups: int,
+                     repeat: int) -> typing.Dict[str, float]:
+    """ Import the inputs with a schema and time the queries on it.
+
+    Args:
+        directory: The directory to create the database in.
+        schema: The name of the schema; see `tweets_to_sqlite.SCHEMAS`.
+        inputs: The files to import.
+        lookups: The number of tweet IDs to look up.
+        repeat: The number of times to run each query.
+
+    Returns:
+        A dict containing the import time ("seconds"), the number of tweets
+        ("tweets"), the size of the database ("bytes") and the latency of each
+        query in `QUERIES` and `LOOKUPS`, in milliseconds.
+    """
+
+    db_path = os.path.join(directory, "{}.db".format(schema))
+    result = {"seconds": import_sample(db_path, schema, inputs)}
+    result["bytes"] = os.path.getsize(db_path)
+
+    db = sqlite3.connect(db_path)
+    tweet_ids = [row[0] for row in db.execute("SELECT id FROM tweets")]
+    result["tweets"] = len(tweet_ids)
+    # the same IDs are looked up in every schema
+    parameters = [
+        (tweet_id,)
+        for tweet_id in random.Random(0).sample(
+            sorted(tweet_ids), min(lookups, len(tweet_ids))
+        )
+    ]
+    for (name, sql) in QUERIES.items():
+        result[name] = time_query(db, [sql], [()], repeat)
+    for (name, statements) in LOOKUPS.items():
+        result[name] = time_query(db, statements, parameters, repeat)
+    db.close()
+    return result
+
+if __name__ == "__main__":
+    #pylint: disable=invalid-name
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "inputs", nargs="+",
+        help="newline-delimited JSON files to import."
+    )
+    parser.add_argument(
+        "-n", "--lookups", default=DEFAULT_LOOKUPS, type=int,
+        help="the number of tweet IDs to look up; default is {}."
+             .format(DEFAULT_LOOKUPS)
+    )
+    parser.add_argument(
+        "-r", "--repeat", default=DEFAULT_REPEAT, type=int,
+        help="the number of times to run each query; default is {}."
+             .format(DEFAULT_REPEAT)
+    )
+    parser.add_argument(
+        "-d", "--directory",
+        help="the directory to create the databases in; default is the"
+             " system's temporary directory. it needs room for one database"
+             " per schema."
+    )
+    args = parser.parse_args()
+
+    columns = list(QUERIES) + list(LOOKUPS)
+    print("query latencies in ms; lookups of {} tweet IDs".format(args.lookups))
+    print("{:<10} {:>10} {:>10}".format("schema", "tweets/s", "size MB")
+          + "".join(" {:>10}".format(column) for column in columns))
+    with tempfile.TemporaryDirectory(dir=args.directory) as directory:
+        for schema in tweets_to_sqlite.SCHEMAS:
+            result = benchmark_schema(
+                directory, schema, args.inputs, args.lookups, args.repeat
+            )
+            print("{:<10} {:>10.0f} {:>10.2f}".format(
+                schema, result["tweets"] / result["seconds"],
+                result["bytes"] / 1e6
+            ) + "".join(
+                " {:>10.1f}".format(result[column]) for column in columns
+            ))
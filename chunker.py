@@ -10,17 +10,83 @@ based on file name alone.
 """
 
 import abc
-import gzip
-import hashlib
+import array
+import bisect
+import collections
+import functools
+import heapq
 import json
+import math
 import multiprocessing
+import multiprocessing.pool
+import operator
 import os
+import queue
+import shutil
+import sys
+import tempfile
+import time
 import typing
+import zlib
 
 import tqdm
 
+import tweetio
+
 DEFAULT_CHUNKER_TEMPDIR = "geotweets-chunker-temp"
 
+# the maximum number of chunk files that a TweetChunker will keep open at once.
+# this should stay well below the open file limit (see `ulimit -n`), especially
+# when several jobs are running.
+DEFAULT_MAX_OPEN_FILES = 128
+
+# tweets are collected in a buffer for each chunk and written to the chunk
+# file in blocks. this is the size of a block, in bytes
+DEFAULT_WRITE_BUFFER_SIZE = 256 * 1024
+# if the buffers of all chunks together exceed this many bytes, all of them are
+# written out
+DEFAULT_MAX_BUFFERED_BYTES = 64 * 1024 * 1024
+
+# defaults for the shuffle mode; see `shuffle_tweets`. a batch holds up to this
+# many tweets bound for the same writer, and each writer's queue holds up to
+# this many batches.
+DEFAULT_SHUFFLE_BATCH_SIZE = 1000
+DEFAULT_SHUFFLE_QUEUE_SIZE = 16
+
+# defaults for deduplication with Bloom filters; see `BloomFilter`. with these
+# defaults, each chunk's filter takes about 1.8 MB
+DEFAULT_DEDUP_CAPACITY = 1000000
+DEFAULT_DEDUP_ERROR_RATE = 0.001
+
+# defaults for sorting chunks; see `sort_chunk`. the memory is the number of
+# bytes of tweets each process holds before spilling a sorted run to disk, and
+# the block size is the number of uncompressed bytes between entries of the
+# sparse ID index. each tweet held in memory also costs about this many bytes
+# of Python objects
+DEFAULT_SORT_MEMORY = 256 * 1024 * 1024
+DEFAULT_INDEX_BLOCK_SIZE = 1024 * 1024
+SORT_ENTRY_OVERHEAD = 100
+
+# defaults for GeohashChunker. cells of 3 characters are about 156 km by 156 km,
+# and cells of 6 characters about 1.2 km by 0.6 km. with splitting enabled,
+# cells holding more than this fraction of tweets are split
+DEFAULT_GEOHASH_PRECISION = 3
+DEFAULT_GEOHASH_MAX_PRECISION = 6
+DEFAULT_GEOHASH_SPLIT_FRACTION = 0.01
+DEFAULT_GEOHASH_SAMPLE_SIZE = 100000
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+# files written to the output directory to keep track of chunked inputs; see
+# `commit_run`
+STATE_NAME = "chunker-state.json"
+GEOHASH_SPLITS_NAME = "geohash-splits.json"
+JOURNAL_NAME = "chunker-journal.json"
+
+# extensions of chunk files written with each codec
+CHUNK_SUFFIXES = tuple(
+    ".json" + codec.suffix for codec in tweetio.CODECS.values()
+)
+
 def split_list(list_: list, n: int) -> list:
     """ Split a list into smaller lists.
 
@@ -41,84 +107,623 @@ def split_list(list_: list, n: int) -> list:
         for i in range(n)
     ]
 
+class SortedIdSet():
+    """ A compact, exact set of tweet IDs.
+
+    IDs are kept in a sorted array of 64-bit integers, using 8 bytes per ID
+    instead of the ~70 bytes per ID of a Python set. New IDs are collected in a
+    small set first, which is merged into the array once it reaches a fraction
+    of the array's size, so that the array is only rebuilt a logarithmic
+    number of times.
+
+    Attributes:
+        ids: The sorted array of IDs.
+        pending: The set of IDs not yet merged into the array.
+    """
+
+    # the smallest number of pending IDs that triggers a merge, and the
+    # fraction of the array's size above that
+    MIN_PENDING = 4096
+    PENDING_FRACTION = 8
+
+    def __init__(self):
+        """ Initialize SortedIdSet class. """
+
+        self.ids = array.array("q")
+        self.pending = set() # type: typing.Set[int]
+
+    def __len__(self):
+        return len(self.ids) + len(self.pending)
+
+    def add(self, tweet_id: int) -> bool:
+        """ Add an ID to the set.
+
+        Returns:
+            True if the ID was new, or False if it was already in the set.
+        """
+
+        if tweet_id in self.pending:
+            return False
+        index = bisect.bisect_left(self.ids, tweet_id)
+        if index < len(self.ids) and self.ids[index] == tweet_id:
+            return False
+
+        self.pending.add(tweet_id)
+        if len(self.pending) >= max(
+                self.MIN_PENDING, len(self.ids) // self.PENDING_FRACTION
+            ):
+            self.ids = array.array(
+                "q", heapq.merge(self.ids, sorted(self.pending))
+            )
+            self.pending.clear()
+        return True
+
+    def memory_usage(self) -> int:
+        """ Estimate the memory used by the set, in bytes. """
+
+        return self.ids.buffer_info()[1] * self.ids.itemsize \
+            + sys.getsizeof(self.pending)
+
+class BloomFilter():
+    """ A Bloom filter of tweet IDs, using a fixed amount of memory.
+
+    The filter is sized for an expected number of IDs and a false positive
+    rate. Once more IDs than expected have been added, the false positive rate
+    rises above the target. A false positive causes a tweet to be taken for a
+    duplicate and dropped.
+
+    Attributes:
+        size: The number of bits in the filter.
+        hashes: The number of bit positions set for each ID.
+        bits: The bits of the filter.
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        """ Initialize BloomFilter class.
+
+        Args:
+            capacity: The expected number of IDs.
+            error_rate: The target false positive rate once `capacity` IDs
+                have been added.
+        """
+
+        self.size = max(
+            8, int(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        )
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def add(self, tweet_id: int) -> bool:
+        """ Add an ID to the filter.
+
+        Returns:
+            True if the ID was new, or False if it was probably already in the
+            filter.
+        """
+
+        # derive all bit positions from two 64-bit hashes of the ID, using the
+        # finalizer of splitmix64, which is much faster than hashlib here
+        mixed = (tweet_id + 0x9e3779b97f4a7c15) & 0xffffffffffffffff
+        mixed = ((mixed ^ (mixed >> 30)) * 0xbf58476d1ce4e5b9) \
+            & 0xffffffffffffffff
+        mixed = ((mixed ^ (mixed >> 27)) * 0x94d049bb133111eb) \
+            & 0xffffffffffffffff
+        first = mixed ^ (mixed >> 31)
+        second = ((first * 0x9e3779b97f4a7c15) & 0xffffffffffffffff) | 1
+
+        new = False
+        bits = self.bits
+        size = self.size
+        for _ in range(self.hashes):
+            position = first % size
+            byte = position >> 3
+            mask = 1 << (position & 7)
+            if not bits[byte] & mask:
+                bits[byte] |= mask
+                new = True
+            first += second
+        return new
+
+    def memory_usage(self) -> int:
+        """ Get the memory used by the filter's bits, in bytes. """
+
+        return len(self.bits)
+
 class TweetChunker(abc.ABC):
     """ Abstract base class implementing chunking functionality.
 
+    Tweets are handled as raw bytes from start to finish: input files are read
+    in binary mode, and lines are collected, undecoded, in a write buffer for
+    each chunk. A chunk's buffer is written out as a single block once it
+    reaches `write_buffer_size` bytes, or once the buffers of all chunks
+    together reach `max_buffered_bytes`.
+
+    Chunk files are compressed with a `tweetio.Codec`, GZIP by default, and
+    are kept open between writes in a pool of writers. When the pool is full,
+    the least recently used chunk file is closed to make room; reopening it
+    later appends a new GZIP member (or zstd or LZ4 frame) to the file, which
+    is still read back as a single stream.
+
+    Subclasses may also implement `label_parsed_tweet`, which labels a tweet
+    that has already been parsed, so that several chunkers can share a single
+    parse (see CompositeChunker), and `fast_label_tweet`, which labels a tweet
+    by scanning its raw data instead of parsing it. If `fast_labels` is enabled,
+    it will be tried first, falling back to `label_tweet` whenever it cannot
+    label a tweet unambiguously.
+
+    Unless `collect_stats` is disabled, statistics about the tweets written to
+    each chunk are collected along the way and can be written to the manifest
+    of the output directory with `write_manifest`; see `tweetio.ChunkStats`.
+
+    If `dedup` is enabled, the IDs written to each chunk are remembered, either
+    exactly in a `SortedIdSet` or approximately in a `BloomFilter`, and tweets
+    whose IDs have already been written to their chunk are dropped. Since the
+    same tweet always gets the same label, this removes all duplicates, as long
+    as every tweet of a chunk goes through the same chunker.
+
     Attributes:
         output_directory: The directory where chunked files are being written.
-        output_file_pointers: A dict where keys are the paths of chunked output
-            files and values are open file pointers to those files.
+        fast_labels: If True, try `fast_label_tweet` before `label_tweet`.
+        fast_label_hits: The number of tweets labeled by `fast_label_tweet`.
+        fast_label_fallbacks: The number of tweets that `fast_label_tweet`
+            could not label, which were labeled by `label_tweet` instead.
+        sampler: The `tweetio.TweetSampler` of the tweets to chunk, or None
+            to chunk every tweet.
+        sampled_out: The number of tweets that were not in the sample.
+        write_buffers: A dict where keys are chunk labels and values are lists
+            of tweets waiting to be written to the corresponding chunk files.
+        write_buffer_sizes: A dict where keys are chunk labels and values are
+            the number of bytes in the corresponding write buffers.
+        buffered_bytes: The total number of bytes in all write buffers.
+        write_buffer_size: The size of a chunk's write buffer, in bytes, at
+            which it is written to the chunk file.
+        max_buffered_bytes: The total size of all write buffers, in bytes, at
+            which all of them are written to their chunk files.
+        output_file_pointers: An OrderedDict where keys are chunk labels and
+            values are open file pointers to the corresponding chunk files,
+            ordered from least to most recently used.
+        max_open_files: The maximum number of chunk files to keep open.
+        pool_hits: The number of blocks written to a chunk file that was
+            already open.
+        pool_misses: The number of blocks whose writing required opening a
+            chunk file.
+        pool_evictions: The number of chunk files closed to make room for
+            another chunk file.
+        codec: The `tweetio.Codec` used to compress chunk files.
+        compression_level: The compression level, or None for the codec's
+            default.
+        compression_threads: The number of extra threads that each chunk file
+            is compressed with, if the codec supports it.
+        collect_stats: If True, collect statistics about written tweets.
+        dedup: "exact" or "bloom" to drop duplicate tweets, or None.
+        dedup_capacity: The expected number of tweets per chunk that Bloom
+            filters are sized for.
+        dedup_error_rate: The target false positive rate of Bloom filters.
+        seen_ids: A dict where keys are chunk labels and values are the
+            `SortedIdSet`s or `BloomFilter`s of the IDs written to them.
+        duplicates: A dict where keys are chunk labels and values are the
+            number of duplicate tweets dropped from them.
+        chunk_stats: A dict where keys are chunk labels and values are
+            `tweetio.ChunkStats` of the tweets written to the corresponding
+            chunk files.
     """
 
-    def __init__(self, output_directory: str):
+    def __init__(self,
+                 output_directory: str,
+                 max_open_files: int = DEFAULT_MAX_OPEN_FILES,
+                 fast_labels: bool = False,
+                 write_buffer_size: int = DEFAULT_WRITE_BUFFER_SIZE,
+                 max_buffered_bytes: int = DEFAULT_MAX_BUFFERED_BYTES,
+                 codec: str = "gzip",
+                 compression_level: int = None,
+                 compression_threads: int = 0,
+                 collect_stats: bool = True,
+                 dedup: str = None,
+                 dedup_capacity: int = DEFAULT_DEDUP_CAPACITY,
+                 dedup_error_rate: float = DEFAULT_DEDUP_ERROR_RATE,
+                 sampler: tweetio.TweetSampler = None):
         """ Initializes TweetChunker class.
 
         Args:
             output_directory: The directory where chunked files should be
                 written to.
+            max_open_files: The maximum number of chunk files to keep open at
+                once.
+            fast_labels: If True, label tweets with `fast_label_tweet` when
+                possible.
+            write_buffer_size: The size of a chunk's write buffer, in bytes,
+                at which it is written to the chunk file.
+            max_buffered_bytes: The total size of all write buffers, in bytes,
+                at which all of them are written to their chunk files.
+            codec: The name of the codec to compress chunk files with; see
+                `tweetio.get_codec`.
+            compression_level: The compression level, or None for the
+                codec's default.
+            compression_threads: The number of extra threads to compress each
+                chunk file with, or -1 for one per CPU, if the codec supports
+                it.
+            collect_stats: If True, collect statistics about the tweets
+                written to each chunk for the manifest.
+            dedup: If "exact" or "bloom", drop tweets whose IDs were already
+                written to their chunk, remembering IDs in a `SortedIdSet` or
+                in a `BloomFilter` respectively.
+            dedup_capacity: The number of tweets per chunk that Bloom filters
+                are sized for.
+            dedup_error_rate: The false positive rate that Bloom filters are
+                sized for.
+            sampler: If given, only tweets in this sample are chunked. Tweets
+                are sampled before they are labeled, usually without parsing
+                them.
         """
 
+        if max_open_files < 1:
+            raise ValueError("max_open_files must be at least 1")
+        if dedup not in (None, "exact", "bloom"):
+            raise ValueError("dedup must be None, \"exact\" or \"bloom\"")
+
         self.output_directory = output_directory
+        self.fast_labels = fast_labels
+        self.fast_label_hits = 0
+        self.fast_label_fallbacks = 0
+        self.write_buffers = {} # type: typing.Dict[str, typing.List[bytes]]
+        self.write_buffer_sizes = {} # type: typing.Dict[str, int]
+        self.buffered_bytes = 0
+        self.write_buffer_size = write_buffer_size
+        self.max_buffered_bytes = max_buffered_bytes
+        self.output_file_pointers = collections.OrderedDict()
+        self.max_open_files = max_open_files
+        self.codec = tweetio.get_codec(codec)
+        self.compression_level = compression_level
+        self.compression_threads = compression_threads
+
+        self.pool_hits = 0
+        self.pool_misses = 0
+        self.pool_evictions = 0
+
+        self.collect_stats = collect_stats
+        self.chunk_stats = {} # type: typing.Dict[str, tweetio.ChunkStats]
+
+        self.dedup = dedup
+        self.dedup_capacity = dedup_capacity
+        self.dedup_error_rate = dedup_error_rate
+        self.seen_ids = {} # type: typing.Dict[str, typing.Any]
+        self.duplicates = {} # type: typing.Dict[str, int]
+
+        self.sampler = sampler
+        self.sampled_out = 0
 
         if not os.path.isdir(output_directory):
             os.makedirs(output_directory)
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
     @abc.abstractmethod
-    def label_tweet(self, tweet_str: str) -> str:
+    def label_tweet(self, tweet_str: bytes) -> str:
         """ Generate a chunk label to which a tweet will be assigned. All
         tweets with the same chunk label will be grouped into the same output
         file.
 
         Args:
-            tweet_str: A string containing a JSON of a single tweet's data.
+            tweet_str: The raw, undecoded JSON of a single tweet's data, which
+                can be passed directly to `json.loads`.
+        """
+
+    def label_parsed_tweet(self, tweet: dict) -> str:
+        """ Generate a chunk label for a tweet that has already been parsed.
+
+        Implementations must return the same label as `label_tweet`. The
+        default implementation raises NotImplementedError; see
+        `labels_parsed_tweets`.
+
+        Args:
+            tweet: The parsed JSON data of a single tweet.
+        """
+
+        raise NotImplementedError
+
+    def labels_parsed_tweets(self) -> bool:
+        """ Check if this chunker implements `label_parsed_tweet`. """
+
+        return type(self).label_parsed_tweet \
+            is not TweetChunker.label_parsed_tweet
+
+    def fast_label_tweet(self,
+                         tweet_bytes: bytes) -> typing.Optional[str]:
+        """ Generate a chunk label without parsing the tweet.
+
+        Implementations must return the same label as `label_tweet`, or None
+        if that cannot be guaranteed, e.g. because the relevant field could not
+        be found unambiguously. The default implementation always returns None.
+
+        Args:
+            tweet_bytes: The raw JSON data of a single tweet.
+        """
+        #pylint: disable=no-self-use,unused-argument
+
+        return None
+
+    def get_label(self, tweet_str: bytes) -> str:
+        """ Label a tweet, using `fast_label_tweet` if enabled and possible,
+        and `label_tweet` otherwise.
+
+        Args:
+            tweet_str: The raw JSON data of a single tweet.
+        """
+
+        if self.fast_labels:
+            label = self.fast_label_tweet(tweet_str)
+            if label is not None:
+                self.fast_label_hits += 1
+                return label
+            self.fast_label_fallbacks += 1
+
+        return self.label_tweet(tweet_str)
+
+    def verify_fast_labels(self,
+                           tweet_strs: typing.Iterable[bytes]
+                           ) -> typing.Dict[str, typing.Any]:
+        """ Check that `fast_label_tweet` agrees with `label_tweet`.
+
+        Args:
+            tweet_strs: A sample of tweets to check.
+
+        Returns:
+            A dict containing the number of tweets checked, the number that
+            were labeled by `fast_label_tweet`, and a list of mismatches, each
+            a tuple of (tweet, fast label, label).
+        """
+
+        (checked, labeled, mismatches) = (0, 0, [])
+        for tweet_str in tweet_strs:
+            checked += 1
+            fast_label = self.fast_label_tweet(tweet_str)
+            if fast_label is None:
+                continue
+            labeled += 1
+            label = self.label_tweet(tweet_str)
+            if fast_label != label:
+                mismatches.append((tweet_str, fast_label, label))
+
+        return {"checked": checked, "labeled": labeled, "mismatches": mismatches}
+
+    def chunk_filename(self, label: str) -> str:
+        """ Get the path of the chunk file with the given label, relative to
+        the output directory. """
+
+        return label + ".json" + self.codec.suffix
+
+    def get_output_fp(self, label: str) -> typing.BinaryIO:
+        """ Get an open file pointer to the chunk file with the given label.
+
+        If the chunk file is not already open, it will be opened in append
+        mode, closing the least recently used chunk file first if the pool is
+        full.
+
+        Args:
+            label: The label of the chunk.
+
+        Returns:
+            A writable file pointer to the chunk file.
+        """
+
+        try:
+            output_fp = self.output_file_pointers[label]
+            self.output_file_pointers.move_to_end(label)
+            self.pool_hits += 1
+            return output_fp
+        except KeyError:
+            self.pool_misses += 1
+
+        if len(self.output_file_pointers) >= self.max_open_files:
+            (_, evicted_fp) = self.output_file_pointers.popitem(last=False)
+            evicted_fp.close()
+            self.pool_evictions += 1
+
+        path = os.path.join(self.output_directory, self.chunk_filename(label))
+        if os.sep in label:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        output_fp = self.codec.open(
+            path, "ab", self.compression_level, self.compression_threads
+        )
+        self.output_file_pointers[label] = output_fp
+        return output_fp
+
+    def get_chunk_stats(self, label: str) -> tweetio.ChunkStats:
+        """ Get the statistics of a chunk that have not been written to the
+        manifest yet. """
+
+        try:
+            return self.chunk_stats[label]
+        except KeyError:
+            stats = self.chunk_stats[label] = tweetio.ChunkStats()
+            return stats
+
+    def is_duplicate(self, label: str, tweet_id: int) -> bool:
+        """ Check if a tweet ID was already written to a chunk, remembering it
+        otherwise. """
+
+        try:
+            seen = self.seen_ids[label]
+        except KeyError:
+            if self.dedup == "bloom":
+                seen = BloomFilter(self.dedup_capacity, self.dedup_error_rate)
+            else:
+                seen = SortedIdSet()
+            self.seen_ids[label] = seen
+        return not seen.add(tweet_id)
+
+    def write_tweet(self, label: str, tweet_str: bytes) -> None:
+        """ Add a tweet to the write buffer of a chunk, writing out buffers as
+        necessary. Duplicates are dropped here if `dedup` is enabled.
+
+        Args:
+            label: The label of the chunk.
+            tweet_str: The raw JSON data of a single tweet, ending in a newline.
+        """
+
+        if self.collect_stats or self.dedup:
+            tweet_stats = tweetio.scan_tweet_stats(tweet_str)
+            if self.dedup and tweet_stats[0] is not None \
+                    and self.is_duplicate(label, tweet_stats[0]):
+                self.duplicates[label] = self.duplicates.get(label, 0) + 1
+                if self.collect_stats:
+                    self.get_chunk_stats(label).duplicates += 1
+                return
+            if self.collect_stats:
+                self.get_chunk_stats(label).add(len(tweet_str), *tweet_stats)
+
+        try:
+            self.write_buffers[label].append(tweet_str)
+            self.write_buffer_sizes[label] += len(tweet_str)
+        except KeyError:
+            self.write_buffers[label] = [tweet_str]
+            self.write_buffer_sizes[label] = len(tweet_str)
+        self.buffered_bytes += len(tweet_str)
+
+        if self.write_buffer_sizes[label] >= self.write_buffer_size:
+            self.flush_buffer(label)
+        elif self.buffered_bytes >= self.max_buffered_bytes:
+            self.flush()
+
+    def flush_buffer(self, label: str) -> None:
+        """ Write out the write buffer of a chunk as a single block.
+
+        Args:
+            label: The label of the chunk.
+        """
+
+        buffer = self.write_buffers.pop(label, None)
+        if buffer:
+            self.get_output_fp(label).write(b"".join(buffer))
+            self.buffered_bytes -= self.write_buffer_sizes.pop(label)
+
+    def flush(self) -> None:
+        """ Write out the write buffers of all chunks. """
+
+        for label in list(self.write_buffers):
+            self.flush_buffer(label)
+
+    def close(self) -> None:
+        """ Flush all write buffers and close all open chunk files. """
+
+        self.flush()
+        while self.output_file_pointers:
+            (_, output_fp) = self.output_file_pointers.popitem(last=False)
+            output_fp.close()
+
+    def write_manifest(self) -> None:
+        """ Add the statistics collected so far to the manifest of the output
+        directory, then reset them. The chunker should be closed first, so
+        that the sizes of the chunk files are final. """
+
+        if self.chunk_stats:
+            tweetio.update_manifest(self.output_directory, {
+                self.chunk_filename(label): stats
+                for (label, stats) in self.chunk_stats.items()
+            })
+            self.chunk_stats = {}
+
+    def dedup_memory_usage(self) -> int:
+        """ Get the memory used to remember the IDs written to chunks, in
+        bytes. """
+
+        return sum(seen.memory_usage() for seen in self.seen_ids.values())
+
+    def pool_stats(self) -> typing.Dict[str, float]:
+        """ Summarize how well the pool of open chunk files is working.
+
+        Returns:
+            A dict containing the number of hits, misses, and evictions, as
+            well as the hit rate (the fraction of writes that went to an
+            already-open chunk file) and the eviction rate (the fraction of
+            writes that caused another chunk file to be closed).
         """
 
-    def import_tweet_str(self, tweet_str: str) -> None:
+        writes = self.pool_hits + self.pool_misses
+        return {
+            "hits": self.pool_hits,
+            "misses": self.pool_misses,
+            "evictions": self.pool_evictions,
+            "hit_rate": self.pool_hits / writes if writes else 0.0,
+            "eviction_rate": self.pool_evictions / writes if writes else 0.0
+        }
+
+    def import_tweet_str(self, tweet_str: typing.Union[str, bytes]) -> None:
         """ Import a tweet.
 
         This function will "import" a tweet by using self.label_tweet to
-        generate a chunk label and redirecting it to the appropriate chunk file
-        pointer, opening a new one if necessary.
+        generate a chunk label and adding it to the write buffer of that chunk.
 
         Args:
-            tweet_str: A street containing a JSON of a single tweet's data.
+            tweet_str: The JSON of a single tweet's data. Strings are encoded
+                as UTF-8; bytes are used as they are.
         """
 
-        label = self.label_tweet(tweet_str)
+        if isinstance(tweet_str, str):
+            tweet_str = tweet_str.encode("utf-8")
+        if not tweet_str.endswith(b"\n"):
+            tweet_str += b"\n"
+
+        if self.in_sample(tweet_str):
+            self.write_tweet(self.get_label(tweet_str), tweet_str)
 
-        with gzip.open(
-                os.path.join(self.output_directory, label + ".json.gz"), "a"
-            ) as output_fp:
-            output_fp.write(tweet_str)
+    def in_sample(self, tweet_str: bytes) -> bool:
+        """ Check if a tweet is in the sample being chunked, counting the
+        tweets that are not. """
+
+        if self.sampler is None or self.sampler.keeps_raw(tweet_str):
+            return True
+        self.sampled_out += 1
+        return False
 
     def import_file(self,
                     path: str,
-                    compressed: bool = True,
-                    verbose: bool = True) -> None:
-        """ Import a file.
+                    compressed: bool = None,
+                    verbose: bool = True,
+                    close: bool = True,
+                    start: int = 0,
+                    end: int = None) -> None:
+        """ Import a file, or a range of a file.
 
-        This function is a small wrapper around `self.import_tweet_str`.
+        This function is a small wrapper around `self.import_tweet_str`. The
+        file is always read in binary mode.
 
         Args:
             path: A newline-delimited JSON file containing tweet data.
-            compressed: A bool describing if GZIP compression was used.
+            compressed: A bool describing if GZIP compression was used. If
+                None, files ending in .gz are assumed to be compressed.
             verbose: A bool describing if tqdm should be used to give progress.
+            close: If True, flush and close all chunk files once the file has
+                been imported. If False, they are left open so that they can be
+                reused when importing the next file; `self.close` must then be
+                called when done.
+            start: The start of the range of uncompressed bytes to import; see
+                `tweetio.read_range`.
+            end: The end of the range of uncompressed bytes to import, or None
+                for the end of the file.
         """
 
-        if compressed:
-            input_fp = gzip.open(path, "r")
+        if start == 0 and end is None:
+            input_fp = tweetio.open_input(path, compressed)
         else:
-            input_fp = open(path, "r")
+            input_fp = tweetio.read_range(path, start, end)
 
         if verbose:
             iterator = tqdm.tqdm(input_fp, 0)
         else:
             iterator = input_fp
 
-        for tweet_str in iterator:
-            self.import_tweet_str(tweet_str)
-
-        input_fp.close()
+        try:
+            for tweet_str in iterator:
+                self.import_tweet_str(tweet_str)
+        finally:
+            input_fp.close()
+            if close:
+                self.close()
 
 class CalendarDayChunker(TweetChunker):
     """ Subclass of TweetChunker implementing chunking based on calendar day,
@@ -131,27 +736,50 @@ class CalendarDayChunker(TweetChunker):
         "Nov": "11", "Dec": "12"
     }
 
-    def __init__(self, output_directory):
+    def __init__(self, output_directory, **kwargs):
         """ Initializes CalendarDayChunker class.
 
         Args:
             output_directory: The directory where chunked files should be
                 written to.
+            **kwargs: Passed to TweetChunker.
         """
 
-        TweetChunker.__init__(self, output_directory)
+        TweetChunker.__init__(self, output_directory, **kwargs)
 
-    def label_tweet(self, tweet_str: str) -> str:
-        """ Create an ISO datetime string string (YYYY-MM-DD) by parsing the
+    def created_at_to_label(self, created_at: str) -> str:
+        """ Create an ISO datetime string string (YYYY-MM-DD) from a
         created_at attribute. We do not need to use a datetime object because
         we only need a year-month-day string. """
 
-        tweet = json.loads(tweet_str)
-        date_parts = tweet["created_at"].split()
+        date_parts = created_at.split()
         return "-".join([
             date_parts[-1], self.MONTHS[date_parts[1]], date_parts[2]
         ])
 
+    def label_tweet(self, tweet_str: bytes) -> str:
+        """ Label a tweet by parsing the created_at attribute. """
+
+        return self.label_parsed_tweet(json.loads(tweet_str))
+
+    def label_parsed_tweet(self, tweet: dict) -> str:
+        """ Label a parsed tweet using its created_at attribute. """
+
+        return self.created_at_to_label(tweet["created_at"])
+
+    def fast_label_tweet(self, tweet_bytes: bytes) -> typing.Optional[str]:
+        """ Label a tweet by finding the top-level created_at attribute. """
+
+        match = tweetio.find_top_level_key(
+            tweetio.CREATED_AT_PATTERN, tweet_bytes
+        )
+        if match is None:
+            return None
+        try:
+            return self.created_at_to_label(match.group(1).decode("ascii"))
+        except (IndexError, KeyError, UnicodeDecodeError):
+            return None
+
 class UserIdMd5Chunker(TweetChunker):
     """ Subclass of TweetChunker implementing user-level chunking by truncating
     the MD5 hash of a user ID. This assumes that truncated MD5 hashes are
@@ -159,7 +787,7 @@ class UserIdMd5Chunker(TweetChunker):
     order to ensure roughly equal distribution of users among chunks.
     """
 
-    def __init__(self, output_directory, length: int = 2):
+    def __init__(self, output_directory, length: int = 2, **kwargs):
         """ Initializes UserIdMd5Chunker class.
 
         Additional args:
@@ -168,32 +796,367 @@ class UserIdMd5Chunker(TweetChunker):
             length: The number of characters to truncate the MD5 hex digest
                 to. Because hexadecimal strings have 16 characters, the total
                 number of output files will be equal to 16^(length).
+            **kwargs: Passed to TweetChunker.
         """
 
-        TweetChunker.__init__(self, output_directory)
+        TweetChunker.__init__(self, output_directory, **kwargs)
         self.length = length
 
-    def label_tweet(self, tweet_str: str) -> str:
-        """ Create an ISO datetime string string (YYYY-MM-DD) by parsing the
-        created_at attribute. We do not need to use a datetime object because
-        we only need a year-month-day string. """
+    def user_id_to_label(self, user_id: int) -> str:
+        """ Truncate the MD5 hash of a user ID. """
 
-        tweet = json.loads(tweet_str)
+        return tweetio.md5_id(user_id).hexdigest()[:self.length]
+
+    def label_tweet(self, tweet_str: bytes) -> str:
+        """ Label a tweet by parsing the user.id attribute. """
+
+        return self.label_parsed_tweet(json.loads(tweet_str))
+
+    def label_parsed_tweet(self, tweet: dict) -> str:
+        """ Label a parsed tweet using its user.id attribute. """
 
         user_id = tweet["user"]["id"]
         if type(user_id) is dict:
             user_id = user_id["$numberLong"]
 
-        md5 = hashlib.md5()
-        md5.update(int(user_id).to_bytes(
-                length=8, byteorder="big", signed=False
-        ))
-        return md5.hexdigest()[:self.length]
+        return self.user_id_to_label(user_id)
+
+    def fast_label_tweet(self, tweet_bytes: bytes) -> typing.Optional[str]:
+        """ Label a tweet by finding the user.id attribute of the top-level
+        user object. """
+
+        match = tweetio.find_top_level_key(
+            tweetio.USER_ID_PATTERN, tweet_bytes
+        )
+        if match is None or match.group(1) is None:
+            return None
+        return self.user_id_to_label(int(match.group(1)))
+
+class GeohashChunker(TweetChunker):
+    """ Subclass of TweetChunker implementing spatial chunking by geohash,
+    e.g. 9q8.json.gz. Tweets are located by their coordinates, or by the
+    center of their place's bounding box if they have none; tweets with
+    neither are put in unlocated.json.gz. Dense cells can be split into
+    longer geohashes, e.g. 9q8 into 9q8y, 9q8z, etc., so that chunks stay
+    balanced; see `plan_geohash_splits`.
+    """
+
+    UNLOCATED_LABEL = "unlocated"
+
+    def __init__(self,
+                 output_directory,
+                 precision: int = DEFAULT_GEOHASH_PRECISION,
+                 max_precision: int = DEFAULT_GEOHASH_MAX_PRECISION,
+                 splits: typing.Iterable[str] = (),
+                 **kwargs):
+        """ Initializes GeohashChunker class.
+
+        Additional args:
+            output_directory: The directory where chunked files should be
+                written to.
+            precision: The length of the geohashes used as labels. Each
+                additional character divides cells into 32 smaller cells;
+                cells of 3 characters are about 156 km by 156 km.
+            max_precision: The length that geohashes can be split up to.
+            splits: Geohashes of cells that are split into 32 smaller cells
+                instead of being used as labels.
+            **kwargs: Passed to TweetChunker.
+        """
+
+        if not 1 <= precision <= max_precision:
+            raise ValueError("precision must be between 1 and max_precision")
+
+        TweetChunker.__init__(self, output_directory, **kwargs)
+        self.precision = precision
+        self.max_precision = max_precision
+        self.splits = frozenset(splits)
+
+    def point_to_label(self, lon: float, lat: float) -> str:
+        """ Find the label of the cell containing a point, following splits
+        down to the smallest cell. """
+
+        geohash = encode_geohash(lon, lat, self.max_precision)
+        length = self.precision
+        while length < self.max_precision and geohash[:length] in self.splits:
+            length += 1
+        return geohash[:length]
+
+    def label_tweet(self, tweet_str: bytes) -> str:
+        """ Label a tweet by parsing its coordinates or place. """
+
+        return self.label_parsed_tweet(json.loads(tweet_str))
+
+    def label_parsed_tweet(self, tweet: dict) -> str:
+        """ Label a parsed tweet using its coordinates or place. """
+
+        point = tweet_point(tweet)
+        if point is None:
+            return self.UNLOCATED_LABEL
+        return self.point_to_label(*point)
+
+    def fast_label_tweet(self, tweet_bytes: bytes) -> typing.Optional[str]:
+        """ Label a tweet by finding its top-level coordinates. Tweets without
+        coordinates are left to be labeled by their place. """
+
+        match = tweetio.find_coordinates(tweet_bytes)
+        if match is None or match.group(1) is None:
+            return None
+        try:
+            return self.point_to_label(
+                float(match.group(1)), float(match.group(2))
+            )
+        except ValueError:
+            return None
+
+def encode_geohash(lon: float, lat: float, precision: int) -> str:
+    """ Encode a point as a geohash.
+
+    Args:
+        lon: The longitude of the point.
+        lat: The latitude of the point.
+        precision: The number of characters of the geohash.
+
+    Returns:
+        The geohash.
+    """
+
+    (lon_min, lon_max) = (-180.0, 180.0)
+    (lat_min, lat_max) = (-90.0, 90.0)
+    characters = []
+    value = 0
+    bits = 0
+    even = True
+    while len(characters) < precision:
+        # bits alternate between longitude and latitude, starting with
+        # longitude
+        if even:
+            middle = (lon_min + lon_max) / 2
+            if lon >= middle:
+                value = value << 1 | 1
+                lon_min = middle
+            else:
+                value <<= 1
+                lon_max = middle
+        else:
+            middle = (lat_min + lat_max) / 2
+            if lat >= middle:
+                value = value << 1 | 1
+                lat_min = middle
+            else:
+                value <<= 1
+                lat_max = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            characters.append(GEOHASH_ALPHABET[value])
+            value = 0
+            bits = 0
+    return "".join(characters)
+
+def tweet_point(tweet: dict) -> typing.Optional[typing.Tuple[float, float]]:
+    """ Locate a parsed tweet by its coordinates, or by the center of its
+    place's bounding box if it has none.
+
+    Args:
+        tweet: The parsed JSON data of a tweet.
+
+    Returns:
+        A tuple of (longitude, latitude), or None if the tweet has neither
+        coordinates nor a place.
+    """
+
+    try:
+        (lon, lat) = tweet["coordinates"]["coordinates"][:2]
+        return (float(lon), float(lat))
+    except (KeyError, TypeError, ValueError):
+        pass
+
+    try:
+        ring = tweet["place"]["bounding_box"]["coordinates"][0]
+        lons = [float(point[0]) for point in ring]
+        lats = [float(point[1]) for point in ring]
+        return ((min(lons) + max(lons)) / 2, (min(lats) + max(lats)) / 2)
+    except (KeyError, TypeError, ValueError, IndexError):
+        return None
+
+def plan_geohash_splits(tweet_strs: typing.Iterable[bytes],
+                        precision: int = DEFAULT_GEOHASH_PRECISION,
+                        max_precision: int = DEFAULT_GEOHASH_MAX_PRECISION,
+                        max_fraction: float = DEFAULT_GEOHASH_SPLIT_FRACTION
+                        ) -> typing.List[str]:
+    """ Decide which geohash cells to split, based on a sample of tweets.
+
+    A cell is split if it holds more than `max_fraction` of the sample, and
+    the resulting cells are split in the same way, until no cell holds more
+    than `max_fraction` of the sample or cells reach `max_precision`.
+
+    Args:
+        tweet_strs: A sample of raw tweets, e.g. from `read_sample`.
+        precision: The length of geohashes before splitting.
+        max_precision: The length that geohashes can be split up to.
+        max_fraction: The largest fraction of tweets that a cell may hold
+            without being split.
+
+    Returns:
+        The sorted geohashes of the cells to split, to be passed to
+        GeohashChunker.
+    """
+
+    counts = collections.Counter() # type: typing.Counter[str]
+    located = 0
+    for tweet_str in tweet_strs:
+        point = tweet_point(json.loads(tweet_str))
+        if point is None:
+            continue
+        located += 1
+        geohash = encode_geohash(point[0], point[1], max_precision)
+        for length in range(precision, max_precision):
+            counts[geohash[:length]] += 1
+
+    threshold = max_fraction * located
+    splits = []
+    cells = [
+        cell for (cell, count) in counts.items()
+        if len(cell) == precision and count > threshold
+    ]
+    while cells:
+        cell = cells.pop()
+        splits.append(cell)
+        cells.extend(
+            cell + character for character in GEOHASH_ALPHABET
+            if counts.get(cell + character, 0) > threshold
+        )
+    return sorted(splits)
+
+class CompositeChunker(TweetChunker):
+    """ Subclass of TweetChunker combining several other chunkers into nested
+    chunks in a single pass, e.g. CalendarDayChunker and UserIdMd5Chunker into
+    2020-01-02/3f.json.gz. Each tweet is parsed at most once, and the parsed
+    tweet is shared by all of the combined chunkers.
+    """
+
+    def __init__(self,
+                 output_directory,
+                 components: typing.List[typing.Union[
+                     TweetChunker,
+                     typing.Type[TweetChunker],
+                     typing.Tuple[typing.Type[TweetChunker], dict]
+                 ]],
+                 **kwargs):
+        """ Initializes CompositeChunker class.
+
+        Additional args:
+            output_directory: The directory where chunked files should be
+                written to.
+            components: The chunkers to combine, from the outermost to the
+                innermost level of nesting. Classes are initialized with
+                their default arguments, and (class, kwargs) tuples with the
+                given keyword arguments; instances are used as they are, for
+                labeling only.
+            **kwargs: Passed to TweetChunker.
+        """
+
+        if not components:
+            raise ValueError("at least one component chunker is required")
+
+        TweetChunker.__init__(self, output_directory, **kwargs)
+        self.components = []
+        for component in components:
+            if isinstance(component, tuple):
+                (component_class, component_kwargs) = component
+                component = component_class(
+                    output_directory, **component_kwargs
+                )
+            elif not isinstance(component, TweetChunker):
+                component = component(output_directory)
+            self.components.append(component)
+
+        # the function labeling tweets with each component, and whether it
+        # takes the shared parsed tweet or the raw tweet
+        self.labelers = [
+            (component.label_parsed_tweet, True)
+            if component.labels_parsed_tweets()
+            else (component.label_tweet, False)
+            for component in self.components
+        ] # type: typing.List[typing.Tuple[typing.Callable, bool]]
+
+    def label_component(self,
+                        index: int,
+                        tweet_str: bytes,
+                        tweet: dict) -> str:
+        """ Label a tweet with the component at the given index, using the
+        shared parsed tweet unless the component can only label raw
+        tweets. """
+
+        (labeler, parsed) = self.labelers[index]
+        return labeler(tweet if parsed else tweet_str)
+
+    def label_tweet(self, tweet_str: bytes) -> str:
+        """ Label a tweet with every component, parsing it once. """
+
+        tweet = json.loads(tweet_str)
+        return os.path.join(*[
+            self.label_component(index, tweet_str, tweet)
+            for index in range(len(self.components))
+        ])
+
+    def label_parsed_tweet(self, tweet: dict) -> str:
+        """ Label a parsed tweet with every component, if all of the
+        components implement `label_parsed_tweet`. """
+
+        if not self.labels_parsed_tweets():
+            raise NotImplementedError
+        return os.path.join(*[
+            labeler(tweet) for (labeler, _) in self.labelers
+        ])
+
+    def labels_parsed_tweets(self) -> bool:
+        """ Check if every component implements `label_parsed_tweet`. """
+
+        return all(parsed for (_, parsed) in self.labelers)
+
+    def fast_label_tweet(self, tweet_bytes: bytes) -> typing.Optional[str]:
+        """ Label a tweet with every component without parsing it, if all of
+        the components can do so. """
+
+        labels = []
+        for component in self.components:
+            label = component.fast_label_tweet(tweet_bytes)
+            if label is None:
+                return None
+            labels.append(label)
+        return os.path.join(*labels)
+
+    def get_label(self, tweet_str: bytes) -> str:
+        """ Label a tweet with every component, using `fast_label_tweet` for
+        each component if enabled and possible. The tweet is only parsed if
+        some component cannot label it without parsing, and then only once. """
+
+        labels = []
+        tweet = None
+        for (index, component) in enumerate(self.components):
+            label = None
+            if self.fast_labels:
+                label = component.fast_label_tweet(tweet_str)
+            if label is None:
+                if tweet is None:
+                    tweet = json.loads(tweet_str)
+                label = self.label_component(index, tweet_str, tweet)
+            labels.append(label)
+
+        if self.fast_labels:
+            if tweet is None:
+                self.fast_label_hits += 1
+            else:
+                self.fast_label_fallbacks += 1
+
+        return os.path.join(*labels)
 
 def chunk_tweets(inputs: typing.List[str],
                  output_directory: str,
                  job_number: int = None,
-                 chunker: typing.Type[TweetChunker] = CalendarDayChunker
+                 chunker: typing.Type[TweetChunker] = CalendarDayChunker,
+                 chunker_kwargs: dict = None
                  ) -> str:
     """ Chunk tweets into files by date.
 
@@ -207,9 +1170,12 @@ def chunk_tweets(inputs: typing.List[str],
         output_directory: The directory to save chunked files to.
         job_number: The ID of this job. If given, labels the progress bar with
             that job number and displays the bar in that position.
+        chunker: The TweetChunker subclass to use.
+        chunker_kwargs: Additional keyword arguments used to initialize the
+            chunker, e.g. max_open_files.
     """
 
-    chunker_obj = chunker(output_directory)
+    chunker_obj = chunker(output_directory, **(chunker_kwargs or {}))
 
     if job_number is not None:
         iterator = tqdm.tqdm(
@@ -219,15 +1185,640 @@ def chunk_tweets(inputs: typing.List[str],
     else:
         iterator = tqdm.tqdm(inputs, unit="file")
 
-    for path in iterator:
-        chunker_obj.import_file(path, verbose=False)
+    with chunker_obj:
+        for path in iterator:
+            chunker_obj.import_file(path, verbose=False, close=False)
     iterator.close()
+    chunker_obj.write_manifest()
+
+    report_chunker_stats(chunker_obj, job_number)
 
     return chunker_obj.output_directory
 
+def order_by_size(inputs: typing.List[str]) -> typing.List[str]:
+    """ Order files by their size on disk, largest first.
+
+    Processing the largest files first keeps a single large file from being
+    started last, when all other jobs are about to run out of work.
+
+    Args:
+        inputs: A list of files.
+
+    Returns:
+        A new list containing the same files.
+    """
+
+    return sorted(inputs, key=os.path.getsize, reverse=True)
+
+def schedule_inputs(inputs: typing.List[str],
+                    split_size: int = None
+                    ) -> typing.List[tweetio.InputRange]:
+    """ Turn files into units of work for jobs, largest first.
+
+    Args:
+        inputs: A list of files.
+        split_size: If given, files larger than this many bytes on disk are
+            split into ranges of roughly this size, so that several jobs can
+            work on the same file at once. GZIP files are indexed first; see
+            `tweetio.split_input`.
+
+    Returns:
+        A list of ranges covering all of the files, ordered by size.
+    """
+
+    work = []
+    for path in tqdm.tqdm(inputs, desc="scheduling inputs", leave=None):
+        size = os.path.getsize(path)
+        if split_size and size > split_size:
+            work += tweetio.split_input(path, -(-size // split_size))
+        else:
+            work.append(tweetio.InputRange(path, 0, None, size))
+
+    return sorted(work, key=lambda item: item.weight, reverse=True)
+
+def chunk_tweets_from_queue(input_queue: queue.Queue,
+                            output_directory: str,
+                            job_number: int = None,
+                            chunker: typing.Type[TweetChunker] \
+                                = CalendarDayChunker,
+                            chunker_kwargs: dict = None
+                            ) -> typing.Dict[str, typing.Any]:
+    """ Chunk tweets from files taken from a shared queue.
+
+    Like `chunk_tweets`, but instead of chunking a fixed list of files, keep
+    taking the next file (or range of a file) from a queue shared with other
+    jobs until a None is taken. Jobs that finish their files early will then
+    simply take more files, instead of sitting idle while other jobs are still
+    busy.
+
+    Args:
+        input_queue: A queue containing `tweetio.InputRange`s to chunk,
+            followed by one None for each job taking files from it.
+        output_directory: The directory to save chunked files to.
+        job_number: The ID of this job. If given, labels the progress bar with
+            that job number and displays the bar in that position.
+        chunker: The TweetChunker subclass to use.
+        chunker_kwargs: Additional keyword arguments used to initialize the
+            chunker, e.g. max_open_files.
+
+    Returns:
+        A dict containing the output directory ("partition"), the number of
+        seconds spent chunking ("busy"), and the number of files or ranges
+        ("files") and bytes on disk ("bytes") chunked by this job.
+    """
+
+    chunker_obj = chunker(output_directory, **(chunker_kwargs or {}))
+    result = {
+        "partition": chunker_obj.output_directory,
+        "busy": 0.0,
+        "files": 0,
+        "bytes": 0
+    }
+
+    if job_number is not None:
+        progress = tqdm.tqdm(
+            position=job_number, desc="job {}".format(job_number), unit="file"
+        )
+    else:
+        progress = tqdm.tqdm(unit="file")
+
+    with chunker_obj:
+        for item in iter(input_queue.get, None):
+            start = time.perf_counter()
+            chunker_obj.import_file(
+                item.path, verbose=False, close=False,
+                start=item.start, end=item.end
+            )
+            result["busy"] += time.perf_counter() - start
+            result["files"] += 1
+            result["bytes"] += item.weight
+            progress.update()
+
+        # writing out the remaining buffers is also part of the job's work
+        start = time.perf_counter()
+        chunker_obj.close()
+        chunker_obj.write_manifest()
+        result["busy"] += time.perf_counter() - start
+    progress.close()
+
+    report_chunker_stats(chunker_obj, job_number)
+
+    return result
+
+def report_chunker_stats(chunker_obj: TweetChunker,
+                         job_number: int = None) -> None:
+    """ Print statistics about a finished chunker.
+
+    Args:
+        chunker_obj: A TweetChunker that has finished chunking.
+        job_number: The ID of the job that used the chunker, if any.
+    """
+
+    prefix = "" if job_number is None else "job {}: ".format(job_number)
+    stats = chunker_obj.pool_stats()
+    tqdm.tqdm.write(
+        "{}output pool: {:.1%} hit rate, {:.1%} eviction rate ({} evictions)"
+        .format(
+            prefix,
+            stats["hit_rate"], stats["eviction_rate"], stats["evictions"]
+        )
+    )
+    if chunker_obj.fast_labels:
+        tqdm.tqdm.write("{}fast labels: {} labeled, {} parsed".format(
+            prefix, chunker_obj.fast_label_hits,
+            chunker_obj.fast_label_fallbacks
+        ))
+    if chunker_obj.dedup:
+        report_duplicates(
+            chunker_obj.duplicates, chunker_obj.dedup_memory_usage(), prefix
+        )
+
+def report_duplicates(duplicates: typing.Dict[str, int],
+                      memory_usage: int,
+                      prefix: str = "") -> None:
+    """ Print the number of duplicate tweets dropped from each chunk.
+
+    Args:
+        duplicates: A dict where keys are chunk labels and values are the
+            number of duplicates dropped from them.
+        memory_usage: The memory used to remember IDs, in bytes.
+        prefix: A prefix for each printed line.
+    """
+
+    for (label, count) in sorted(duplicates.items()):
+        tqdm.tqdm.write("{}{}: dropped {} duplicates".format(
+            prefix, label, count
+        ))
+    tqdm.tqdm.write(
+        "{}dedup: dropped {} duplicates from {} chunks; {:.1f} MB of IDs"
+        .format(
+            prefix, sum(duplicates.values()), len(duplicates),
+            memory_usage / 1e6
+        )
+    )
+
+def writer_for_label(label: str, writers: int) -> int:
+    """ Find the writer that owns a chunk in the shuffle mode.
+
+    The range of CRC-32 hashes is split evenly between writers. Unlike
+    `hash`, CRC-32 gives the same result in every process.
+
+    Args:
+        label: The label of the chunk.
+        writers: The total number of writers.
+
+    Returns:
+        The number of the writer, from 0 to writers - 1.
+    """
+
+    return (zlib.crc32(label.encode("utf-8")) * writers) >> 32
+
+def label_tweets_from_queue(input_queue: multiprocessing.Queue,
+                            writer_queues: typing.List[multiprocessing.Queue],
+                            result_queue: multiprocessing.Queue,
+                            output_directory: str,
+                            job_number: int,
+                            chunker: typing.Type[TweetChunker],
+                            chunker_kwargs: dict = None,
+                            batch_size: int = DEFAULT_SHUFFLE_BATCH_SIZE
+                            ) -> None:
+    """ Label tweets from files taken from a shared queue and send them to the
+    writers that own their chunks, in batches. This is run by the parser
+    processes of the shuffle mode; see `shuffle_tweets`.
+
+    Args:
+        input_queue: A queue containing `tweetio.InputRange`s to chunk,
+            followed by one None for each parser taking files from it.
+        writer_queues: One queue for each writer. Batches are dicts where keys
+            are chunk labels and values are lists of tweets.
+        result_queue: A queue that statistics about this parser will be put
+            into once it is done. If labeling fails, the exception is put
+            into the queue instead.
+        output_directory: The directory where chunks are being written.
+        job_number: The ID of this parser.
+        chunker: The TweetChunker subclass used to label tweets.
+        chunker_kwargs: Additional keyword arguments used to initialize the
+            chunker.
+        batch_size: The number of tweets to collect for a writer before
+            sending them. Putting a batch into a full queue blocks until the
+            writer catches up.
+    """
+
+    try:
+        chunker_obj = chunker(output_directory, **(chunker_kwargs or {}))
+        result = {"job": job_number, "busy": 0.0, "files": 0, "bytes": 0}
+
+        batches = [
+            collections.defaultdict(list) for _ in writer_queues
+        ] # type: typing.List[typing.DefaultDict[str, typing.List[bytes]]]
+        batch_sizes = [0] * len(writer_queues)
+
+        progress = tqdm.tqdm(
+            position=job_number, desc="parser {}".format(job_number),
+            unit="file"
+        )
+        for item in iter(input_queue.get, None):
+            start = time.perf_counter()
+            for tweet_str in tweetio.read_range(item.path, item.start,
+                                                item.end):
+                if not tweet_str.endswith(b"\n"):
+                    tweet_str += b"\n"
+                if not chunker_obj.in_sample(tweet_str):
+                    continue
+                label = chunker_obj.get_label(tweet_str)
+                writer = writer_for_label(label, len(writer_queues))
+                batches[writer][label].append(tweet_str)
+                batch_sizes[writer] += 1
+                if batch_sizes[writer] >= batch_size:
+                    writer_queues[writer].put(dict(batches[writer]))
+                    batches[writer].clear()
+                    batch_sizes[writer] = 0
+            result["busy"] += time.perf_counter() - start
+            result["files"] += 1
+            result["bytes"] += item.weight
+            progress.update()
+
+        for (writer, batch) in enumerate(batches):
+            if batch:
+                writer_queues[writer].put(dict(batch))
+        progress.close()
+
+        result["fast_label_hits"] = chunker_obj.fast_label_hits
+        result["fast_label_fallbacks"] = chunker_obj.fast_label_fallbacks
+    except Exception as error: # pylint: disable=broad-except
+        result_queue.put(error)
+        return
+    result_queue.put(result)
+
+def write_tweets_from_queue(writer_queue: multiprocessing.Queue,
+                            result_queue: multiprocessing.Queue,
+                            output_directory: str,
+                            job_number: int,
+                            chunker: typing.Type[TweetChunker],
+                            chunker_kwargs: dict = None) -> None:
+    """ Write batches of labeled tweets to chunk files until a None is taken
+    from the queue. This is run by the writer processes of the shuffle mode;
+    see `shuffle_tweets`.
+
+    Args:
+        writer_queue: A queue of batches from `label_tweets_from_queue`.
+        result_queue: A queue that statistics about this writer will be put
+            into once it is done. If writing fails, the exception is put into
+            the queue instead, and the remaining batches are discarded.
+        output_directory: The directory to save chunked files to.
+        job_number: The ID of this writer.
+        chunker: The TweetChunker subclass to use for writing.
+        chunker_kwargs: Additional keyword arguments used to initialize the
+            chunker, e.g. max_open_files.
+    """
+
+    try:
+        chunker_obj = chunker(output_directory, **(chunker_kwargs or {}))
+        result = {"job": job_number, "busy": 0.0, "tweets": 0}
+
+        with chunker_obj:
+            for batch in iter(writer_queue.get, None):
+                start = time.perf_counter()
+                for (label, tweet_strs) in batch.items():
+                    for tweet_str in tweet_strs:
+                        chunker_obj.write_tweet(label, tweet_str)
+                    result["tweets"] += len(tweet_strs)
+                result["busy"] += time.perf_counter() - start
+            start = time.perf_counter()
+            chunker_obj.close()
+            result["busy"] += time.perf_counter() - start
+
+        result.update(chunker_obj.pool_stats())
+        result["duplicates"] = chunker_obj.duplicates
+        result["dedup_memory_usage"] = chunker_obj.dedup_memory_usage()
+        # writers own disjoint sets of chunks, but the manifest is shared,
+        # so it is written once by the main process; see `shuffle_tweets`
+        result["chunk_stats"] = {
+            chunker_obj.chunk_filename(label): stats.to_dict()
+            for (label, stats) in chunker_obj.chunk_stats.items()
+        }
+    except Exception as error: # pylint: disable=broad-except
+        result_queue.put(error)
+        # parsers would otherwise wait forever on the full queue
+        for _ in iter(writer_queue.get, None):
+            pass
+        return
+    result_queue.put(result)
+
+def stop_shuffle_processes(processes: typing.List[multiprocessing.Process],
+                           error: Exception) -> typing.NoReturn:
+    """ Terminate every parser and writer of the shuffle mode, e.g. because
+    one of them failed, and raise an error.
+
+    Args:
+        processes: Every parser and writer process.
+        error: The error to raise.
+    """
+
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.join()
+    raise error
+
+def check_shuffle_processes(
+        processes: typing.List[multiprocessing.Process]
+    ) -> None:
+    """ Stop the shuffle mode if a process exited without putting an exception
+    into the result queue, e.g. because it was killed.
+
+    Args:
+        processes: Every parser and writer process.
+    """
+
+    for process in processes:
+        if process.exitcode not in (None, 0):
+            stop_shuffle_processes(processes, RuntimeError(
+                "{} exited with code {}".format(process.name, process.exitcode)
+            ))
+
+def take_shuffle_result(result_queue: multiprocessing.Queue,
+                        processes: typing.List[multiprocessing.Process]
+                        ) -> dict:
+    """ Take the statistics of a parser or writer of the shuffle mode from
+    the queue they share.
+
+    If a process failed, every process is terminated and its error is raised;
+    otherwise, the others could wait forever on full queues.
+
+    Args:
+        result_queue: The queue shared by the processes.
+        processes: Every parser and writer process.
+
+    Returns:
+        The statistics of a process.
+    """
+
+    while True:
+        try:
+            result = result_queue.get(timeout=1)
+        except queue.Empty:
+            check_shuffle_processes(processes)
+            continue
+        if isinstance(result, Exception):
+            stop_shuffle_processes(processes, result)
+        return result
+
+def join_shuffle_processes(joined: typing.List[multiprocessing.Process],
+                           processes: typing.List[multiprocessing.Process]
+                           ) -> None:
+    """ Wait for some processes of the shuffle mode to exit, stopping the
+    shuffle mode if any process fails in the meantime.
+
+    Args:
+        joined: The processes to wait for.
+        processes: Every parser and writer process.
+    """
+
+    for process in joined:
+        process.join(timeout=1)
+        while process.exitcode is None:
+            check_shuffle_processes(processes)
+            process.join(timeout=1)
+
+def shuffle_tweets(inputs: typing.List[str],
+                   output_directory: str,
+                   chunker: typing.Type[TweetChunker] = CalendarDayChunker,
+                   chunker_kwargs: dict = None,
+                   parsers: int = 1,
+                   writers: int = 1,
+                   batch_size: int = DEFAULT_SHUFFLE_BATCH_SIZE,
+                   queue_size: int = DEFAULT_SHUFFLE_QUEUE_SIZE,
+                   split_size: int = None
+                   ) -> typing.Tuple[typing.List[dict], typing.List[dict]]:
+    """ Chunk tweets in a single pass, without temporary partitions.
+
+    Parser processes take files from a shared queue, largest first, and label
+    their tweets. Each chunk is owned by exactly one writer process, chosen by
+    `writer_for_label`; parsers send labeled tweets in batches through a
+    bounded queue to the owning writer, which writes them directly to the
+    final chunk files. Because no two writers ever write to the same chunk,
+    nothing needs to be merged afterwards. Because the queues are bounded,
+    parsers wait for writers that are falling behind, which keeps memory use
+    bounded as well. Once all writers are done, their statistics are added to
+    the manifest of the output directory. If any process fails, the others
+    are terminated and its error is raised.
+
+    Args:
+        inputs: A list of files to chunk.
+        output_directory: The directory to save chunked files to. Tweets are
+            appended to chunks that already exist there.
+        chunker: The TweetChunker subclass to use.
+        chunker_kwargs: Additional keyword arguments used to initialize the
+            chunker.
+        parsers: The number of parser processes.
+        writers: The number of writer processes.
+        batch_size: The number of tweets in a batch.
+        queue_size: The number of batches that each writer's queue can hold.
+        split_size: Passed to `schedule_inputs`.
+
+    Returns:
+        A tuple of (parser statistics, writer statistics), each a list of
+        dicts ordered by job number.
+    """
+
+    input_queue = multiprocessing.Queue()
+    for item in schedule_inputs(inputs, split_size) + [None] * parsers:
+        input_queue.put(item)
+    writer_queues = [
+        multiprocessing.Queue(queue_size) for _ in range(writers)
+    ]
+    # writers only put their results once every parser is done, but an error
+    # of a writer must still reach the main process while it waits for parsers
+    results = multiprocessing.Queue()
+
+    writer_processes = [
+        multiprocessing.Process(
+            target=write_tweets_from_queue,
+            args=(
+                writer_queue, results, output_directory, job_number,
+                chunker, chunker_kwargs
+            )
+        )
+        for (job_number, writer_queue) in enumerate(writer_queues)
+    ]
+    parser_processes = [
+        multiprocessing.Process(
+            target=label_tweets_from_queue,
+            args=(
+                input_queue, writer_queues, results, output_directory,
+                job_number, chunker, chunker_kwargs, batch_size
+            )
+        )
+        for job_number in range(parsers)
+    ]
+    for process in writer_processes + parser_processes:
+        process.start()
+
+    # results must be taken from the queues before joining the processes that
+    # put them there
+    processes = writer_processes + parser_processes
+    parser_stats = [
+        take_shuffle_result(results, processes) for _ in parser_processes
+    ]
+    join_shuffle_processes(parser_processes, processes)
+    for writer_queue in writer_queues:
+        writer_queue.put(None)
+    writer_stats = [
+        take_shuffle_result(results, processes) for _ in writer_processes
+    ]
+    join_shuffle_processes(writer_processes, processes)
+
+    chunk_stats = {} # type: typing.Dict[str, tweetio.ChunkStats]
+    for result in writer_stats:
+        for (filename, entry) in result.pop("chunk_stats").items():
+            chunk_stats[filename] = tweetio.ChunkStats.from_dict(entry)
+    if chunk_stats:
+        tweetio.update_manifest(output_directory, chunk_stats)
+
+    return (
+        sorted(parser_stats, key=lambda result: result["job"]),
+        sorted(writer_stats, key=lambda result: result["job"])
+    )
+
+def read_sample(inputs: typing.List[str], sample_size: int) -> list:
+    """ Read a sample of tweets, taking the same number of tweets from the
+    start of each input file.
+
+    Args:
+        inputs: A list of newline-delimited JSON files containing tweet data.
+        sample_size: The total number of tweets to read.
+
+    Returns:
+        A list of raw tweets.
+    """
+
+    per_input = -(-sample_size // max(len(inputs), 1))
+    sample = []
+    for path in inputs:
+        with tweetio.open_input(path) as input_fp:
+            for (i, tweet_bytes) in enumerate(input_fp):
+                if i >= per_input or len(sample) >= sample_size:
+                    break
+                sample.append(tweet_bytes)
+    return sample
+
+def copy_file_contents(input_fp: typing.BinaryIO,
+                       output_fp: typing.BinaryIO,
+                       zero_copy: bool = False) -> None:
+    """ Append the rest of one file to another.
+
+    Args:
+        input_fp: A file opened for reading in binary mode.
+        output_fp: An unbuffered file opened for writing in binary mode.
+        zero_copy: If True, let the kernel copy the data directly between the
+            files using `os.copy_file_range` or `os.sendfile`, without passing
+            it through Python. If neither is available or supported between
+            these files, this falls back to a normal copy.
+    """
+
+    if zero_copy:
+        input_fd = input_fp.fileno()
+        output_fd = output_fp.fileno()
+        offset = input_fp.tell()
+        remaining = os.fstat(input_fd).st_size - offset
+
+        for copy_function in [
+                getattr(os, "copy_file_range", None),
+                getattr(os, "sendfile", None)
+            ]:
+            if copy_function is None:
+                continue
+            try:
+                while remaining > 0:
+                    if copy_function is os.sendfile:
+                        copied = os.sendfile(
+                            output_fd, input_fd, offset, remaining
+                        )
+                    else:
+                        copied = copy_function(
+                            input_fd, output_fd, remaining, offset
+                        )
+                    if copied == 0:
+                        break
+                    offset += copied
+                    remaining -= copied
+                break
+            except OSError:
+                # e.g. not supported by this file system; try the next way
+                # of copying, starting from wherever this one stopped
+                continue
+
+        input_fp.seek(offset)
+
+    shutil.copyfileobj(input_fp, output_fp)
+
+def merge_chunk(filename: str,
+                parent_directories: typing.List[str],
+                output_directory: str,
+                keep_temporary_files: bool,
+                zero_copy: bool = False,
+                append: bool = False) -> str:
+    """ Merge all parts of a single chunk into the output directory.
+
+    Args:
+        filename: The path of the chunk file, relative to its partition.
+        parent_directories: The partitions containing parts of the chunk.
+        output_directory: The directory to save the merged chunk to.
+        keep_temporary_files: If False, the parts will be removed after being
+            merged.
+        zero_copy: Passed to `copy_file_contents`.
+        append: If True, append the parts to the chunk if it already exists in
+            the output directory, instead of replacing it.
+
+    Returns:
+        The name of the chunk file.
+    """
+
+    destination = os.path.join(output_directory, filename)
+    if os.path.dirname(filename):
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+
+    # file already exists: append all parts to it. the file is not opened in
+    # append mode, which copy_file_range does not support
+    if append and os.path.isfile(destination):
+        with open(destination, "r+b", buffering=0) as output_fp:
+            output_fp.seek(0, os.SEEK_END)
+            for parent_directory in parent_directories:
+                source = os.path.join(parent_directory, filename)
+                with open(source, "rb") as input_fp:
+                    copy_file_contents(input_fp, output_fp, zero_copy)
+                if not keep_temporary_files:
+                    os.remove(source)
+
+    # file only has one partition: move/copy it
+    elif len(parent_directories) == 1:
+        source = os.path.join(parent_directories[0], filename)
+        if keep_temporary_files:
+            shutil.copyfile(source, destination)
+        else:
+            os.rename(source, destination)
+
+    # file has multiple partitions: concatenate them
+    else:
+        with open(destination, "wb", buffering=0) as output_fp:
+            for source in [
+                    os.path.join(parent_directory, filename)
+                    for parent_directory in parent_directories
+                ]:
+                with open(source, "rb") as input_fp:
+                    copy_file_contents(input_fp, output_fp, zero_copy)
+                if not keep_temporary_files:
+                    os.remove(source)
+
+    return filename
+
 def merge_partitions(partitions: typing.List[str],
                      output_directory: str,
-                     keep_temporary_files: bool
+                     keep_temporary_files: bool,
+                     jobs: int = 1,
+                     zero_copy: bool = False,
+                     append: bool = False
                      ) -> None:
     """ Merge chunks across partitions.
 
@@ -248,56 +1839,495 @@ def merge_partitions(partitions: typing.List[str],
     that appear only once will be either moved or copied based on the value of
     `keep_temporary_files`.
 
+    Chunks are merged independently of each other, so they are spread over a
+    pool of threads, one chunk at a time. Merging is limited by I/O rather than
+    by Python, so threads are sufficient. The manifests of the partitions are
+    merged into the manifest of the output directory.
+
     Args:
         partitions: A list of directories containing chunked tweets.
         output_directory: The directory to save merged chunks to.
         keep_temporary_files: If False, the original partitioned chunks will
             be removed after being merged.
+        jobs: The number of chunks to merge concurrently.
+        zero_copy: If True, concatenate parts of chunks using zero-copy system
+            calls where possible; see `copy_file_contents`.
+        append: If True, append to chunks that already exist in the output
+            directory instead of replacing them.
     """
     #pylint: disable=bad-continuation
 
-    # find what partitions contain parts of what files
+    # find what partitions contain parts of what files; chunks may be nested
+    # in subdirectories, e.g. by CompositeChunker
     part_locations = collections.defaultdict(list)
+    chunk_stats = {} # type: typing.Dict[str, tweetio.ChunkStats]
     for partition in partitions:
-        for filename in os.listdir(partition):
-            part_locations[filename].append(partition)
+        for (filename, entry) in tweetio.load_manifest(partition).items():
+            if filename in chunk_stats:
+                chunk_stats[filename].merge(tweetio.ChunkStats.from_dict(entry))
+            else:
+                chunk_stats[filename] = tweetio.ChunkStats.from_dict(entry)
+        for (root, _, filenames) in os.walk(partition):
+            for filename in filenames:
+                if root == partition and filename == tweetio.MANIFEST_NAME:
+                    continue
+                part_locations[os.path.relpath(
+                    os.path.join(root, filename), partition
+                )].append(partition)
 
     # merge parts across partitions
-    for (filename, parent_directories) in tqdm.tqdm(
-        part_locations.items(), desc="merging partitions"
-    ):
-        destination = os.path.join(output_directory, filename)
-
-        # file only has one partition: move/copy it
-        if len(parent_directories) == 1:
-            source = os.path.join(parent_directories[0], filename)
-            if keep_temporary_files:
-                shutil.copyfile(source, destination)
-            else:
-                os.rename(source, destination)
+    with multiprocessing.pool.ThreadPool(jobs) as pool:
+        for _ in tqdm.tqdm(
+            pool.imap_unordered(
+                lambda item: merge_chunk(
+                    item[0], item[1], output_directory, keep_temporary_files,
+                    zero_copy, append
+                ),
+                part_locations.items()
+            ),
+            total=len(part_locations), desc="merging partitions"
+        ):
+            pass
+
+    # merged chunks replace existing chunks of the same name, unless appending
+    if chunk_stats:
+        tweetio.update_manifest(
+            output_directory, chunk_stats, replace=not append
+        )
+
+def spill_run(batch: typing.List[typing.Tuple[int, bytes]],
+              run_directory: str,
+              run_number: int) -> str:
+    """ Sort a batch of tweets by ID and write it to a run file.
+
+    Each line of a run file is a tweet prefixed by its ID and a space, so that
+    IDs don't have to be found again when merging runs.
+
+    Args:
+        batch: A list of (ID, raw tweet) tuples.
+        run_directory: The directory to write the run file to.
+        run_number: The number of the run, used to name the file.
+
+    Returns:
+        The path to the run file.
+    """
+
+    batch.sort(key=operator.itemgetter(0))
+    path = os.path.join(run_directory, "run-{}".format(run_number))
+    with open(path, "wb") as run_fp:
+        run_fp.writelines(b"%d %s" % item for item in batch)
+    return path
+
+def read_run(path: str) -> typing.Iterator[typing.Tuple[int, bytes]]:
+    """ Read a run file written by `spill_run`.
+
+    Yields:
+        (ID, raw tweet) tuples, in order.
+    """
+
+    with open(path, "rb") as run_fp:
+        for line in run_fp:
+            (tweet_id, _, tweet_str) = line.partition(b" ")
+            yield (int(tweet_id), tweet_str)
+
+def sort_chunk(path: str,
+               temp_directory: str = None,
+               max_memory: int = DEFAULT_SORT_MEMORY,
+               block_size: int = DEFAULT_INDEX_BLOCK_SIZE,
+               compression_level: int = None) -> int:
+    """ Sort a chunk by tweet ID and write its sparse ID index.
+
+    This is an external merge sort: tweets are collected until about
+    `max_memory` bytes are held, then sorted and spilled to a run file on
+    disk. The runs are then merged in a single k-way merge. Chunks that fit in
+    memory are sorted without spilling.
+
+    The sorted chunk is written as a sequence of independently compressed
+    blocks of about `block_size` uncompressed bytes, and the first ID and the
+    offset of each block are written to the chunk's index (see
+    `tweetio.write_id_index`). The chunk is replaced atomically. Tweets
+    without an ID are sorted first.
+
+    Args:
+        path: The path to the chunk file.
+        temp_directory: The directory to write run files to.
+        max_memory: The approximate number of bytes of tweets to hold in
+            memory at once.
+        block_size: The approximate uncompressed size of each block.
+        compression_level: The compression level, or None for the codec's
+            default.
+
+    Returns:
+        The number of runs spilled to disk.
+    """
 
-        # file has multiple partitions: concatenate them
+    codec = tweetio.codec_for_path(path)
+    runs = []
+
+    with tempfile.TemporaryDirectory(dir=temp_directory) as run_directory:
+        batch = [] # type: typing.List[typing.Tuple[int, bytes]]
+        batch_bytes = 0
+        with tweetio.open_input(path) as input_fp:
+            for tweet_str in input_fp:
+                if not tweet_str.endswith(b"\n"):
+                    tweet_str += b"\n"
+                tweet_id = tweetio.scan_tweet_id(tweet_str)
+                batch.append((-1 if tweet_id is None else tweet_id, tweet_str))
+                batch_bytes += len(tweet_str) + SORT_ENTRY_OVERHEAD
+                if batch_bytes >= max_memory:
+                    runs.append(spill_run(batch, run_directory, len(runs)))
+                    batch = []
+                    batch_bytes = 0
+
+        if runs:
+            if batch:
+                runs.append(spill_run(batch, run_directory, len(runs)))
+            del batch
+            items = heapq.merge(
+                *[read_run(run) for run in runs], key=operator.itemgetter(0)
+            ) # type: typing.Iterable[typing.Tuple[int, bytes]]
         else:
-            with open(destination, "wb") as output_fp:
-                for source in [
-                    os.path.join(parent_directory, filename)
-                    for parent_directory in parent_directories
-                ]:
-                    with open(source, "rb") as input_fp:
-                        shutil.copyfileobj(input_fp, output_fp)
-                    if not keep_temporary_files:
-                        os.remove(source)
+            batch.sort(key=operator.itemgetter(0))
+            items = batch
+
+        blocks = []
+        block = [] # type: typing.List[bytes]
+        block_bytes = 0
+        uncompressed_offset = 0
+        with open(path + ".part", "wb") as output_fp:
+            for (tweet_id, tweet_str) in items:
+                if not block:
+                    blocks.append(
+                        [tweet_id, output_fp.tell(), uncompressed_offset]
+                    )
+                block.append(tweet_str)
+                block_bytes += len(tweet_str)
+                if block_bytes >= block_size:
+                    output_fp.write(
+                        codec.compress(b"".join(block), compression_level)
+                    )
+                    uncompressed_offset += block_bytes
+                    block = []
+                    block_bytes = 0
+            if block:
+                output_fp.write(
+                    codec.compress(b"".join(block), compression_level)
+                )
+
+    os.replace(path + ".part", path)
+    tweetio.write_id_index(path, blocks)
+
+    return len(runs)
+
+def sort_chunks(output_directory: str,
+                jobs: int = 1,
+                temp_directory: str = None,
+                max_memory: int = DEFAULT_SORT_MEMORY,
+                block_size: int = DEFAULT_INDEX_BLOCK_SIZE,
+                compression_level: int = None) -> typing.List[str]:
+    """ Sort every chunk in an output directory that is not sorted yet, or
+    that was appended to after it was sorted, using `sort_chunk`.
+
+    Chunks are sorted in a pool of processes, one chunk at a time, and each
+    process holds up to `max_memory` bytes of tweets. Sorted chunks are marked
+    as such in the manifest.
+
+    Args:
+        output_directory: The output directory.
+        jobs: The number of chunks to sort concurrently.
+        temp_directory: The directory to write run files to.
+        max_memory: Passed to `sort_chunk`.
+        block_size: Passed to `sort_chunk`.
+        compression_level: Passed to `sort_chunk`.
+
+    Returns:
+        The chunks that were sorted, relative to the output directory.
+    """
+
+    filenames = [
+        filename for filename in list_chunks(output_directory)
+        if filename.endswith(CHUNK_SUFFIXES)
+            and tweetio.load_id_index(
+                os.path.join(output_directory, filename)
+            ) is None
+    ]
+
+    created_temp_directory = temp_directory is not None \
+        and not os.path.isdir(temp_directory)
+    if created_temp_directory:
+        os.makedirs(temp_directory)
+
+    runs = 0
+    with multiprocessing.Pool(jobs) as pool:
+        for spilled in tqdm.tqdm(
+                pool.imap_unordered(
+                    functools.partial(
+                        sort_chunk, temp_directory=temp_directory,
+                        max_memory=max_memory, block_size=block_size,
+                        compression_level=compression_level
+                    ),
+                    [
+                        os.path.join(output_directory, filename)
+                        for filename in filenames
+                    ]
+                ),
+                total=len(filenames), desc="sorting chunks"
+            ):
+            runs += spilled
+    tqdm.tqdm.write("sorted {} chunks; {} runs spilled to disk".format(
+        len(filenames), runs
+    ))
+    if created_temp_directory:
+        os.rmdir(temp_directory)
+
+    # sorting only changes the compressed size of each chunk
+    manifest = tweetio.load_manifest(output_directory)
+    for filename in filenames:
+        if filename in manifest:
+            manifest[filename]["compressed_bytes"] = os.path.getsize(
+                os.path.join(output_directory, filename)
+            )
+            manifest[filename]["sorted"] = True
+    if manifest:
+        tweetio.save_manifest(output_directory, manifest)
+
+    return filenames
+
+def list_chunks(output_directory: str) -> typing.List[str]:
+    """ List the chunk files in an output directory, relative to it, leaving
+    out the manifest, the state file, indexes, and unfinished files.
+
+    Args:
+        output_directory: The output directory.
+    """
+
+    chunks = []
+    for (root, _, filenames) in os.walk(output_directory):
+        for filename in filenames:
+            if filename.endswith(".part") or tweetio.is_sidecar(filename) or (
+                    root == output_directory and filename in (
+                        tweetio.MANIFEST_NAME, STATE_NAME, JOURNAL_NAME,
+                        GEOHASH_SPLITS_NAME
+                    )
+                ):
+                continue
+            chunks.append(os.path.relpath(
+                os.path.join(root, filename), output_directory
+            ))
+    return chunks
+
+def load_geohash_splits(output_directory: str,
+                        precision: int,
+                        max_precision: int) -> typing.Optional[typing.List[str]]:
+    """ Load the geohash cells that earlier runs split.
+
+    Args:
+        output_directory: The directory that chunks were written to.
+        precision: The length of geohashes before splitting.
+        max_precision: The length that geohashes can be split up to.
+
+    Returns:
+        The geohashes of the split cells, or None if no splits were saved.
+
+    Raises:
+        ValueError: The splits were saved with a different precision, so the
+            chunks of this run would not line up with the existing chunks.
+    """
+
+    try:
+        with open(os.path.join(output_directory, GEOHASH_SPLITS_NAME)) \
+                as splits_fp:
+            saved = json.load(splits_fp)
+    except FileNotFoundError:
+        return None
+    if (saved["precision"], saved["max_precision"]) \
+            != (precision, max_precision):
+        raise ValueError(
+            "{} was written with a precision of {} and a max precision of {}"
+            .format(
+                GEOHASH_SPLITS_NAME, saved["precision"],
+                saved["max_precision"]
+            )
+        )
+    return saved["splits"]
+
+def save_geohash_splits(output_directory: str,
+                        precision: int,
+                        max_precision: int,
+                        splits: typing.List[str]) -> None:
+    """ Save the geohash cells that were split, so that later runs label
+    tweets consistently.
+
+    Args:
+        output_directory: The directory that chunks are written to.
+        precision: The length of geohashes before splitting.
+        max_precision: The length that geohashes can be split up to.
+        splits: The geohashes of the split cells.
+    """
+
+    os.makedirs(output_directory, exist_ok=True)
+    tweetio.write_json_atomic(
+        os.path.join(output_directory, GEOHASH_SPLITS_NAME),
+        {"precision": precision, "max_precision": max_precision,
+         "splits": splits}
+    )
+
+def load_state(output_directory: str) -> dict:
+    """ Load the state file of an output directory.
+
+    Args:
+        output_directory: The output directory.
+
+    Returns:
+        A dict containing the ID of the last completed run ("run") and a dict
+        where keys are the absolute paths of inputs that were chunked into the
+        output directory and values are their `stat_input` from when they were
+        chunked ("inputs").
+    """
+
+    try:
+        with open(os.path.join(output_directory, STATE_NAME)) as state_fp:
+            return json.load(state_fp)
+    except FileNotFoundError:
+        return {"run": None, "inputs": {}}
+
+def stat_input(path: str) -> typing.Dict[str, float]:
+    """ Get the size and modification time of an input, as recorded in the
+    state file. """
+
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+def classify_inputs(inputs: typing.List[str],
+                    state: dict
+                    ) -> typing.Tuple[typing.List[str],
+                                      typing.List[str],
+                                      typing.List[str]]:
+    """ Compare inputs against the state file of an output directory.
+
+    Args:
+        inputs: A list of input files.
+        state: The state, as returned by `load_state`.
+
+    Returns:
+        A tuple of (new inputs, unchanged inputs, changed inputs). Inputs are
+        changed if their size or modification time differs from when they were
+        chunked.
+    """
+
+    new = []
+    unchanged = []
+    changed = []
+    for path in inputs:
+        recorded = state["inputs"].get(os.path.abspath(path))
+        if recorded is None:
+            new.append(path)
+        elif recorded == stat_input(path):
+            unchanged.append(path)
+        else:
+            changed.append(path)
+    return (new, unchanged, changed)
+
+def begin_run(output_directory: str) -> str:
+    """ Start a run that appends to the chunks in an output directory.
+
+    The size of every existing chunk, as well as the manifest, is recorded in
+    a journal before anything is appended. If the run is interrupted, the
+    next run uses the journal to undo its appends; see `recover_run`. The run
+    is completed by `commit_run`.
+
+    Args:
+        output_directory: The output directory.
+
+    Returns:
+        The ID of the run.
+    """
+
+    run_id = "{:.6f}-{}".format(time.time(), os.getpid())
+    os.makedirs(output_directory, exist_ok=True)
+    tweetio.write_json_atomic(os.path.join(output_directory, JOURNAL_NAME), {
+        "run": run_id,
+        "sizes": {
+            filename: os.path.getsize(os.path.join(output_directory, filename))
+            for filename in list_chunks(output_directory)
+        },
+        "manifest": tweetio.load_manifest(output_directory)
+    })
+    return run_id
+
+def commit_run(output_directory: str,
+               input_stats: typing.Dict[str, typing.Dict[str, float]],
+               run_id: str = None) -> None:
+    """ Record chunked inputs in the state file of an output directory,
+    completing a run started by `begin_run`.
+
+    Replacing the state file is the point at which the appends of the run
+    become permanent; the journal is removed afterwards.
+
+    Args:
+        output_directory: The output directory.
+        input_stats: A dict where keys are the absolute paths of the inputs
+            that were chunked and values are their `stat_input` from before
+            they were chunked.
+        run_id: The ID returned by `begin_run`, if any.
+    """
+
+    state = load_state(output_directory)
+    state["run"] = run_id
+    state["inputs"].update(input_stats)
+    tweetio.write_json_atomic(os.path.join(output_directory, STATE_NAME), state)
+
+    journal_path = os.path.join(output_directory, JOURNAL_NAME)
+    if os.path.isfile(journal_path):
+        os.remove(journal_path)
+
+def recover_run(output_directory: str) -> bool:
+    """ Undo the appends of an interrupted run, if there was one.
+
+    Chunks that existed before the run are truncated to their previous sizes;
+    because chunks consist of whole GZIP members, this removes exactly what
+    was appended. Chunks created by the run, i.e. chunk files written after the
+    journal, are removed, and the manifest is restored.
+
+    Args:
+        output_directory: The output directory.
+
+    Returns:
+        True if an interrupted run was undone.
+    """
+
+    journal_path = os.path.join(output_directory, JOURNAL_NAME)
+    try:
+        with open(journal_path) as journal_fp:
+            journal = json.load(journal_fp)
+    except FileNotFoundError:
+        return False
+
+    # the run was committed, but the journal was not removed yet
+    if load_state(output_directory)["run"] == journal["run"]:
+        os.remove(journal_path)
+        return False
+
+    journal_time = os.path.getmtime(journal_path)
+    for filename in list_chunks(output_directory):
+        path = os.path.join(output_directory, filename)
+        if filename in journal["sizes"]:
+            with open(path, "r+b") as chunk_fp:
+                chunk_fp.truncate(journal["sizes"][filename])
+        elif filename.endswith(CHUNK_SUFFIXES) \
+                and os.path.getmtime(path) >= journal_time:
+            os.remove(path)
+    tweetio.save_manifest(output_directory, journal["manifest"])
+
+    os.remove(journal_path)
+    return True
 
 if __name__ == "__main__":
     #pylint: disable=invalid-name
     #pylint: disable=bad-continuation
 
     import argparse
-    import collections
     import inspect
-    import shutil
-    import sys
-    import tempfile
     import textwrap
 
     all_chunkers = {
@@ -305,7 +2335,7 @@ if __name__ == "__main__":
         for (name, obj) in inspect.getmembers(sys.modules[__name__])
         if inspect.isclass(obj)
             and issubclass(obj, TweetChunker)
-            and obj is not TweetChunker
+            and obj not in (TweetChunker, CompositeChunker)
     }
 
     indent_level = 2
@@ -356,14 +2386,205 @@ if __name__ == "__main__":
         help="number of jobs to use; the number of partitions will equal the"
              " number of jobs."
     )
+    parser.add_argument(
+        "-s", "--split-size", type=float, metavar="MB",
+        help="split input files larger than this many megabytes on disk into"
+             " ranges of about this size, so that several jobs can work on a"
+             " single large file. GZIP files are indexed in a single pass"
+             " first; the index is cached next to each file. see tweetio.py."
+    )
+    parser.add_argument(
+        "-i", "--in-place", default=False, action="store_true",
+        help="with -j 1, chunk directly into the output directory, skipping"
+             " temporary partitions and merging. unlike merging, this appends"
+             " to chunks that already exist in the output directory."
+    )
+    parser.add_argument(
+        "-w", "--writers", type=int,
+        help="chunk in a single pass using the given number of writer"
+             " processes, each owning a share of the chunks, fed by -j parser"
+             " processes. no temporary partitions are created and nothing is"
+             " merged; tweets are appended to chunks that already exist in the"
+             " output directory."
+    )
+    parser.add_argument(
+        "--batch-size", default=DEFAULT_SHUFFLE_BATCH_SIZE, type=int,
+        help="with -w, the number of tweets that parsers send to a writer at"
+             " once; default is {}.".format(DEFAULT_SHUFFLE_BATCH_SIZE)
+    )
+    parser.add_argument(
+        "--queue-size", default=DEFAULT_SHUFFLE_QUEUE_SIZE, type=int,
+        help="with -w, the number of batches that can wait for each writer"
+             " before parsers wait for it to catch up; default is {}."
+             .format(DEFAULT_SHUFFLE_QUEUE_SIZE)
+    )
+    parser.add_argument(
+        "-z", "--zero-copy", default=False, action="store_true",
+        help="when merging partitions, concatenate chunks using zero-copy"
+             " system calls (copy_file_range or sendfile) where supported."
+    )
+    parser.add_argument(
+        "-m", "--max-open-files", default=DEFAULT_MAX_OPEN_FILES, type=int,
+        help="maximum number of chunk files that each job keeps open; the"
+             " least recently used file is closed when this is exceeded."
+             " default is {}.".format(DEFAULT_MAX_OPEN_FILES)
+    )
     parser.add_argument(
         "-c", "--chunker", default="CalendarDayChunker",
-        choices=all_chunkers.keys(),
-        help="the chunker to use for chunking tweets. available chunkers: {}"\
+        help="the chunker to use for chunking tweets, or a comma-separated list"
+             " of chunkers to combine into nested chunks in a single pass, e.g."
+             " CalendarDayChunker,UserIdMd5Chunker. available chunkers: {}"\
             .format(", ".join(all_chunkers.keys()))
     )
+    parser.add_argument(
+        "-f", "--fast-labels", default=False, action="store_true",
+        help="label tweets by scanning their raw data for the relevant field"
+             " where the chunker supports it, only parsing tweets when the"
+             " field cannot be found unambiguously."
+    )
+    parser.add_argument(
+        "--codec", default="gzip",
+        help="the codec to compress chunks with; default is gzip. available"
+             " codecs: {}. zstd and lz4 require the zstandard and lz4 modules."
+             .format(", ".join(tweetio.available_codecs()))
+    )
+    parser.add_argument(
+        "--level", type=int,
+        help="the compression level; the default depends on the codec (9 for"
+             " gzip, 3 for zstd, 0 for lz4)."
+    )
+    parser.add_argument(
+        "--compress-threads", default=0, type=int,
+        help="with --codec zstd, the number of extra threads to compress each"
+             " open chunk with, or -1 for one per CPU. note that up to"
+             " --max-open-files chunks are open at once in each job."
+    )
+    parser.add_argument(
+        "-d", "--dedup", choices=["exact", "bloom"],
+        help="drop tweets whose IDs were already written to their chunk."
+             " exact remembers every ID (8 bytes per ID); bloom uses a Bloom"
+             " filter of fixed size per chunk, which may drop a small fraction"
+             " of tweets that are not duplicates. requires that every chunk is"
+             " written by a single process, i.e. -j 1, -i, or -w. duplicates"
+             " of tweets chunked by earlier runs are not detected."
+    )
+    parser.add_argument(
+        "--dedup-capacity", default=DEFAULT_DEDUP_CAPACITY, type=int,
+        help="with --dedup bloom, the number of tweets per chunk that Bloom"
+             " filters are sized for; default is {}."
+             .format(DEFAULT_DEDUP_CAPACITY)
+    )
+    parser.add_argument(
+        "--dedup-error-rate", default=DEFAULT_DEDUP_ERROR_RATE, type=float,
+        help="with --dedup bloom, the false positive rate that Bloom filters"
+             " are sized for; default is {}.".format(DEFAULT_DEDUP_ERROR_RATE)
+    )
+    parser.add_argument(
+        "--sort", default=False, action="store_true",
+        help="after chunking, sort every chunk that is not sorted yet by tweet"
+             " ID, i.e. by time, and write a sparse index of IDs next to it"
+             " (<chunk>{}), which lets tweets-to-csv.py and"
+             " tweets-to-sqlite.py read only the part of a chunk within"
+             " --min-id/--max-id or --since/--until. chunks larger than"
+             " --sort-memory are sorted with an external merge sort in the"
+             " temporary directory.".format(tweetio.ID_INDEX_SUFFIX)
+    )
+    parser.add_argument(
+        "--sort-memory", default=DEFAULT_SORT_MEMORY / 1024 / 1024,
+        type=float, metavar="MB",
+        help="with --sort, the megabytes of tweets that each job sorts in"
+             " memory before spilling a sorted run to disk; default is {}."
+             .format(DEFAULT_SORT_MEMORY // 1024 // 1024)
+    )
+    parser.add_argument(
+        "--index-block-size", default=DEFAULT_INDEX_BLOCK_SIZE / 1024,
+        type=float, metavar="KB",
+        help="with --sort, the uncompressed kilobytes between entries of the"
+             " index of each chunk; default is {}. smaller blocks allow"
+             " reading less data, but compress slightly worse."
+             .format(DEFAULT_INDEX_BLOCK_SIZE // 1024)
+    )
+    parser.add_argument(
+        "-u", "--update", default=False, action="store_true",
+        help="only chunk inputs that have not been chunked into the output"
+             " directory yet, according to its state file ({}), appending"
+             " their tweets to the existing chunks. inputs whose size or"
+             " modification time changed since they were chunked are flagged"
+             " but not chunked again.".format(STATE_NAME)
+    )
+    parser.add_argument(
+        "--no-manifest", default=False, action="store_true",
+        help="don't collect statistics about each chunk (number of tweets, ID"
+             " and time range, bounding box) in {} in the output directory."
+             " the manifest lets tweets-to-csv.py and tweets-to-sqlite.py skip"
+             " chunks that cannot match their filters.".format(
+                 tweetio.MANIFEST_NAME
+             )
+    )
+    parser.add_argument(
+        "--geohash-precision", default=DEFAULT_GEOHASH_PRECISION, type=int,
+        help="with GeohashChunker, the number of characters of the geohashes"
+             " that tweets are chunked by; default is {}, i.e. cells of about"
+             " 156 km by 156 km.".format(DEFAULT_GEOHASH_PRECISION)
+    )
+    parser.add_argument(
+        "--geohash-max-precision", default=DEFAULT_GEOHASH_MAX_PRECISION,
+        type=int,
+        help="with GeohashChunker, the number of characters that the"
+             " geohashes of dense cells can be split up to; default is {}."
+             .format(DEFAULT_GEOHASH_MAX_PRECISION)
+    )
+    parser.add_argument(
+        "--geohash-split-fraction", type=float, metavar="FRACTION",
+        help="with GeohashChunker, split cells holding more than FRACTION of"
+             " the tweets in a sample of the inputs into smaller cells, e.g."
+             " {}. the cells to split are saved in {} in the output directory"
+             " and reused by later runs, so that chunks keep the same labels."
+             .format(DEFAULT_GEOHASH_SPLIT_FRACTION, GEOHASH_SPLITS_NAME)
+    )
+    parser.add_argument(
+        "--geohash-sample", default=DEFAULT_GEOHASH_SAMPLE_SIZE, type=int,
+        metavar="N",
+        help="with --geohash-split-fraction, the number of tweets to sample"
+             " from the inputs; default is {}."
+             .format(DEFAULT_GEOHASH_SAMPLE_SIZE)
+    )
+    parser.add_argument(
+        "--verify-fast-labels", metavar="N", type=int,
+        help="instead of chunking, check that fast labels agree with labels"
+             " from fully parsed tweets on a sample of N tweets taken from the"
+             " inputs, then exit."
+    )
+    tweetio.add_sample_arguments(parser)
     args = parser.parse_args()
 
+    chunker_names = args.chunker.split(",")
+    for name in chunker_names:
+        if name not in all_chunkers:
+            parser.error("unknown chunker {}; available chunkers: {}".format(
+                name, ", ".join(all_chunkers.keys())
+            ))
+    if not 1 <= args.geohash_precision <= args.geohash_max_precision:
+        parser.error(
+            "--geohash-precision must be between 1 and"
+            " --geohash-max-precision"
+        )
+
+    try:
+        tweetio.get_codec(args.codec)
+    except ValueError as error:
+        parser.error(str(error))
+
+    if args.in_place and args.jobs != 1:
+        parser.error("--in-place can only be used with -j 1")
+    if args.in_place and args.writers:
+        parser.error("--in-place and --writers cannot be used together")
+    if args.dedup and args.jobs != 1 and not args.writers:
+        parser.error(
+            "--dedup requires -j 1 or --writers; partitions written by"
+            " different jobs would not be deduplicated against each other"
+        )
+
     # scan for input files
     inputs = []
     for path in tqdm.tqdm(args.inputs, desc="scanning inputs"):
@@ -372,36 +2593,224 @@ if __name__ == "__main__":
         elif os.path.isdir(path):
             for (root, directories, files) in os.walk(path):
                 for name in files:
-                    inputs.append(os.path.join(root, name))
+                    if not tweetio.is_sidecar(name) and name not in (
+                            STATE_NAME, JOURNAL_NAME, GEOHASH_SPLITS_NAME
+                    ):
+                        inputs.append(os.path.join(root, name))
+
+    # geohash cells are split according to a sample of the inputs the first
+    # time, and according to the saved splits afterwards
+    component_kwargs = {
+        name: {} for name in chunker_names
+    } # type: typing.Dict[str, dict]
+    if "GeohashChunker" in chunker_names:
+        try:
+            saved_splits = load_geohash_splits(
+                args.output_directory, args.geohash_precision,
+                args.geohash_max_precision
+            )
+        except ValueError as error:
+            parser.error(str(error))
+        component_kwargs["GeohashChunker"] = {
+            "precision": args.geohash_precision,
+            "max_precision": args.geohash_max_precision,
+            "splits": saved_splits
+        }
+        if component_kwargs["GeohashChunker"]["splits"] is None:
+            splits = [] # type: typing.List[str]
+            if args.geohash_split_fraction is not None:
+                splits = plan_geohash_splits(
+                    read_sample(inputs, args.geohash_sample),
+                    args.geohash_precision, args.geohash_max_precision,
+                    args.geohash_split_fraction
+                )
+                print("splitting {} dense geohash cells".format(len(splits)))
+            component_kwargs["GeohashChunker"]["splits"] = splits
+            if args.verify_fast_labels is None:
+                save_geohash_splits(
+                    args.output_directory, args.geohash_precision,
+                    args.geohash_max_precision, splits
+                )
 
-    # initialize directories
-    for directory in [args.temp_directory, args.output_directory]:
-        if not os.path.isdir(directory):
-            os.makedirs(directory)
+    if len(chunker_names) == 1:
+        chunker_class = all_chunkers[chunker_names[0]]
+        chunker_kwargs = dict(component_kwargs[chunker_names[0]])
+    else:
+        chunker_class = CompositeChunker
+        chunker_kwargs = {
+            "components": [
+                (all_chunkers[name], component_kwargs[name])
+                for name in chunker_names
+            ]
+        }
 
-    # partition into jobs and chunk tweets using TweetChunker
-    print("chunking; using {} threads -> {} partitions".format(
-        args.jobs, args.jobs
-    ))
-    with multiprocessing.Pool(args.jobs) as pool:
-        partitions = pool.starmap(
-            chunk_tweets,
-            [
-                (
-                    split_list(inputs, args.jobs)[job_number],
-                    tempfile.mkdtemp(dir=args.temp_directory),
-                    job_number,
-                    all_chunkers[args.chunker]
+    if args.verify_fast_labels is not None:
+        with tempfile.TemporaryDirectory() as verify_directory:
+            result = chunker_class(verify_directory, **chunker_kwargs)\
+                .verify_fast_labels(
+                    read_sample(inputs, args.verify_fast_labels)
                 )
-                for job_number in range(args.jobs)
-            ]
+        for (tweet_str, fast_label, label) in result["mismatches"]:
+            print("MISMATCH: fast label {} != label {}: {!r}".format(
+                fast_label, label, tweet_str
+            ))
+        print("{} tweets checked; {} fast labels; {} mismatches".format(
+            result["checked"], result["labeled"], len(result["mismatches"])
+        ))
+        sys.exit(1 if result["mismatches"] else 0)
+
+    # undo the appends of an interrupted run, then compare the inputs against
+    # the ones that were already chunked into the output directory
+    if recover_run(args.output_directory):
+        print("undid the appends of an interrupted run")
+    (new_inputs, unchanged_inputs, changed_inputs) = classify_inputs(
+        inputs, load_state(args.output_directory)
+    )
+    for path in changed_inputs:
+        print(
+            "WARNING: {} changed since it was chunked. consider rebuilding the"
+            " chunks.".format(path)
+        )
+    if args.update:
+        print("{} new inputs; skipping {} unchanged and {} changed inputs"
+              .format(
+                  len(new_inputs), len(unchanged_inputs), len(changed_inputs)
+              ))
+        inputs = new_inputs
+        if not inputs:
+            sys.exit(0)
+    input_stats = {os.path.abspath(path): stat_input(path) for path in inputs}
+
+    # runs that append to existing chunks are journaled, so that they can be
+    # undone if they are interrupted
+    run_id = None
+    if args.update or args.in_place or args.writers:
+        run_id = begin_run(args.output_directory)
+
+    split_size = None
+    if args.split_size is not None:
+        split_size = int(args.split_size * 1024 * 1024)
+
+    chunker_kwargs.update({
+        "max_open_files": args.max_open_files,
+        "fast_labels": args.fast_labels,
+        "codec": args.codec,
+        "compression_level": args.level,
+        "compression_threads": args.compress_threads,
+        "collect_stats": not args.no_manifest,
+        "dedup": args.dedup,
+        "dedup_capacity": args.dedup_capacity,
+        "dedup_error_rate": args.dedup_error_rate,
+        "sampler": tweetio.sampler_from_args(args, parser)
+    })
+
+    # with a single job, chunk tweets directly into the output directory
+    if args.in_place:
+        print("chunking in place")
+        chunk_tweets(
+            order_by_size(inputs), args.output_directory,
+            chunker=chunker_class, chunker_kwargs=chunker_kwargs
         )
 
-    # merge partitions
-    merge_partitions(
-        partitions, args.output_directory, args.keep_temporary_files
-    )
+    # with writer processes, chunk tweets directly into the output directory
+    elif args.writers:
+        print("chunking; using {} parsers -> {} writers".format(
+            args.jobs, args.writers
+        ))
+        (parser_stats, writer_stats) = shuffle_tweets(
+            inputs, args.output_directory, chunker_class,
+            chunker_kwargs, parsers=args.jobs, writers=args.writers,
+            batch_size=args.batch_size, queue_size=args.queue_size,
+            split_size=split_size
+        )
+        for result in parser_stats:
+            print("parser {}: busy {:.1f}s; {} files, {:.1f} MB".format(
+                result["job"], result["busy"], result["files"],
+                result["bytes"] / 1e6
+            ))
+        for result in writer_stats:
+            print(
+                "writer {}: busy {:.1f}s; {} tweets; output pool: {:.1%} hit"
+                " rate, {:.1%} eviction rate".format(
+                    result["job"], result["busy"], result["tweets"],
+                    result["hit_rate"], result["eviction_rate"]
+                )
+            )
+        if args.dedup:
+            report_duplicates(
+                {
+                    label: count
+                    for result in writer_stats
+                    for (label, count) in result["duplicates"].items()
+                },
+                sum(result["dedup_memory_usage"] for result in writer_stats)
+            )
+
+    # otherwise, each job chunks tweets into its own partition, and the
+    # partitions are merged into the output directory
+    else:
+        # initialize directories
+        for directory in [args.temp_directory, args.output_directory]:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+
+        # chunk tweets using TweetChunker; jobs take files from a shared queue,
+        # largest first, and each job writes to its own partition
+        print("chunking; using {} threads -> {} partitions".format(
+            args.jobs, args.jobs
+        ))
+        with multiprocessing.Manager() as manager, \
+             multiprocessing.Pool(args.jobs) as pool:
+            input_queue = manager.Queue()
+            for item in schedule_inputs(inputs, split_size) \
+                    + [None] * args.jobs:
+                input_queue.put(item)
+            results = pool.starmap(
+                chunk_tweets_from_queue,
+                [
+                    (
+                        input_queue,
+                        tempfile.mkdtemp(dir=args.temp_directory),
+                        job_number,
+                        chunker_class,
+                        chunker_kwargs
+                    )
+                    for job_number in range(args.jobs)
+                ],
+                chunksize=1
+            )
+        partitions = [result["partition"] for result in results]
+
+        # report how evenly the work was spread across jobs
+        for (job_number, result) in enumerate(results):
+            print("job {}: busy {:.1f}s; {} files, {:.1f} MB".format(
+                job_number, result["busy"], result["files"],
+                result["bytes"] / 1e6
+            ))
+        busy = [result["busy"] for result in results]
+        if max(busy) > 0:
+            print("load balance (mean / max busy time): {:.1%}".format(
+                sum(busy) / len(busy) / max(busy)
+            ))
+
+        # merge partitions, one chunk per thread
+        merge_partitions(
+            partitions, args.output_directory, args.keep_temporary_files,
+            jobs=args.jobs, zero_copy=args.zero_copy, append=args.update
+        )
 
-    # clean up if necessary
-    if not args.keep_temporary_files:
-        shutil.rmtree(args.temp_directory)
+        # clean up if necessary
+        if not args.keep_temporary_files:
+            shutil.rmtree(args.temp_directory)
+
+    commit_run(args.output_directory, input_stats, run_id)
+
+    # sort the chunks written by this run, replacing each chunk atomically
+    if args.sort:
+        sort_chunks(
+            args.output_directory, jobs=args.jobs,
+            temp_directory=args.temp_directory,
+            max_memory=int(args.sort_memory * 1024 * 1024),
+            block_size=int(args.index_block_size * 1024),
+            compression_level=args.level
+        )
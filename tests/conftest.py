@@ -0,0 +1,137 @@
+""" Shared fixtures for the tests of the geotweets utilities. """
+
+import gzip
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+REPOSITORY_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__
+)))
+
+sys.path.insert(0, REPOSITORY_DIRECTORY)
+
+# the epoch of tweet ID snowflakes, in milliseconds
+SNOWFLAKE_EPOCH = 1288834974657
+
+# the number of tweets in each generated input file
+TWEETS_PER_FILE = 300
+
+def make_tweet(i: int, version: int = 0) -> dict:
+    """ Generate a geotweet, spread over three days, 20 users and 5 places.
+    Different versions of a tweet have the same ID but a different text and
+    user profile. """
+
+    timestamp_ms = 1577836800000 + i * 86400000 * 3 // (3 * TWEETS_PER_FILE)
+    tweet_id = (timestamp_ms - SNOWFLAKE_EPOCH) << 22 | i % 4096
+    created_at = time.strftime(
+        "%a %b %d %H:%M:%S +0000 %Y", time.gmtime(timestamp_ms // 1000)
+    )
+    place = None
+    if i % 3:
+        place = {
+            "id": "{:016x}".format(i % 5 + 0xabc) if i % 5 else "not-hex",
+            "country": ["US", "CA"][i % 2],
+            "full_name": "Place {}".format(i % 5),
+            "bounding_box": {"coordinates": [[
+                [-71.1, 42.3], [-71.1, 42.4], [-71.0, 42.4], [-71.0, 42.3]
+            ]]}
+        }
+    return {
+        "id": tweet_id,
+        "created_at": created_at,
+        "text": "tweet {} version {} #tag{}".format(i, version, i % 7),
+        "lang": ["en", "es", "und"][i % 3],
+        "quoted_status_id": tweet_id - 1 if i % 11 == 0 else None,
+        "in_reply_to_status_id": None,
+        "in_reply_to_user_id": i % 20 if i % 13 == 0 else None,
+        "user": {
+            "id": i % 20,
+            "name": "user {}".format(i % 20),
+            "screen_name": "user{}".format(i % 20),
+            "description": "version {}".format(version),
+            "verified": i % 20 == 0,
+            "statuses_count": i,
+            "followers_count": i % 20 * 10,
+            "friends_count": 5,
+            "time_zone": None,
+            "lang": "en",
+            "location": "Boston"
+        },
+        "entities": {
+            "hashtags": [{"text": "tag{}".format(i % 7)}],
+            "urls": [{
+                "expanded_url": "https://example.com/{}".format(i),
+                "url": "https://t.co/{}".format(i)
+            }] if i % 4 == 0 else [],
+            "media": [{
+                "type": "photo",
+                "media_url": "https://pbs.example.com/{}.jpg".format(i),
+                "url": "https://t.co/m{}".format(i)
+            }] if i % 9 == 0 else []
+        },
+        "place": place,
+        "coordinates": {"coordinates": [
+            -71.1 + (i % 17) * 0.01, 42.3 + (i % 19) * 0.01
+        ]}
+    }
+
+def write_tweets(path: str, tweets: list) -> str:
+    """ Write tweets to a GZIP-compressed NDJSON file. """
+
+    with gzip.open(path, "wt") as output_fp:
+        for tweet in tweets:
+            output_fp.write(json.dumps(tweet) + "\n")
+    return path
+
+@pytest.fixture(scope="session")
+def tweet_files(tmp_path_factory) -> list:
+    """ Three input files of generated tweets. The last one repeats some
+    tweets of the first one in a later version, so that duplicates have to
+    be handled. """
+
+    directory = tmp_path_factory.mktemp("inputs")
+    return [
+        write_tweets(str(directory / "tweets-0.json.gz"), [
+            make_tweet(i) for i in range(TWEETS_PER_FILE)
+        ]),
+        write_tweets(str(directory / "tweets-1.json.gz"), [
+            make_tweet(i)
+            for i in range(TWEETS_PER_FILE, 2 * TWEETS_PER_FILE)
+        ]),
+        write_tweets(str(directory / "tweets-2.json.gz"), [
+            make_tweet(i)
+            for i in range(2 * TWEETS_PER_FILE, 3 * TWEETS_PER_FILE)
+        ] + [
+            make_tweet(i, version=1) for i in range(0, TWEETS_PER_FILE, 10)
+        ])
+    ]
+
+def run_script(name: str, *args: str) -> str:
+    """ Run one of the tools, failing the test if it fails, and return its
+    output. """
+
+    process = subprocess.run(
+        [sys.executable, os.path.join(REPOSITORY_DIRECTORY, name)]
+        + list(args),
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, check=False
+    )
+    output = process.stdout.decode("utf-8", "replace")
+    assert process.returncode == 0, output
+    return output
+
+def load_script(name: str):
+    """ Import one of the tools as a module, e.g. to call its functions. """
+
+    spec = importlib.util.spec_from_file_location(
+        os.path.splitext(name)[0].replace("-", "_"),
+        os.path.join(REPOSITORY_DIRECTORY, name)
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,172 @@
+""" Tests for chunker.py: every chunking mode must produce the same chunks as
+a plain serial run. """
+
+import collections
+import json
+import os
+
+import pytest
+
+import chunker
+import tweetio
+from conftest import run_script
+
+MODES = {
+    "jobs": ["-j", "2"],
+    "writers": ["-j", "2", "-w", "2"],
+    "split": ["-j", "2", "-s", "0.005"],
+    "in-place": ["-i"],
+    "fast-labels": ["-f"],
+    "composite": ["-c", "CalendarDayChunker,UserIdMd5Chunker"]
+}
+
+def chunk(output_directory: str, inputs: list, *args: str) -> str:
+    """ Chunk files with chunker.py. """
+
+    return run_script(
+        "chunker.py", "-o", output_directory,
+        "-t", output_directory + "-temp", *args, *inputs
+    )
+
+def read_chunks(output_directory: str) -> dict:
+    """ Get the lines of every chunk in an output directory, in the order
+    they were written. """
+
+    chunks = {}
+    for filename in chunker.list_chunks(output_directory):
+        with tweetio.open_input(
+                os.path.join(output_directory, filename)
+            ) as input_fp:
+            chunks[filename] = input_fp.read().splitlines()
+    return chunks
+
+def chunk_ids(chunks: dict) -> dict:
+    """ Get the tweet IDs in each chunk. """
+
+    return {
+        filename: [json.loads(line)["id"] for line in lines]
+        for (filename, lines) in chunks.items()
+    }
+
+def unordered(chunks: dict) -> dict:
+    """ Get the lines of each chunk regardless of their order. """
+
+    return {
+        filename: collections.Counter(lines)
+        for (filename, lines) in chunks.items()
+    }
+
+@pytest.fixture(scope="module")
+def serial_chunks(tweet_files, tmp_path_factory) -> dict:
+    """ The chunks of a plain serial run. """
+
+    output_directory = str(tmp_path_factory.mktemp("serial") / "chunks")
+    chunk(output_directory, tweet_files)
+    return read_chunks(output_directory)
+
+def test_serial_chunks(serial_chunks):
+    """ Tweets are chunked by day, keeping duplicates. """
+
+    assert sorted(serial_chunks) == [
+        "2020-01-01.json.gz", "2020-01-02.json.gz", "2020-01-03.json.gz"
+    ]
+    assert sum(len(lines) for lines in serial_chunks.values()) == 930
+
+@pytest.mark.parametrize("mode", sorted(MODES))
+def test_chunk_mode(tweet_files, serial_chunks, tmp_path, mode):
+    """ Each chunking mode writes the same tweets to each chunk as a serial
+    run, although not necessarily in the same order. """
+
+    output_directory = str(tmp_path / "chunks")
+    chunk(output_directory, tweet_files, *MODES[mode])
+    chunks = read_chunks(output_directory)
+    if mode == "composite":
+        # nested chunks, e.g. 2020-01-01/3f.json.gz, are compared by day
+        by_day = collections.defaultdict(list)
+        for (filename, lines) in chunks.items():
+            by_day[os.path.dirname(filename) + ".json.gz"].extend(lines)
+        chunks = dict(by_day)
+    assert unordered(chunks) == unordered(serial_chunks)
+
+@pytest.mark.parametrize("mode", ["serial", "writers"])
+def test_dedup(tweet_files, serial_chunks, tmp_path, mode):
+    """ With --dedup, each tweet ID is written to its chunk only once. """
+
+    output_directory = str(tmp_path / "chunks")
+    args = ["-d", "exact"]
+    if mode == "writers":
+        args += ["-j", "2", "-w", "2"]
+    chunk(output_directory, tweet_files, *args)
+    chunks = read_chunks(output_directory)
+
+    expected = {}
+    for (filename, lines) in serial_chunks.items():
+        seen = set()
+        expected[filename] = []
+        for line in lines:
+            tweet_id = json.loads(line)["id"]
+            if tweet_id not in seen:
+                seen.add(tweet_id)
+                expected[filename].append(line)
+    if mode == "serial":
+        assert unordered(chunks) == unordered(expected)
+    else:
+        # parsers may read the later version of a duplicate first
+        assert {
+            filename: sorted(ids)
+            for (filename, ids) in chunk_ids(chunks).items()
+        } == {
+            filename: sorted(ids)
+            for (filename, ids) in chunk_ids(expected).items()
+        }
+
+def test_sort(tweet_files, serial_chunks, tmp_path):
+    """ With --sort, chunks are sorted by ID, and reads within an ID range
+    use the ID index to return the same tweets as a full scan. """
+
+    output_directory = str(tmp_path / "chunks")
+    chunk(
+        output_directory, tweet_files, "--sort", "--index-block-size", "1"
+    )
+    chunks = read_chunks(output_directory)
+    assert unordered(chunks) == unordered(serial_chunks)
+
+    for (filename, ids) in chunk_ids(chunks).items():
+        assert ids == sorted(ids)
+        path = os.path.join(output_directory, filename)
+        assert len(tweetio.load_id_index(path)) > 1
+
+        (min_id, max_id) = (ids[len(ids) // 3], ids[2 * len(ids) // 3])
+        predicate = tweetio.TweetPredicate(min_id=min_id, max_id=max_id)
+        read_ids = [
+            tweet["id"] for tweet in map(
+                json.loads, tweetio.read_tweets(path, predicate)
+            )
+            if predicate.matches(tweet)
+        ]
+        assert read_ids == [
+            tweet_id for tweet_id in ids if min_id <= tweet_id <= max_id
+        ]
+
+def test_update_recovers_interrupted_run(tweet_files, serial_chunks,
+                                         tmp_path):
+    """ With --update, the appends of an interrupted run are undone before
+    the remaining inputs are chunked. """
+
+    output_directory = str(tmp_path / "chunks")
+    chunk(output_directory, tweet_files[:1], "-u")
+
+    # a run that was interrupted after appending to a chunk and creating one
+    chunker.begin_run(output_directory)
+    with open(os.path.join(output_directory, "2020-01-01.json.gz"),
+              "ab") as chunk_fp:
+        chunk_fp.write(tweetio.get_codec("gzip").compress(b"partial\n"))
+    with open(os.path.join(output_directory, "2020-01-03.json.gz"),
+              "wb") as chunk_fp:
+        chunk_fp.write(tweetio.get_codec("gzip").compress(b"partial\n"))
+
+    output = chunk(output_directory, tweet_files, "-u")
+    assert "undid the appends of an interrupted run" in output
+    assert "2 new inputs" in output
+    assert unordered(read_chunks(output_directory)) \
+        == unordered(serial_chunks)
@@ -0,0 +1,50 @@
+""" Tests for tweetio.py. """
+
+import gzip
+import json
+
+import tweetio
+
+def write_sorted_chunk(path, ids, block_lines):
+    """ Write a sorted chunk of tweets with the given IDs, compressing every
+    `block_lines` lines as an independent block, and its ID index. """
+
+    lines = [
+        json.dumps({"id": tweet_id, "text": str(i)}).encode("utf-8") + b"\n"
+        for (i, tweet_id) in enumerate(sorted(ids))
+    ]
+    blocks = []
+    uncompressed_offset = 0
+    with open(path, "wb") as output_fp:
+        for start in range(0, len(lines), block_lines):
+            block = lines[start:start + block_lines]
+            blocks.append([
+                json.loads(block[0])["id"], output_fp.tell(),
+                uncompressed_offset
+            ])
+            output_fp.write(gzip.compress(b"".join(block)))
+            uncompressed_offset += sum(len(line) for line in block)
+    tweetio.write_id_index(path, blocks)
+    return lines
+
+def test_read_tweets_duplicates_across_blocks(tmp_path):
+    """ Copies of the smallest ID of a predicate at the end of the previous
+    block are read. """
+
+    path = str(tmp_path / "sorted.json.gz")
+    # blocks of 4 lines: [1, 2, 5, 5], [5, 5, 5, 8], ...
+    ids = [1, 2] + [5] * 5 + list(range(8, 30))
+    lines = write_sorted_chunk(path, ids, 4)
+    assert len(tweetio.load_id_index(path)) > 2
+
+    predicate = tweetio.TweetPredicate(min_id=5, max_id=20)
+    read_ids = [
+        json.loads(line)["id"] for line in tweetio.read_tweets(path, predicate)
+        if predicate.matches(json.loads(line))
+    ]
+    expected_ids = [
+        json.loads(line)["id"] for line in lines
+        if 5 <= json.loads(line)["id"] <= 20
+    ]
+    assert read_ids == expected_ids
+    assert read_ids.count(5) == 5
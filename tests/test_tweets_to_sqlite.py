@@ -0,0 +1,143 @@
+""" Tests for tweets-to-sqlite.py: every import mode must produce the same
+database as a plain serial import. """
+
+import os
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+
+from conftest import load_script, run_script
+
+SCHEMAS = ["standard", "interned", "compact"]
+
+MODES = {
+    "jobs": ["-j", "2"],
+    "shards": ["-j", "2", "-s"],
+    "bulk": ["-B"],
+    "jobs-bulk": ["-j", "2", "-B"],
+    "wal": ["-W", "--commit-every", "50"],
+    "no-cache": ["--upsert-cache-size", "0"]
+}
+
+# runs tweets-to-sqlite.py, exiting abruptly after generating the records
+# of the given number of lines, as if the process was killed
+CRASHING_IMPORT = """
+import argparse
+import os
+import sys
+sys.path.insert(0, {tests_directory!r})
+from conftest import load_script
+module = load_script("tweets-to-sqlite.py")
+module.argparse = argparse
+generate_records = module.generate_records
+calls = []
+def crashing_generate_records(*args, **kwargs):
+    calls.append(None)
+    if len(calls) > {lines}:
+        os._exit(1)
+    return generate_records(*args, **kwargs)
+module.generate_records = crashing_generate_records
+sys.argv[0] = "tweets-to-sqlite.py"
+module.main()
+"""
+
+tweets_to_sqlite = load_script("tweets-to-sqlite.py")
+
+def import_tweets(db_path: str, inputs: list, *args: str) -> None:
+    """ Import files into a database with tweets-to-sqlite.py. """
+
+    run_script("tweets-to-sqlite.py", "-d", db_path, *args, *inputs)
+
+def dump(db_path: str) -> dict:
+    """ Get the rows of every table of a database, in a canonical order. For
+    the interned and compact schemas, the rows are read through their
+    views. """
+
+    db = sqlite3.connect(db_path)
+    try:
+        return {
+            table_name: sorted(
+                db.execute("SELECT {} FROM {}".format(
+                    ",".join(columns), table_name
+                )).fetchall(),
+                key=repr
+            )
+            for (table_name, columns)
+            in tweets_to_sqlite.TABLE_COLUMNS.items()
+        }
+    finally:
+        db.close()
+
+@pytest.fixture(scope="module")
+def serial_dumps(tweet_files, tmp_path_factory) -> dict:
+    """ The dumps of plain serial imports of the inputs, by schema. """
+
+    directory = tmp_path_factory.mktemp("serial")
+    dumps = {}
+    for schema in SCHEMAS:
+        db_path = str(directory / "{}.db".format(schema))
+        import_tweets(db_path, tweet_files, "--schema", schema)
+        dumps[schema] = dump(db_path)
+    return dumps
+
+def test_serial_import(serial_dumps):
+    """ The first version of each duplicate tweet and user is kept. """
+
+    dumped = serial_dumps["standard"]
+    assert len(dumped["tweets"]) == 3 * 300
+    assert len(dumped["users"]) == 20
+    assert all("version 0" in row[-1] for row in dumped["tweets"])
+    assert all(row[3] == "version 0" for row in dumped["users"])
+    assert len(dumped["media"]) > 0 and len(dumped["urls"]) > 0
+
+@pytest.mark.parametrize("schema", SCHEMAS)
+@pytest.mark.parametrize("mode", sorted(MODES))
+def test_import_mode(tweet_files, serial_dumps, tmp_path, schema, mode):
+    """ Each import mode produces the same database as a serial import. """
+
+    db_path = str(tmp_path / "tweets.db")
+    import_tweets(db_path, tweet_files, "--schema", schema, *MODES[mode])
+    assert dump(db_path) == serial_dumps[schema]
+
+@pytest.mark.parametrize("schema", ["interned", "compact"])
+def test_schemas_agree(serial_dumps, schema):
+    """ The views of the interned and compact schemas return what the
+    standard schema stores, except that the child tables of the compact
+    schema are keyed by their values and so have no duplicate rows. """
+
+    expected = dict(serial_dumps["standard"])
+    if schema == "compact":
+        for table_name in ("urls", "media", "hashtags", "mentions"):
+            expected[table_name] = sorted(set(expected[table_name]), key=repr)
+    assert serial_dumps[schema] == expected
+
+@pytest.mark.parametrize("schema", SCHEMAS)
+def test_wal_resume(tweet_files, serial_dumps, tmp_path, schema):
+    """ An import with --wal that crashes in the middle of a file resumes at
+    its last checkpoint. """
+
+    db_path = str(tmp_path / "tweets.db")
+    args = ["-d", db_path, "-W", "--commit-every", "50", "--schema", schema]
+
+    crashed = subprocess.run(
+        [sys.executable, "-c", CRASHING_IMPORT.format(
+            tests_directory=os.path.dirname(os.path.abspath(__file__)),
+            lines=420
+        )] + args + tweet_files,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False
+    )
+    assert crashed.returncode == 1
+
+    db = sqlite3.connect(db_path)
+    try:
+        assert db.execute(
+            "SELECT lines FROM imported_files WHERE NOT complete"
+        ).fetchall() == [(100,)]
+    finally:
+        db.close()
+
+    output = run_script("tweets-to-sqlite.py", *args, *tweet_files)
+    assert "resuming" in output
+    assert dump(db_path) == serial_dumps[schema]
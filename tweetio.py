@@ -0,0 +1,1440 @@
+#!/usr/bin/env python3
+""" Shared input/output helpers for the geotweets utilities.
+
+Large newline-delimited JSON files can be split into byte ranges that are read
+by several workers at once. Ranges are measured in uncompressed bytes and are
+aligned to lines when read (see `read_range`), so that every line is read
+exactly once no matter where the range boundaries fall.
+
+Reading a range of a GZIP file requires starting decompression somewhere in
+the middle of the file. If the indexed_gzip library is installed, a seekable
+checkpoint index is built for each GZIP file and any range can be read.
+Otherwise, ranges can only start at the beginning of a GZIP member, which
+works for files consisting of many members (e.g. files written by chunker.py
+or by concatenating GZIP files), but not for files consisting of a single
+member. Either way, the index is built with a single pass over the file and
+cached next to it, in `<file>.gzidx.json` (and `<file>.gzidx` for
+indexed_gzip), so that it only has to be built once.
+
+Directories of chunks written by chunker.py contain a manifest, which records
+statistics about each chunk such as its range of tweet IDs and the bounding
+box of its coordinates. Readers can use a TweetPredicate to skip chunks that
+cannot contain any matching tweets without opening them.
+
+Chunks can also be sorted by tweet ID, i.e. by time, by chunker.py. A sorted
+chunk consists of independently compressed blocks and comes with a sparse
+index of the first ID of each block, so that `read_tweets` can start reading
+at the first block that can contain a given ID range and stop after it.
+
+Files can be compressed with any of several codecs (see `Codec`), which are
+chosen by file extension when reading. GZIP files and uncompressed files can be
+split into ranges; other formats are always read from start to finish.
+
+Fields of a tweet can also be found directly in its raw data, without parsing
+it, using `find_top_level_key`.
+"""
+
+import argparse
+import bisect
+import contextlib
+import datetime
+import gzip
+import hashlib
+import io
+import json
+import os
+import re
+import typing
+import zlib
+
+try:
+    import indexed_gzip
+except ModuleNotFoundError:
+    indexed_gzip = None
+
+try:
+    import lz4.frame as lz4_frame
+except ModuleNotFoundError:
+    lz4_frame = None
+
+try:
+    import zstandard
+except ModuleNotFoundError:
+    zstandard = None
+
+GZIP_INDEX_SUFFIX = ".gzidx"
+GZIP_INDEX_INFO_SUFFIX = ".gzidx.json"
+
+# the distance, in uncompressed bytes, between checkpoints in an indexed_gzip
+# index. each checkpoint stores 32 KiB of data, so this trades off the size of
+# the index against the amount of data decompressed and thrown away on seeking
+DEFAULT_INDEX_SPACING = 16 * 1024 * 1024
+
+# the number of compressed bytes read at a time when scanning for members
+SCAN_BLOCK_SIZE = 1024 * 1024
+
+class InputRange(typing.NamedTuple):
+    """ A range of uncompressed bytes of an input file.
+
+    Attributes:
+        path: The path to the file.
+        start: The start of the range.
+        end: The end of the range, or None for the end of the file.
+        weight: The approximate number of bytes on disk covered by the range,
+            used to schedule large ranges first.
+    """
+
+    path: str
+    start: int = 0
+    end: typing.Optional[int] = None
+    weight: int = 0
+
+MANIFEST_NAME = "manifest.json"
+
+# sparse index of chunks sorted by tweet ID; see `load_id_index`
+ID_INDEX_SUFFIX = ".idx.json"
+
+# suffixes of files that this module writes next to input files
+SIDECAR_SUFFIXES = (
+    GZIP_INDEX_SUFFIX, GZIP_INDEX_INFO_SUFFIX, MANIFEST_NAME, ID_INDEX_SUFFIX
+)
+
+NLONG = "$numberLong"
+
+# precompiled patterns for finding fields in the raw bytes of a tweet without
+# parsing it; see `find_top_level_key`
+JSON_STRING_PATTERN = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"')
+CREATED_AT_PATTERN = re.compile(rb'"created_at"\s*:\s*"([^"\\]*)"')
+# IDs are only captured if they are plain integers, i.e. not wrapped in
+# MongoDB's numberLong type. the user ID is only captured if it is the first key
+# of the user object
+TWEET_ID_PATTERN = re.compile(rb'"id"\s*:\s*(?:(\d+)\s*[,}])?')
+USER_ID_PATTERN = re.compile(
+    rb'"user"\s*:\s*(?:\{\s*"id"\s*:\s*(\d+)\s*[,}])?'
+)
+# matches a "coordinates" key whose value is either null or a GeoJSON point,
+# capturing the longitude and latitude of the point; this excludes the
+# coordinates of places' bounding boxes and of the points themselves
+COORDINATES_PATTERN = re.compile(
+    rb'"coordinates"\s*:\s*(?:null|\{\s*"type"\s*:\s*"Point"\s*,\s*'
+    rb'"coordinates"\s*:\s*\[\s*([-+.eE\d]+)\s*,\s*([-+.eE\d]+)\s*\])'
+)
+# keys of tweets that can be nested inside of a tweet
+NESTED_TWEET_KEYS = (b'"retweeted_status"', b'"quoted_status"')
+
+def is_sidecar(path: str) -> bool:
+    """ Check if a file was written next to an input file by this module,
+    rather than being an input file itself. """
+
+    return path.endswith(SIDECAR_SUFFIXES)
+
+def convert_nlong(nlong: dict) -> int:
+    """ Extract numberLong from a Mongo value if necessary. """
+
+    try:
+        return nlong[NLONG]
+    except TypeError:
+        return nlong
+
+def snowflake_to_timestamp(snowflake: int) -> float:
+    """ Convert a Twitter snowflake ID into a Unix timestamp, in seconds.
+
+    Source: Nick Galbreath @ngalbreath nickg@client9.com
+    Url: https://github.com/client9/snowflake2time/
+    """
+
+    return ((snowflake >> 22) + 1288834974657) / 1000.0
+
+def timestamp_to_snowflake(timestamp: float) -> int:
+    """ Convert a Unix timestamp, in seconds, into the smallest snowflake ID
+    that could have been generated at that time. """
+
+    return max(int(timestamp * 1000) - 1288834974657, 0) << 22
+
+def find_top_level_key(pattern: typing.Pattern,
+                       tweet_bytes: bytes) -> typing.Optional[typing.Match]:
+    """ Find a key of a tweet's top-level object without parsing the tweet.
+
+    Matches of the pattern are only returned if they are not nested inside of
+    another object or array, e.g. `"created_at"` of the tweet but not of
+    `user` or `quoted_status`. A pattern starting with a quoted key can never
+    match inside of a JSON string, because quotes inside of JSON strings are
+    always escaped.
+
+    Args:
+        pattern: A compiled bytes pattern starting with a quoted key.
+        tweet_bytes: The raw JSON data of a tweet.
+
+    Returns:
+        The first match at the top level, or None if there is none, in which
+        case the tweet should be parsed.
+    """
+
+    depth = 0
+    position = 0
+    for match in pattern.finditer(tweet_bytes):
+        segment = tweet_bytes[position:match.start()]
+        if position == 0 and segment.count(b"{") == 1 and not (
+                b"}" in segment or b"[" in segment or b"]" in segment
+            ):
+            # brackets inside of strings could only make this count larger
+            return match
+
+        # blank out strings, which may contain brackets, before measuring depth;
+        # segments always start and end outside of strings
+        segment = JSON_STRING_PATTERN.sub(b"", segment)
+        depth += (segment.count(b"{") + segment.count(b"[")
+                  - segment.count(b"}") - segment.count(b"]"))
+        if depth == 1:
+            return match
+        position = match.start()
+
+    return None
+
+def find_coordinates(tweet_bytes: bytes) -> typing.Optional[typing.Match]:
+    """ Find the top-level "coordinates" key of a tweet without parsing it.
+
+    Args:
+        tweet_bytes: The raw JSON data of a tweet.
+
+    Returns:
+        A match of `COORDINATES_PATTERN`, whose groups are the longitude and
+        latitude of the tweet (both None if its coordinates are null), or None
+        if the key cannot be found unambiguously.
+    """
+
+    if any(key in tweet_bytes for key in NESTED_TWEET_KEYS):
+        # the first match could belong to a nested tweet
+        return find_top_level_key(COORDINATES_PATTERN, tweet_bytes)
+    return COORDINATES_PATTERN.search(tweet_bytes)
+
+def scan_tweet_stats(tweet_bytes: bytes
+                     ) -> typing.Tuple[typing.Optional[int],
+                                       typing.Optional[float],
+                                       typing.Optional[float]]:
+    """ Find the ID and coordinates of a tweet, preferably without parsing it.
+
+    Args:
+        tweet_bytes: The raw JSON data of a tweet.
+
+    Returns:
+        A tuple of (ID, longitude, latitude), with None for missing values.
+    """
+
+    id_match = find_top_level_key(TWEET_ID_PATTERN, tweet_bytes)
+    coordinates_match = find_coordinates(tweet_bytes)
+
+    if id_match is not None and id_match.group(1) is not None \
+            and coordinates_match is not None:
+        if coordinates_match.group(1) is None:
+            return (int(id_match.group(1)), None, None)
+        try:
+            return (
+                int(id_match.group(1)),
+                float(coordinates_match.group(1)),
+                float(coordinates_match.group(2))
+            )
+        except ValueError:
+            pass
+
+    tweet = json.loads(tweet_bytes)
+    return tweet_stats(tweet)
+
+def scan_tweet_id(tweet_bytes: bytes) -> typing.Optional[int]:
+    """ Find the ID of a tweet, preferably without parsing it.
+
+    Args:
+        tweet_bytes: The raw JSON data of a tweet.
+
+    Returns:
+        The ID, or None if the tweet has none.
+    """
+
+    match = find_top_level_key(TWEET_ID_PATTERN, tweet_bytes)
+    if match is not None and match.group(1) is not None:
+        return int(match.group(1))
+    return tweet_stats(json.loads(tweet_bytes))[0]
+
+def md5_id(id_: int) -> "hashlib._Hash":
+    """ Hash a tweet or user ID with MD5, as UserIdMd5Chunker does. The ID is
+    hashed as an unsigned 64-bit big-endian integer.
+
+    Args:
+        id_: The ID to hash.
+
+    Returns:
+        The MD5 hash object.
+    """
+
+    return hashlib.md5(int(id_).to_bytes(
+        length=8, byteorder="big", signed=False
+    ))
+
+def tweet_stats(tweet: dict) -> typing.Tuple[typing.Optional[int],
+                                             typing.Optional[float],
+                                             typing.Optional[float]]:
+    """ Get the ID and coordinates of a parsed tweet.
+
+    Args:
+        tweet: The parsed JSON data of a tweet.
+
+    Returns:
+        A tuple of (ID, longitude, latitude), with None for missing values.
+    """
+
+    try:
+        tweet_id = int(convert_nlong(tweet["id"]))
+    except (KeyError, TypeError, ValueError):
+        tweet_id = None
+    try:
+        (lon, lat) = tweet["coordinates"]["coordinates"][:2]
+    except (KeyError, TypeError, ValueError):
+        (lon, lat) = (None, None)
+    return (tweet_id, lon, lat)
+
+class ChunkStats():
+    """ Statistics about the tweets in a chunk, as recorded in a manifest.
+
+    Attributes:
+        tweets: The number of tweets.
+        bytes: The total uncompressed size of the tweets, in bytes.
+        min_id: The smallest tweet ID, or None if there are no IDs.
+        max_id: The largest tweet ID, or None if there are no IDs.
+        bbox: The bounding box of the coordinates of the tweets, as a list of
+            [min_lon, min_lat, max_lon, max_lat], or None if no tweet has
+            coordinates.
+        duplicates: The number of tweets that were dropped from the chunk
+            because their IDs had already been written to it.
+    """
+
+    __slots__ = ("tweets", "bytes", "min_id", "max_id", "bbox", "duplicates")
+
+    def __init__(self):
+        """ Initialize ChunkStats class for an empty chunk. """
+
+        self.tweets = 0
+        self.bytes = 0
+        self.min_id = None # type: typing.Optional[int]
+        self.max_id = None # type: typing.Optional[int]
+        self.bbox = None # type: typing.Optional[typing.List[float]]
+        self.duplicates = 0
+
+    def add(self,
+            size: int,
+            tweet_id: typing.Optional[int],
+            lon: typing.Optional[float],
+            lat: typing.Optional[float]) -> None:
+        """ Add a tweet to the statistics.
+
+        Args:
+            size: The size of the tweet, in bytes.
+            tweet_id: The ID of the tweet, if known.
+            lon: The longitude of the tweet, if known.
+            lat: The latitude of the tweet, if known.
+        """
+
+        self.tweets += 1
+        self.bytes += size
+        if tweet_id is not None:
+            if self.min_id is None or tweet_id < self.min_id:
+                self.min_id = tweet_id
+            if self.max_id is None or tweet_id > self.max_id:
+                self.max_id = tweet_id
+        if lon is not None and lat is not None:
+            if self.bbox is None:
+                self.bbox = [lon, lat, lon, lat]
+            else:
+                bbox = self.bbox
+                if lon < bbox[0]:
+                    bbox[0] = lon
+                elif lon > bbox[2]:
+                    bbox[2] = lon
+                if lat < bbox[1]:
+                    bbox[1] = lat
+                elif lat > bbox[3]:
+                    bbox[3] = lat
+
+    def merge(self, other: "ChunkStats") -> None:
+        """ Add the statistics of another part of the same chunk. """
+
+        self.tweets += other.tweets
+        self.bytes += other.bytes
+        self.duplicates += other.duplicates
+        if other.min_id is not None:
+            if self.min_id is None or other.min_id < self.min_id:
+                self.min_id = other.min_id
+            if self.max_id is None or other.max_id > self.max_id:
+                self.max_id = other.max_id
+        if other.bbox is not None:
+            if self.bbox is None:
+                self.bbox = list(other.bbox)
+            else:
+                self.bbox = [
+                    min(self.bbox[0], other.bbox[0]),
+                    min(self.bbox[1], other.bbox[1]),
+                    max(self.bbox[2], other.bbox[2]),
+                    max(self.bbox[3], other.bbox[3])
+                ]
+
+    def to_dict(self) -> dict:
+        """ Represent the statistics as a manifest entry, including the time
+        range of the tweets derived from their IDs. """
+
+        return {
+            "tweets": self.tweets,
+            "bytes": self.bytes,
+            "min_id": self.min_id,
+            "max_id": self.max_id,
+            "min_timestamp": (
+                None if self.min_id is None
+                else snowflake_to_timestamp(self.min_id)
+            ),
+            "max_timestamp": (
+                None if self.max_id is None
+                else snowflake_to_timestamp(self.max_id)
+            ),
+            "bbox": self.bbox,
+            "duplicates": self.duplicates
+        }
+
+    @classmethod
+    def from_dict(cls, entry: dict) -> "ChunkStats":
+        """ Load the statistics from a manifest entry. """
+
+        stats = cls()
+        stats.tweets = entry["tweets"]
+        stats.bytes = entry["bytes"]
+        stats.min_id = entry["min_id"]
+        stats.max_id = entry["max_id"]
+        stats.bbox = entry["bbox"]
+        stats.duplicates = entry.get("duplicates", 0)
+        return stats
+
+def load_manifest(directory: str) -> typing.Dict[str, dict]:
+    """ Load the manifest of a directory of chunks.
+
+    Args:
+        directory: The directory containing the chunks.
+
+    Returns:
+        A dict where keys are paths of chunk files relative to the directory
+        and values are dicts as returned by `ChunkStats.to_dict`, with the
+        addition of the size of the chunk file on disk ("compressed_bytes").
+        The dict is empty if there is no manifest.
+    """
+
+    try:
+        with open(os.path.join(directory, MANIFEST_NAME)) as manifest_fp:
+            return json.load(manifest_fp)["chunks"]
+    except FileNotFoundError:
+        return {}
+
+def update_manifest(directory: str,
+                    stats: typing.Dict[str, ChunkStats],
+                    replace: bool = False) -> None:
+    """ Add statistics to the manifest of a directory of chunks.
+
+    The manifest is replaced atomically, so that readers never see a partially
+    written manifest.
+
+    Args:
+        directory: The directory containing the chunks.
+        stats: A dict where keys are paths of chunk files relative to the
+            directory and values are statistics about the tweets added to
+            them.
+        replace: If True, replace existing entries of the given chunks, e.g.
+            because the chunks were overwritten. If False, add the statistics
+            to existing entries, e.g. because tweets were appended.
+    """
+
+    manifest = load_manifest(directory)
+    for (filename, chunk_stats) in stats.items():
+        if filename in manifest and not replace:
+            merged = ChunkStats.from_dict(manifest[filename])
+            merged.merge(chunk_stats)
+            chunk_stats = merged
+        entry = chunk_stats.to_dict()
+        try:
+            entry["compressed_bytes"] = os.path.getsize(
+                os.path.join(directory, filename)
+            )
+        except OSError:
+            entry["compressed_bytes"] = None
+        manifest[filename] = entry
+
+    save_manifest(directory, manifest)
+
+def save_manifest(directory: str, manifest: typing.Dict[str, dict]) -> None:
+    """ Replace the manifest of a directory of chunks.
+
+    Args:
+        directory: The directory containing the chunks.
+        manifest: A dict as returned by `load_manifest`.
+    """
+
+    write_json_atomic(os.path.join(directory, MANIFEST_NAME),
+                      {"chunks": manifest})
+
+def write_json_atomic(path: str, obj: typing.Any) -> None:
+    """ Write an object to a JSON file, replacing the file atomically.
+
+    The object is written to a temporary file next to the destination, which
+    is synced to disk and then renamed over the destination, so that readers
+    only ever see the old or the new file in full.
+
+    Args:
+        path: The path to the JSON file.
+        obj: The object to write.
+    """
+
+    with open(path + ".part", "w") as output_fp:
+        json.dump(obj, output_fp, indent=1, sort_keys=True)
+        output_fp.flush()
+        os.fsync(output_fp.fileno())
+    os.replace(path + ".part", path)
+
+class TweetPredicate():
+    """ A condition on tweets that can also be checked against the statistics
+    of whole chunks, to skip chunks that cannot contain matching tweets.
+
+    Attributes:
+        min_id: The smallest tweet ID to match, or None.
+        max_id: The largest tweet ID to match, or None.
+        bbox: The bounding box that the coordinates of matching tweets must be
+            in, as [min_lon, min_lat, max_lon, max_lat], or None. Tweets
+            without coordinates do not match a bounding box.
+    """
+
+    def __init__(self,
+                 min_id: int = None,
+                 max_id: int = None,
+                 since: float = None,
+                 until: float = None,
+                 bbox: typing.List[float] = None):
+        """ Initialize TweetPredicate class.
+
+        Time ranges are converted into ID ranges, because tweet IDs are
+        snowflakes ordered by time.
+
+        Args:
+            min_id: The smallest tweet ID to match.
+            max_id: The largest tweet ID to match.
+            since: The earliest Unix timestamp to match, inclusive.
+            until: The latest Unix timestamp to match, exclusive.
+            bbox: The bounding box that matching tweets must be in.
+        """
+
+        if since is not None:
+            since_id = timestamp_to_snowflake(since)
+            min_id = since_id if min_id is None else max(min_id, since_id)
+        if until is not None:
+            until_id = timestamp_to_snowflake(until) - 1
+            max_id = until_id if max_id is None else min(max_id, until_id)
+
+        self.min_id = min_id
+        self.max_id = max_id
+        self.bbox = bbox
+
+    def may_match(self, entry: dict) -> bool:
+        """ Check if a chunk could contain any matching tweets.
+
+        Args:
+            entry: The chunk's manifest entry.
+        """
+
+        if entry["tweets"] == 0:
+            return False
+        if self.min_id is not None and entry["max_id"] is not None \
+                and entry["max_id"] < self.min_id:
+            return False
+        if self.max_id is not None and entry["min_id"] is not None \
+                and entry["min_id"] > self.max_id:
+            return False
+        if self.bbox is not None:
+            if entry["bbox"] is None:
+                return False
+            (min_lon, min_lat, max_lon, max_lat) = entry["bbox"]
+            if (max_lon < self.bbox[0] or min_lon > self.bbox[2]
+                    or max_lat < self.bbox[1] or min_lat > self.bbox[3]):
+                return False
+        return True
+
+    def matches(self, tweet: dict) -> bool:
+        """ Check if a parsed tweet matches. """
+
+        (tweet_id, lon, lat) = tweet_stats(tweet)
+        if self.min_id is not None or self.max_id is not None:
+            if tweet_id is None:
+                return False
+            if self.min_id is not None and tweet_id < self.min_id:
+                return False
+            if self.max_id is not None and tweet_id > self.max_id:
+                return False
+        if self.bbox is not None:
+            if lon is None or lat is None:
+                return False
+            if not (self.bbox[0] <= lon <= self.bbox[2]
+                    and self.bbox[1] <= lat <= self.bbox[3]):
+                return False
+        return True
+
+class TweetSampler():
+    """ A deterministic sample of tweets, keeping a tweet if the MD5 hash of
+    its ID, or of its user's ID, falls below a threshold.
+
+    The same tweets are kept by every run and every tool, and samples are
+    nested: a 1% sample is contained in a 10% sample keyed on the same ID.
+    Sampling by user keeps or drops all of a user's tweets together.
+
+    Attributes:
+        fraction: The fraction of tweets, or of users, to keep.
+        key: "tweet" to sample by tweet ID, or "user" to sample by user ID.
+        threshold: The largest 64-bit hash prefix that is kept, exclusive.
+    """
+
+    KEYS = ("tweet", "user")
+
+    def __init__(self, fraction: float, key: str = "tweet"):
+        """ Initialize TweetSampler class.
+
+        Args:
+            fraction: The fraction of tweets, or of users, to keep; must be
+                greater than 0 and at most 1.
+            key: "tweet" or "user".
+        """
+
+        if not 0 < fraction <= 1:
+            raise ValueError("the sample fraction must be in (0, 1]")
+        if key not in self.KEYS:
+            raise ValueError("the sample key must be one of {}".format(
+                ", ".join(self.KEYS)
+            ))
+
+        self.fraction = fraction
+        self.key = key
+        self.threshold = int(fraction * 2 ** 64)
+        self.pattern = TWEET_ID_PATTERN if key == "tweet" else USER_ID_PATTERN
+
+    def keeps_id(self, id_: int) -> bool:
+        """ Check if a tweet or user ID is in the sample. """
+
+        return int.from_bytes(md5_id(id_).digest()[:8], "big") \
+            < self.threshold
+
+    def keeps(self, tweet: dict) -> bool:
+        """ Check if a parsed tweet is in the sample. Tweets without the ID
+        that the sample is keyed on are dropped. """
+
+        try:
+            if self.key == "tweet":
+                id_ = convert_nlong(tweet["id"])
+            else:
+                id_ = convert_nlong(tweet["user"]["id"])
+            return self.keeps_id(int(id_))
+        except (KeyError, TypeError, ValueError):
+            return False
+
+    def keeps_raw(self, tweet_bytes: bytes) -> bool:
+        """ Check if a tweet is in the sample by finding its ID in the raw
+        data, only parsing it if the ID cannot be found unambiguously. """
+
+        match = find_top_level_key(self.pattern, tweet_bytes)
+        if match is not None and match.group(1) is not None:
+            return self.keeps_id(int(match.group(1)))
+        return self.keeps(json.loads(tweet_bytes))
+
+def write_id_index(path: str,
+                   blocks: typing.List[typing.List[int]]) -> None:
+    """ Write the sparse ID index of a sorted chunk.
+
+    Args:
+        path: The path to the chunk file, which must be complete.
+        blocks: A list of [first ID, compressed offset, uncompressed offset]
+            triples, one for each independently compressed block of the
+            chunk, in order.
+    """
+
+    stat = os.stat(path)
+    write_json_atomic(path + ID_INDEX_SUFFIX, {
+        "source_size": stat.st_size,
+        "source_mtime": stat.st_mtime,
+        "blocks": blocks
+    })
+
+def load_id_index(path: str) -> typing.Optional[typing.List[typing.List[int]]]:
+    """ Load the sparse ID index of a sorted chunk.
+
+    Args:
+        path: The path to the chunk file.
+
+    Returns:
+        The blocks of the chunk as given to `write_id_index`, or None if the
+        chunk has no index or if the chunk was modified after the index was
+        written, e.g. because more tweets were appended to it.
+    """
+
+    try:
+        with open(path + ID_INDEX_SUFFIX) as index_fp:
+            index = json.load(index_fp)
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    if index["source_size"] != stat.st_size \
+            or index["source_mtime"] != stat.st_mtime:
+        return None
+    return index["blocks"]
+
+def read_tweets(path: str,
+                predicate: TweetPredicate = None) -> typing.Iterator[bytes]:
+    """ Read the lines of an input file that may match a predicate.
+
+    If the file is a chunk sorted by tweet ID with a valid index, reading
+    starts at the block that may contain the predicate's smallest ID and stops
+    at the first tweet past its largest ID. Otherwise, every line is read.
+    Either way, lines that don't match may be returned, so the predicate must
+    still be checked.
+
+    Args:
+        path: The path to the file.
+        predicate: The predicate, or None to read every line.
+
+    Yields:
+        Raw lines, including their newlines.
+    """
+
+    for (_, line) in read_tweets_from(path, predicate):
+        yield line
+
+def read_tweets_from(path: str,
+                     predicate: TweetPredicate = None,
+                     start: int = 0
+                     ) -> typing.Iterator[typing.Tuple[int, bytes]]:
+    """ Read the lines of an input file that may match a predicate, starting
+    at an uncompressed offset, and keep track of the offset.
+
+    This is `read_tweets` for readers that need to resume reading where they
+    left off, e.g. after a crash.
+
+    Args:
+        path: The path to the file.
+        predicate: The predicate, or None to read every line.
+        start: The uncompressed offset of the first line to read, e.g. the
+            last offset yielded by a previous read. It must be the start of a
+            line.
+
+    Yields:
+        Tuples of (the uncompressed offset just past the line, the raw line
+        including its newline).
+    """
+
+    blocks = None
+    if predicate is not None and (
+            predicate.min_id is not None or predicate.max_id is not None
+        ):
+        blocks = load_id_index(path)
+
+    if not blocks:
+        with open_range(path, start) as input_fp:
+            position = start
+            for line in input_fp:
+                position += len(line)
+                yield (position, line)
+        return
+
+    block = 0
+    if predicate.min_id is not None:
+        # copies of the smallest ID may also be at the end of the block
+        # before the first block starting with it
+        block = max(bisect.bisect_left(
+            [first_id for (first_id, _, _) in blocks], predicate.min_id
+        ) - 1, 0)
+    # blocks are compressed independently, so a resumed read starts at the
+    # block containing `start`
+    while block + 1 < len(blocks) and blocks[block + 1][2] <= start:
+        block += 1
+
+    raw_fp = open(path, "rb")
+    raw_fp.seek(blocks[block][1])
+    position = blocks[block][2]
+    with codec_for_path(path).reader(raw_fp) as input_fp:
+        while position < start:
+            skipped = len(input_fp.read(min(start - position, SCAN_BLOCK_SIZE)))
+            if not skipped:
+                return
+            position += skipped
+        for line in input_fp:
+            if predicate.max_id is not None:
+                tweet_id = scan_tweet_id(line)
+                if tweet_id is not None and tweet_id > predicate.max_id:
+                    break
+            position += len(line)
+            yield (position, line)
+
+def find_manifest_entry(path: str,
+                        cache: typing.Dict[str, dict] = None
+                        ) -> typing.Optional[dict]:
+    """ Find the manifest entry of a chunk file, looking for a manifest in the
+    chunk's directory and then in its parent directories, since chunks may be
+    nested (see chunker.CompositeChunker).
+
+    Args:
+        path: The path to the chunk file.
+        cache: A dict used to cache loaded manifests between calls.
+
+    Returns:
+        The manifest entry, or None if the chunk is not in a manifest.
+    """
+
+    if cache is None:
+        cache = {}
+
+    path = os.path.abspath(path)
+    directory = os.path.dirname(path)
+    while True:
+        if directory not in cache:
+            cache[directory] = load_manifest(directory)
+        if cache[directory]:
+            return cache[directory].get(os.path.relpath(path, directory))
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
+
+def prune_inputs(inputs: typing.List[str],
+                 predicate: typing.Optional[TweetPredicate]
+                 ) -> typing.List[str]:
+    """ Remove chunk files that cannot contain tweets matching a predicate,
+    according to their manifests. Files that are not in a manifest are kept.
+
+    Args:
+        inputs: A list of paths to input files.
+        predicate: The predicate, or None to keep all files.
+
+    Returns:
+        A new list containing the files that may contain matching tweets.
+    """
+
+    if predicate is None:
+        return list(inputs)
+
+    cache = {} # type: typing.Dict[str, dict]
+    kept = []
+    for path in inputs:
+        entry = find_manifest_entry(path, cache)
+        if entry is None or predicate.may_match(entry):
+            kept.append(path)
+    return kept
+
+def parse_time(time_str: str) -> float:
+    """ Parse an ISO 8601 date or time into a Unix timestamp, assuming UTC
+    unless another time zone is given. """
+
+    time = datetime.datetime.fromisoformat(time_str)
+    if time.tzinfo is None:
+        time = time.replace(tzinfo=datetime.timezone.utc)
+    return time.timestamp()
+
+def add_predicate_arguments(parser: argparse.ArgumentParser) -> None:
+    """ Add command line arguments for a TweetPredicate to a parser. """
+
+    parser.add_argument(
+        "--min-id", type=int,
+        help="only include tweets with at least this ID."
+    )
+    parser.add_argument(
+        "--max-id", type=int,
+        help="only include tweets with at most this ID."
+    )
+    parser.add_argument(
+        "--since", type=parse_time,
+        help="only include tweets posted at or after this ISO 8601 date or"
+             " time, in UTC unless specified, e.g. 2020-01-02 or"
+             " 2020-01-02T12:00."
+    )
+    parser.add_argument(
+        "--until", type=parse_time,
+        help="only include tweets posted before this ISO 8601 date or time."
+    )
+    parser.add_argument(
+        "--bbox", type=lambda bbox: [float(x) for x in bbox.split(",")],
+        metavar="MIN_LON,MIN_LAT,MAX_LON,MAX_LAT",
+        help="only include tweets whose coordinates are in this bounding box."
+    )
+
+def predicate_from_args(args: argparse.Namespace
+                        ) -> typing.Optional[TweetPredicate]:
+    """ Create a TweetPredicate from arguments added by
+    `add_predicate_arguments`, or None if none of them were given. """
+
+    if all(
+            getattr(args, name) is None
+            for name in ["min_id", "max_id", "since", "until", "bbox"]
+        ):
+        return None
+
+    return TweetPredicate(
+        min_id=args.min_id, max_id=args.max_id,
+        since=args.since, until=args.until, bbox=args.bbox
+    )
+
+def add_sample_arguments(parser: argparse.ArgumentParser) -> None:
+    """ Add command line arguments for a TweetSampler to a parser. """
+
+    parser.add_argument(
+        "--sample", type=float, metavar="FRACTION",
+        help="only include a deterministic sample of this fraction of tweets,"
+             " e.g. 0.01, chosen by the MD5 hash of their IDs. the same"
+             " tweets are chosen by chunker.py, tweets-to-csv.py and"
+             " tweets-to-sqlite.py, and smaller samples are contained in"
+             " larger ones."
+    )
+    parser.add_argument(
+        "--sample-by", choices=TweetSampler.KEYS, default="tweet",
+        help="with --sample, hash tweet IDs (default) or user IDs; sampling"
+             " by user keeps all of the tweets of the sampled users."
+    )
+
+def sampler_from_args(args: argparse.Namespace,
+                      parser: argparse.ArgumentParser = None
+                      ) -> typing.Optional[TweetSampler]:
+    """ Create a TweetSampler from arguments added by `add_sample_arguments`,
+    or None if --sample was not given. Invalid arguments are reported with
+    `parser.error` if a parser is given. """
+
+    if args.sample is None:
+        return None
+    try:
+        return TweetSampler(args.sample, args.sample_by)
+    except ValueError as error:
+        if parser is None:
+            raise
+        parser.error(str(error))
+        raise
+
+class Codec():
+    """ A compression format for newline-delimited JSON files.
+
+    Every codec can be appended to: opening an existing file in append mode
+    adds a new GZIP member, zstd frame, or LZ4 frame, and files made of several
+    of these are read back as a single stream. This also means that files can
+    be concatenated byte by byte, as chunker.py does when merging partitions.
+
+    Attributes:
+        name: The name used to select the codec, e.g. on the command line.
+        suffix: The file extension of files using the codec, or "" if none.
+        default_level: The compression level used if none is given.
+        threads: True if the codec can compress with several threads.
+    """
+
+    name = None # type: str
+    suffix = None # type: str
+    default_level = None # type: typing.Optional[int]
+    threads = False
+
+    @staticmethod
+    def available() -> bool:
+        """ Check if the module needed by the codec is installed. """
+
+        return True
+
+    def open(self,
+             path: str,
+             mode: str = "rb",
+             level: int = None,
+             threads: int = 0) -> typing.BinaryIO:
+        """ Open a file in binary mode.
+
+        Args:
+            path: The path to the file.
+            mode: "rb" to read, or "wb" or "ab" to write.
+            level: The compression level, or None for the codec's default.
+                Ignored when reading.
+            threads: The number of extra threads to compress with, or -1 to
+                use one per CPU. Ignored when reading, and by codecs that
+                cannot use threads.
+
+        Returns:
+            A file pointer.
+        """
+
+        raise NotImplementedError
+
+    def reader(self, raw_fp: typing.BinaryIO) -> typing.BinaryIO:
+        """ Decompress an open file from its current position, which must be
+        at the start of a GZIP member or frame.
+
+        Args:
+            raw_fp: A file opened for reading in binary mode.
+
+        Returns:
+            A file pointer to the decompressed data, which closes `raw_fp` when
+            closed.
+        """
+
+        raise NotImplementedError
+
+    def compress(self, data: bytes, level: int = None) -> bytes:
+        """ Compress data into a single, complete GZIP member or frame, which
+        can be appended to a file.
+
+        Args:
+            data: The data to compress.
+            level: The compression level, or None for the codec's default.
+        """
+
+        raise NotImplementedError
+
+class PlainCodec(Codec):
+    """ Uncompressed files. """
+
+    name = "none"
+    suffix = ""
+
+    def open(self, path, mode="rb", level=None, threads=0):
+        return open(path, mode)
+
+    def reader(self, raw_fp):
+        return raw_fp
+
+    def compress(self, data, level=None):
+        return data
+
+class GzipCodec(Codec):
+    """ GZIP files. The default level matches that of `gzip.open`. """
+
+    name = "gzip"
+    suffix = ".gz"
+    default_level = 9
+
+    def open(self, path, mode="rb", level=None, threads=0):
+        if mode.startswith("r"):
+            return gzip.open(path, mode)
+        return gzip.open(
+            path, mode,
+            compresslevel=self.default_level if level is None else level
+        )
+
+    def reader(self, raw_fp):
+        return ClosingReader(gzip.GzipFile(fileobj=raw_fp, mode="rb"), raw_fp)
+
+    def compress(self, data, level=None):
+        return gzip.compress(
+            data, compresslevel=self.default_level if level is None else level
+        )
+
+class ClosingReader(io.BufferedReader):
+    """ A buffered reader of a decompressing file object that also closes the
+    underlying file, which GzipFile and LZ4FrameFile leave open when given a
+    file object. """
+
+    def __init__(self, decompressed_fp: typing.BinaryIO,
+                 raw_fp: typing.BinaryIO):
+        super().__init__(decompressed_fp)
+        self.raw_fp = raw_fp
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self.raw_fp.close()
+
+class ZstdCodec(Codec):
+    """ Zstandard files, using the zstandard module. """
+
+    name = "zstd"
+    suffix = ".zst"
+    default_level = 3
+    threads = True
+
+    @staticmethod
+    def available():
+        return zstandard is not None
+
+    def open(self, path, mode="rb", level=None, threads=0):
+        raw_fp = open(path, mode)
+        if mode.startswith("r"):
+            return self.reader(raw_fp)
+        return zstandard.ZstdCompressor(
+            level=self.default_level if level is None else level,
+            threads=threads
+        ).stream_writer(raw_fp, closefd=True)
+
+    def reader(self, raw_fp):
+        return io.BufferedReader(
+            zstandard.ZstdDecompressor().stream_reader(
+                raw_fp, read_across_frames=True, closefd=True
+            )
+        )
+
+    def compress(self, data, level=None):
+        return zstandard.ZstdCompressor(
+            level=self.default_level if level is None else level
+        ).compress(data)
+
+class Lz4Codec(Codec):
+    """ LZ4 frame files, using the lz4 module. """
+
+    name = "lz4"
+    suffix = ".lz4"
+    default_level = 0
+
+    @staticmethod
+    def available():
+        return lz4_frame is not None
+
+    def open(self, path, mode="rb", level=None, threads=0):
+        if mode.startswith("r"):
+            return lz4_frame.open(path, mode)
+        return lz4_frame.open(
+            path, mode,
+            compression_level=self.default_level if level is None else level
+        )
+
+    def reader(self, raw_fp):
+        return ClosingReader(lz4_frame.LZ4FrameFile(raw_fp, "rb"), raw_fp)
+
+    def compress(self, data, level=None):
+        return lz4_frame.compress(
+            data,
+            compression_level=self.default_level if level is None else level
+        )
+
+CODECS = {
+    codec.name: codec
+    for codec in [PlainCodec(), GzipCodec(), ZstdCodec(), Lz4Codec()]
+} # type: typing.Dict[str, Codec]
+
+def get_codec(name: str) -> Codec:
+    """ Get a codec by name.
+
+    Raises:
+        ValueError: If there is no such codec, or if the module it needs is not
+            installed.
+    """
+
+    try:
+        codec = CODECS[name]
+    except KeyError:
+        raise ValueError("unknown codec {}; available codecs: {}".format(
+            name, ", ".join(available_codecs())
+        ))
+    if not codec.available():
+        raise ValueError(
+            "codec {} requires a module that is not installed".format(name)
+        )
+    return codec
+
+def available_codecs() -> typing.List[str]:
+    """ List the names of the codecs that can be used. """
+
+    return [name for (name, codec) in CODECS.items() if codec.available()]
+
+def codec_for_path(path: str) -> Codec:
+    """ Find the codec of a file based on its extension, assuming that files
+    with an unknown extension are uncompressed.
+
+    Raises:
+        ValueError: If the module the codec needs is not installed.
+    """
+
+    for codec in CODECS.values():
+        if codec.suffix and path.endswith(codec.suffix):
+            return get_codec(codec.name)
+    return CODECS["none"]
+
+def is_gzip(path: str) -> bool:
+    """ Check if a file is GZIP compressed, based on its extension. """
+
+    return path.endswith(".gz")
+
+def open_input(path: str, compressed: bool = None) -> typing.BinaryIO:
+    """ Open a newline-delimited JSON file for reading in binary mode.
+
+    Args:
+        path: The path to the file.
+        compressed: A bool describing if GZIP compression was used. If None,
+            the codec is chosen based on the file's extension; see
+            `codec_for_path`.
+
+    Returns:
+        A file pointer.
+    """
+
+    if compressed is None:
+        return codec_for_path(path).open(path, "rb")
+
+    if compressed:
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+def scan_gzip_members(path: str) -> typing.Tuple[list, int]:
+    """ Find where each member of a GZIP file starts by decompressing it.
+
+    Args:
+        path: The path to the GZIP file.
+
+    Returns:
+        A tuple of (members, uncompressed size), where members is a list of
+        [compressed offset, uncompressed offset] pairs, one per member.
+    """
+
+    members = [[0, 0]]
+    uncompressed_offset = 0
+    bytes_read = 0
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+
+    with open(path, "rb") as input_fp:
+        for block in iter(lambda: input_fp.read(SCAN_BLOCK_SIZE), b""):
+            bytes_read += len(block)
+            while block:
+                uncompressed_offset += len(decompressor.decompress(block))
+                if not decompressor.eof:
+                    break
+                block = decompressor.unused_data
+                decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+                members.append(
+                    [bytes_read - len(block), uncompressed_offset]
+                )
+
+    # the last "member" only marks the end of the file
+    if members[-1][0] >= bytes_read and len(members) > 1:
+        members.pop()
+
+    return (members, uncompressed_offset)
+
+def gzip_index(path: str,
+               build: bool = True,
+               spacing: int = DEFAULT_INDEX_SPACING
+               ) -> typing.Optional[dict]:
+    """ Load or build the checkpoint index of a GZIP file.
+
+    A cached index is only used if the file has not changed since the index
+    was built. If the index cannot be cached next to the file, e.g. because
+    the directory is read-only, it is returned without being cached.
+
+    Args:
+        path: The path to the GZIP file.
+        build: If False and there is no usable cached index, return None
+            instead of building one.
+        spacing: The distance between checkpoints if indexed_gzip is used.
+
+    Returns:
+        A dict containing the uncompressed size of the file
+        ("uncompressed_size"), the list of members as returned by
+        `scan_gzip_members` ("members"), and whether an indexed_gzip index
+        is available ("indexed"). If indexed_gzip is installed, the file is
+        only decompressed once, to build its index, which covers every member;
+        the list of members then only contains the first one.
+    """
+
+    stat = os.stat(path)
+    info_path = path + GZIP_INDEX_INFO_SUFFIX
+    try:
+        with open(info_path) as info_fp:
+            info = json.load(info_fp)
+        if (info["source_size"] == stat.st_size
+                and info["source_mtime"] == stat.st_mtime
+                and (not info["indexed"]
+                     or os.path.isfile(path + GZIP_INDEX_SUFFIX))):
+            # the index may have been built where indexed_gzip is installed
+            info["indexed"] = info["indexed"] and indexed_gzip is not None
+            return info
+    except (OSError, ValueError, KeyError):
+        pass
+
+    if not build:
+        return None
+
+    info = {
+        "source_size": stat.st_size,
+        "source_mtime": stat.st_mtime,
+        "uncompressed_size": 0,
+        "members": [[0, 0]],
+        "indexed": False
+    }
+
+    if indexed_gzip is not None:
+        try:
+            with indexed_gzip.IndexedGzipFile(
+                    path, spacing=spacing
+                ) as input_fp:
+                input_fp.build_full_index()
+                info["uncompressed_size"] = input_fp.seek(0, io.SEEK_END)
+                input_fp.export_index(path + GZIP_INDEX_SUFFIX)
+            info["indexed"] = True
+        except OSError:
+            pass
+    if not info["indexed"]:
+        (info["members"], info["uncompressed_size"]) = scan_gzip_members(path)
+
+    try:
+        with open(info_path, "w") as info_fp:
+            json.dump(info, info_fp)
+    except OSError:
+        pass
+
+    return info
+
+def is_splittable(path: str) -> bool:
+    """ Check if an input file can be split into ranges, i.e. if it is a GZIP
+    file or an uncompressed file. """
+
+    return codec_for_path(path).name in ("gzip", "none")
+
+def input_size(path: str) -> int:
+    """ Get the uncompressed size of an input file, building the checkpoint
+    index of GZIP files if necessary. """
+
+    if is_gzip(path):
+        return gzip_index(path)["uncompressed_size"]
+    return os.path.getsize(path)
+
+def split_input(path: str, parts: int) -> typing.List[InputRange]:
+    """ Split an input file into ranges that can be read concurrently.
+
+    Args:
+        path: The path to the file.
+        parts: The desired number of ranges.
+
+    Returns:
+        A list of up to `parts` consecutive ranges covering the whole file,
+        in order. Fewer ranges are returned if the file cannot be split
+        further, e.g. a GZIP file with a single member when indexed_gzip is
+        not installed, or a file compressed with another codec.
+    """
+
+    disk_size = os.path.getsize(path)
+    if parts <= 1 or not is_splittable(path):
+        return [InputRange(path, 0, None, disk_size)]
+
+    if is_gzip(path):
+        info = gzip_index(path)
+        size = info["uncompressed_size"]
+        if info["indexed"]:
+            split_points = None
+        else:
+            split_points = [offset for (_, offset) in info["members"]]
+    else:
+        size = disk_size
+        split_points = None
+
+    boundaries = [0]
+    for part in range(1, parts):
+        target = size * part // parts
+        if split_points is not None:
+            target = min(
+                split_points, key=lambda offset: abs(offset - target)
+            )
+        if boundaries[-1] < target < size:
+            boundaries.append(target)
+    boundaries.append(size)
+
+    return [
+        InputRange(
+            path, start, end,
+            disk_size * (end - start) // size if size else 0
+        )
+        for (start, end) in zip(boundaries[:-1], boundaries[1:])
+    ]
+
+def skip(input_fp: typing.BinaryIO, size: int) -> None:
+    """ Skip bytes of a file that can't seek, by reading them, stopping at
+    the end of the file. """
+
+    while size > 0:
+        skipped = len(input_fp.read(min(size, SCAN_BLOCK_SIZE)))
+        if not skipped:
+            break
+        size -= skipped
+
+@contextlib.contextmanager
+def open_range(path: str, start: int = 0):
+    """ Open an input file for reading in binary mode, starting at the given
+    uncompressed byte.
+
+    Args:
+        path: The path to the file.
+        start: The offset to start reading from.
+
+    Yields:
+        A file pointer positioned at `start`.
+    """
+
+    if start == 0:
+        with open_input(path) as input_fp:
+            yield input_fp
+        return
+
+    # other codecs can only be read from the start
+    if not is_splittable(path):
+        with open_input(path) as input_fp:
+            skip(input_fp, start)
+            yield input_fp
+        return
+
+    if not is_gzip(path):
+        with open(path, "rb") as input_fp:
+            input_fp.seek(start)
+            yield input_fp
+        return
+
+    # building the index would take a pass over the whole file, e.g. to resume
+    # an import, so without one the file is decompressed from the start
+    info = gzip_index(path, build=False)
+    if info is None:
+        with open_input(path) as input_fp:
+            skip(input_fp, start)
+            yield input_fp
+        return
+
+    if info["indexed"]:
+        with indexed_gzip.IndexedGzipFile(path) as input_fp:
+            input_fp.import_index(path + GZIP_INDEX_SUFFIX)
+            input_fp.seek(start)
+            yield input_fp
+        return
+
+    # start decompressing at the last member starting at or before `start`
+    (compressed_offset, uncompressed_offset) = max(
+        (member for member in info["members"] if member[1] <= start),
+        key=lambda member: member[1]
+    )
+    with open(path, "rb") as raw_fp:
+        raw_fp.seek(compressed_offset)
+        with gzip.GzipFile(fileobj=raw_fp, mode="rb") as input_fp:
+            input_fp.seek(start - uncompressed_offset)
+            yield input_fp
+
+def read_range(path: str,
+               start: int = 0,
+               end: int = None) -> typing.Iterator[bytes]:
+    """ Read the lines of a range of an input file.
+
+    A range other than the first skips everything up to and including the
+    first newline at or after its start, since that line belongs to the
+    previous range; each range then reads every line starting at or before its
+    end, reading past its end to finish the last line. This way, every line is
+    read exactly once without having to look at the byte before the start of a
+    range, which could be in a different GZIP member.
+
+    Args:
+        path: The path to the file.
+        start: The start of the range.
+        end: The end of the range, or None for the end of the file.
+
+    Yields:
+        Raw lines, including their newlines.
+    """
+
+    with open_range(path, start) as input_fp:
+        position = start
+        if start > 0:
+            position += len(input_fp.readline())
+
+        while end is None or position <= end:
+            line = input_fp.readline()
+            if not line:
+                break
+            position += len(line)
+            yield line
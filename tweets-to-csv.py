@@ -2,6 +2,9 @@
 """ Flatten a single, compressed, NDJSON file containing tweet data into a
 compressed CSV file.
 
+The CSV file is compressed with the same codec as the NDJSON file (see
+`tweetio.Codec`), or with GZIP if the NDJSON file is uncompressed.
+
 Complicated geometries, e.g. place.bounding_box, will be represented as WKB
 hex strings, and are cached to avoid expensive recomputation.
 
@@ -11,13 +14,18 @@ will mask json with this library if possible.
 
 import csv
 import functools
-import gzip
+import io
+import multiprocessing
+import multiprocessing.pool
 import os
+import shutil
 import typing
 
 import shapely.geometry
 import tqdm
 
+import tweetio
+
 try:
     import ujson as json
 except ModuleNotFoundError:
@@ -120,15 +128,22 @@ class Flattener():
 
     def __init__(self,
                  fields: typing.List[str],
-                 wkb_cache_size=DEFAULT_WKB_CACHE_SIZE):
+                 wkb_cache_size=DEFAULT_WKB_CACHE_SIZE,
+                 predicate: tweetio.TweetPredicate = None,
+                 sampler: tweetio.TweetSampler = None):
         """ Initialize Flattener class.
 
         Args:
             fields: A list of tweet fields to be flattened, with nesting
                 indicated by periods, e.g. "user.id" -> ["user"]["id"]
+            predicate: If given, only tweets matching this predicate are
+                flattened.
+            sampler: If given, only tweets in this sample are flattened.
         """
 
         self.fields = fields
+        self.predicate = predicate
+        self.sampler = sampler
 
         # we can save a lot of time by precomputing the nesting of fields into
         # values required by recursive_getitem and storing them in a dict
@@ -168,7 +183,9 @@ class Flattener():
 
     def flatten_file(self,
                      path: str,
-                     output_directory: str = None) -> None:
+                     output_directory: str = None,
+                     pool: multiprocessing.pool.Pool = None,
+                     jobs: int = 1) -> None:
         """ Flatten a newline-delimited JSON file
 
         Args:
@@ -176,9 +193,24 @@ class Flattener():
             output_directory: The location where the converted file should be
                 saved. If None, the converted file will be saved next to the
                 input file.
+            pool: If given, split the file into `jobs` ranges (see
+                `tweetio.split_input`) and flatten them concurrently using this
+                pool. The ranges are then concatenated in order, so the result
+                is the same as flattening the file in one go.
+            jobs: The number of ranges to split the file into.
         """
 
-        output_file = path.replace("json", "csv")
+        # the output is compressed with the codec of the input, or with gzip if
+        # the input is uncompressed; only the extension of the file is replaced
+        codec = tweetio.codec_for_path(path)
+        (output_file, extension) = os.path.splitext(
+            path[:len(path) - len(codec.suffix)]
+        )
+        if extension != ".json":
+            output_file += extension
+        if codec.name == "none":
+            codec = tweetio.get_codec("gzip")
+        output_file += ".csv" + codec.suffix
 
         if output_directory is not None:
             output_file = os.path.join(
@@ -188,21 +220,89 @@ class Flattener():
         if not os.path.isfile(output_file):
             temp_file = output_file + ".part"
 
-            with gzip.open(path, "r") as input_fp,\
-                 gzip.open(temp_file, "wt") as output_fp:
-                writer = csv.writer(output_fp)
-                writer.writerow(self.fields)
-
-                for line in tqdm.tqdm(
-                        input_fp,
-                        desc=os.path.basename(input_file),
-                        position=1,
-                        leave=None
-                    ):
-                    writer.writerow(self.flatten_tweet(json.loads(line)))
+            ranges = [tweetio.InputRange(path)]
+            if pool is not None and jobs > 1:
+                ranges = tweetio.split_input(path, jobs)
+
+            if len(ranges) == 1:
+                flatten_range(self, path, temp_file, codec=codec)
+            else:
+                part_files = [
+                    "{}.{}".format(temp_file, part)
+                    for part in range(len(ranges))
+                ]
+                pool.starmap(
+                    flatten_range,
+                    [
+                        (
+                            self, path, part_file, input_range.start,
+                            input_range.end, part == 0, part + 1, codec
+                        )
+                        for (part, (part_file, input_range))
+                        in enumerate(zip(part_files, ranges))
+                    ]
+                )
+
+                # concatenated compressed files are read as a single file
+                with open(temp_file, "wb") as output_fp:
+                    for part_file in part_files:
+                        with open(part_file, "rb") as part_fp:
+                            shutil.copyfileobj(part_fp, output_fp)
+                        os.remove(part_file)
 
             os.rename(temp_file, output_file)
 
+def flatten_range(flattener: Flattener,
+                  path: str,
+                  output_file: str,
+                  start: int = 0,
+                  end: int = None,
+                  header: bool = True,
+                  position: int = 1,
+                  codec: tweetio.Codec = None) -> None:
+    """ Flatten a range of a newline-delimited JSON file into a compressed CSV
+    file.
+
+    Args:
+        flattener: The Flattener to use.
+        path: The file to be flattened.
+        output_file: The file to write the flattened tweets to.
+        start: The start of the range; see `tweetio.read_range`.
+        end: The end of the range, or None for the end of the file.
+        header: If True, start the CSV file with a header.
+        position: The position of the progress bar.
+        codec: The codec to compress the CSV file with; GZIP by default.
+    """
+
+    if codec is None:
+        codec = tweetio.get_codec("gzip")
+
+    with io.TextIOWrapper(codec.open(output_file, "wb")) as output_fp:
+        writer = csv.writer(output_fp)
+        if header:
+            writer.writerow(flattener.fields)
+
+        # sorted chunks are only read within the predicate's ID range
+        if start == 0 and end is None:
+            lines = tweetio.read_tweets(path, flattener.predicate)
+        else:
+            lines = tweetio.read_range(path, start, end)
+
+        for line in tqdm.tqdm(
+                lines,
+                desc=os.path.basename(path),
+                position=position,
+                leave=None
+            ):
+            # sampling is decided before parsing the tweet
+            if flattener.sampler is not None \
+                    and not flattener.sampler.keeps_raw(line):
+                continue
+            tweet = json.loads(line)
+            if flattener.predicate is None \
+                    or flattener.predicate.matches(tweet):
+                writer.writerow(flattener.flatten_tweet(tweet))
+
 if __name__ == "__main__":
     #pylint: disable=invalid-name
 
@@ -224,6 +324,14 @@ if __name__ == "__main__":
              " specified, the output files will be in the same directory as"
              " the original files"
     )
+    parser.add_argument(
+        "-j", "--jobs", default=1, type=int,
+        help="number of processes to flatten each file with. files are split"
+             " into ranges, which requires GZIP files to be indexed in a"
+             " single pass first; see tweetio.py."
+    )
+    tweetio.add_predicate_arguments(parser)
+    tweetio.add_sample_arguments(parser)
     args = parser.parse_args()
 
     if args.fields is None:
@@ -231,10 +339,28 @@ if __name__ == "__main__":
     else:
         args.fields = args.fields.split(",")
 
-    flattener = Flattener(args.fields)
+    # skip chunks that cannot contain matching tweets, according to the
+    # manifests written by chunker.py
+    predicate = tweetio.predicate_from_args(args)
+    inputs = tweetio.prune_inputs(args.inputs, predicate)
+    if len(inputs) < len(args.inputs):
+        print("skipping {} of {} files that cannot match".format(
+            len(args.inputs) - len(inputs), len(args.inputs)
+        ))
+
+    flattener = Flattener(
+        args.fields, predicate=predicate,
+        sampler=tweetio.sampler_from_args(args, parser)
+    )
+    pool = multiprocessing.Pool(args.jobs) if args.jobs > 1 else None
     for input_file in tqdm.tqdm(
-            args.inputs,
+            inputs,
             desc="converting files",
             position=0
         ):
-        flattener.flatten_file(input_file, args.output_directory)
+        flattener.flatten_file(
+            input_file, args.output_directory, pool, args.jobs
+        )
+    if pool is not None:
+        pool.close()
+        pool.join()
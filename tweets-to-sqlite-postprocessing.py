@@ -49,6 +49,12 @@ INSERT INTO fts_{table}_{column}_{tokenizer}(id, content)
     FROM {table};
 """
 
+# in databases created with `tweets-to-sqlite.py --schema interned`, some tables
+# are views of tables with this suffix, whose interned columns have the suffix
+# below and are indexed instead
+INTERNED_TABLE_SUFFIX = "_data"
+INTERNED_COLUMN_SUFFIX = "_id"
+
 # we are only running this once; no need to embed variables for looping
 SQL_SPATIALITE_INIT = """
 SELECT load_extension('mod_spatialite');
@@ -92,6 +98,18 @@ def postprocess(tweets_db_path: str) -> None:
     # normal indices
 
     for (table, columns) in SQL_NORMAL_INDICES.items():
+        if table not in tables and table + INTERNED_TABLE_SUFFIX in tables:
+            table += INTERNED_TABLE_SUFFIX
+            table_columns = set(
+                row[1] for row in tweets_db.execute(
+                    "PRAGMA table_info({})".format(table)
+                )
+            )
+            columns = [
+                column if column in table_columns
+                else column + INTERNED_COLUMN_SUFFIX
+                for column in columns
+            ]
         for column in columns:
             name = SQL_NORMAL_NAME_TEMPLATE.format(table=table, column=column)
             if name in indices:
@@ -6,12 +6,23 @@
 For higher performance, ensure that the ujson library is installed; the script
 will mask json with this library if possible. """
 
-import gzip
+import collections
+import itertools
+import multiprocessing
+import multiprocessing.pool
+import os
+import queue
+import re
+import shutil
 import sqlite3
+import tempfile
+import time
 import typing
 
 import tqdm
 
+import tweetio
+
 try:
     import ujson as json
 except ModuleNotFoundError:
@@ -83,10 +94,257 @@ CREATE TABLE IF NOT EXISTS mentions(             -- entities.user_mentions
 );
 CREATE TABLE IF NOT EXISTS imported_files(
     full_path TEXT,
-    last_modified REAL -- unix time
+    last_modified REAL, -- unix time
+    lines INTEGER,      -- the number of lines read
+    position INTEGER,   -- the uncompressed offset to resume reading from
+    complete INTEGER DEFAULT 1
+);
+"""
+
+# the interned schema (--schema interned) stores repeated short strings once,
+# in lookup tables, and refers to them by integer IDs in the *_data tables.
+# views with the names and columns of the standard schema decode them, and
+# INSTEAD OF triggers on the views intern values inserted through them; see
+# `interned_views_sql`
+SQL_INTERNED_SCHEMA = """
+CREATE TABLE IF NOT EXISTS langs(
+    id INTEGER PRIMARY KEY,
+    value TEXT UNIQUE NOT NULL
+);
+CREATE TABLE IF NOT EXISTS time_zones(
+    id INTEGER PRIMARY KEY,
+    value TEXT UNIQUE NOT NULL
+);
+CREATE TABLE IF NOT EXISTS countries(
+    id INTEGER PRIMARY KEY,
+    value TEXT UNIQUE NOT NULL
+);
+CREATE TABLE IF NOT EXISTS hashtag_texts(
+    id INTEGER PRIMARY KEY,
+    value TEXT UNIQUE NOT NULL
+);
+CREATE TABLE IF NOT EXISTS users_data(
+    id INTEGER PRIMARY KEY,
+    name TEXT,
+    screen_name TEXT,
+    description TEXT,
+    verified INTEGER,
+    statuses_count INTEGER,
+    followers_count INTEGER,
+    friends_count INTEGER,
+    time_zone_id INTEGER,
+    lang_id INTEGER,
+    location TEXT,
+    FOREIGN KEY(time_zone_id) REFERENCES time_zones(id),
+    FOREIGN KEY(lang_id) REFERENCES langs(id)
+);
+CREATE TABLE IF NOT EXISTS places_data(
+    id TEXT PRIMARY KEY,
+    country_id INTEGER,
+    full_name TEXT,
+    min_lon REAL,
+    min_lat REAL,
+    max_lon REAL,
+    max_lat REAL,
+    FOREIGN KEY(country_id) REFERENCES countries(id)
+);
+CREATE TABLE IF NOT EXISTS tweets_data(
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER,
+    place_id TEXT,
+    created_at TEXT,
+    timestamp REAL,
+    lang_id INTEGER,
+    quoted_status_id INTEGER,
+    in_reply_to_status_id INTEGER,
+    in_reply_to_user_id INTEGER,
+    lat REAL,
+    lon REAL,
+    text TEXT,
+    FOREIGN KEY(user_id) REFERENCES users_data(id),
+    FOREIGN KEY(place_id) REFERENCES places_data(id),
+    FOREIGN KEY(lang_id) REFERENCES langs(id)
+);
+CREATE TABLE IF NOT EXISTS urls(                 -- entities.urls
+    tweet_id INTEGER,
+    url TEXT,                                    -- .expanded_url
+    shortened_url TEXT,                          -- .url
+    FOREIGN KEY(tweet_id) REFERENCES tweets_data(id)
+);
+CREATE TABLE IF NOT EXISTS media(                -- entities.media
+    tweet_id INTEGER,
+    type TEXT,
+    url TEXT,                                    -- .media_url
+    shortened_url TEXT,                          -- .url
+    FOREIGN KEY(tweet_id) REFERENCES tweets_data(id)
+);
+CREATE TABLE IF NOT EXISTS hashtags_data(        -- entities.hashtags
+    tweet_id INTEGER,
+    text_id INTEGER,
+    FOREIGN KEY(tweet_id) REFERENCES tweets_data(id),
+    FOREIGN KEY(text_id) REFERENCES hashtag_texts(id)
+);
+CREATE TABLE IF NOT EXISTS mentions(             -- entities.user_mentions
+    tweet_id INTEGER,
+    user_id INTEGER,
+    FOREIGN KEY(user_id) REFERENCES users_data(id),
+    FOREIGN KEY(tweet_id) REFERENCES tweets_data(id)
+);
+CREATE TABLE IF NOT EXISTS imported_files(
+    full_path TEXT,
+    last_modified REAL, -- unix time
+    lines INTEGER,      -- the number of lines read
+    position INTEGER,   -- the uncompressed offset to resume reading from
+    complete INTEGER DEFAULT 1
+);
+"""
+
+# the compact schema (--schema compact) interns values as the interned schema
+# does, and also:
+# * stores the child tables of tweets as WITHOUT ROWID tables clustered on
+#   their keys, which removes the hidden rowid and keeps the records of a tweet
+#   together; exact duplicates, e.g. from importing a tweet twice, are skipped;
+# * stores the hexadecimal IDs of places as 64-bit integers; see
+#   `encode_hex_id`. the columns holding them have no type affinity, so that
+#   other IDs are stored as they are;
+# * only stores created_at if it differs from the time derived from
+#   timestamp; see `format_created_at`
+SQL_COMPACT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS langs(
+    id INTEGER PRIMARY KEY,
+    value TEXT UNIQUE NOT NULL
+);
+CREATE TABLE IF NOT EXISTS time_zones(
+    id INTEGER PRIMARY KEY,
+    value TEXT UNIQUE NOT NULL
+);
+CREATE TABLE IF NOT EXISTS countries(
+    id INTEGER PRIMARY KEY,
+    value TEXT UNIQUE NOT NULL
+);
+CREATE TABLE IF NOT EXISTS hashtag_texts(
+    id INTEGER PRIMARY KEY,
+    value TEXT UNIQUE NOT NULL
+);
+CREATE TABLE IF NOT EXISTS users_data(
+    id INTEGER PRIMARY KEY,
+    name TEXT,
+    screen_name TEXT,
+    description TEXT,
+    verified INTEGER,
+    statuses_count INTEGER,
+    followers_count INTEGER,
+    friends_count INTEGER,
+    time_zone_id INTEGER,
+    lang_id INTEGER,
+    location TEXT,
+    FOREIGN KEY(time_zone_id) REFERENCES time_zones(id),
+    FOREIGN KEY(lang_id) REFERENCES langs(id)
+);
+CREATE TABLE IF NOT EXISTS places_data(
+    id PRIMARY KEY,                              -- encode_hex_id
+    country_id INTEGER,
+    full_name TEXT,
+    min_lon REAL,
+    min_lat REAL,
+    max_lon REAL,
+    max_lat REAL,
+    FOREIGN KEY(country_id) REFERENCES countries(id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS tweets_data(
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER,
+    place_id,                                    -- encode_hex_id
+    created_at TEXT,                             -- NULL if derived
+    timestamp REAL,
+    lang_id INTEGER,
+    quoted_status_id INTEGER,
+    in_reply_to_status_id INTEGER,
+    in_reply_to_user_id INTEGER,
+    lat REAL,
+    lon REAL,
+    text TEXT,
+    FOREIGN KEY(user_id) REFERENCES users_data(id),
+    FOREIGN KEY(place_id) REFERENCES places_data(id),
+    FOREIGN KEY(lang_id) REFERENCES langs(id)
+);
+CREATE TABLE IF NOT EXISTS urls(                 -- entities.urls
+    tweet_id INTEGER,
+    url TEXT,                                    -- .expanded_url
+    shortened_url TEXT,                          -- .url
+    PRIMARY KEY(tweet_id, shortened_url),
+    FOREIGN KEY(tweet_id) REFERENCES tweets_data(id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS media(                -- entities.media
+    tweet_id INTEGER,
+    type TEXT,
+    url TEXT,                                    -- .media_url
+    shortened_url TEXT,                          -- .url
+    PRIMARY KEY(tweet_id, url),
+    FOREIGN KEY(tweet_id) REFERENCES tweets_data(id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS hashtags_data(        -- entities.hashtags
+    tweet_id INTEGER,
+    text_id INTEGER,
+    PRIMARY KEY(tweet_id, text_id),
+    FOREIGN KEY(tweet_id) REFERENCES tweets_data(id),
+    FOREIGN KEY(text_id) REFERENCES hashtag_texts(id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS mentions(             -- entities.user_mentions
+    tweet_id INTEGER,
+    user_id INTEGER,
+    PRIMARY KEY(tweet_id, user_id),
+    FOREIGN KEY(user_id) REFERENCES users_data(id),
+    FOREIGN KEY(tweet_id) REFERENCES tweets_data(id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS imported_files(
+    full_path TEXT,
+    last_modified REAL, -- unix time
+    lines INTEGER,      -- the number of lines read
+    position INTEGER,   -- the uncompressed offset to resume reading from
+    complete INTEGER DEFAULT 1
 );
 """
 
+# the schemas that a database can be created with, and their user_version
+SCHEMAS = {
+    "standard": (SQL_INIT_SCHEMA, 0),
+    "interned": (SQL_INTERNED_SCHEMA, 1),
+    "compact": (SQL_COMPACT_SCHEMA, 2)
+}
+
+# the interned columns of each table of the standard schema, and the lookup
+# tables that their values are interned into. in the interned schema, the
+# table is stored as {table}_data and the column as {column}_id
+INTERNED_COLUMNS = {
+    "users": {"time_zone": "time_zones", "lang": "langs"},
+    "places": {"country": "countries"},
+    "tweets": {"lang": "langs"},
+    "hashtags": {"text": "hashtag_texts"}
+}
+INTERNED_TABLE_SUFFIX = "_data"
+INTERNED_COLUMN_SUFFIX = "_id"
+
+# the columns that the compact schema stores hexadecimal IDs in as integers;
+# only IDs of exactly 16 lowercase hexadecimal digits are converted
+HEX_ID_COLUMNS = {
+    "places": ("id",),
+    "tweets": ("place_id",)
+}
+HEX_ID_PATTERN = re.compile("[0-9a-f]{16}")
+
+# the names used by created_at, which are not localized
+WEEKDAY_NAMES = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+MONTH_NAMES = ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep",
+               "Oct", "Nov", "Dec")
+
+# columns added to imported_files since it was first created, and their types
+IMPORTED_FILES_NEW_COLUMNS = [
+    ("lines", "INTEGER"),
+    ("position", "INTEGER"),
+    ("complete", "INTEGER DEFAULT 1")
+]
+
 SQL_HIGH_THROUGHPUT_PRAGMAS = """
 PRAGMA synchronous = OFF;
 PRAGMA journal_mode = OFF;
@@ -97,8 +355,66 @@ PRAGMA synchronous = NORMAL;
 PRAGMA journal_mode = DELETE;
 """
 
+# with write-ahead logging, commits are cheap and a crash can only lose the
+# transactions since the last checkpoint of the WAL, never corrupt the database
+SQL_WAL_PRAGMAS = """
+PRAGMA journal_mode = WAL;
+PRAGMA synchronous = NORMAL;
+"""
+
+# defaults of --wal, in MiB and lines
+DEFAULT_WAL_CACHE_SIZE = 256
+DEFAULT_WAL_MMAP_SIZE = 1024
+DEFAULT_COMMIT_EVERY = 100000
+
+# the stages of an import measured by ImportStats: reading and decompressing
+# lines, parsing them, generating records, waiting for parser processes,
+# inserting records, committing, merging shards, and finalizing staging tables
+STAGES = ("read", "parse", "records", "wait", "sqlite", "commit", "merge",
+          "finalize")
+
+# the default interval between summaries of ImportStats, in seconds
+DEFAULT_STATS_INTERVAL = 60.0
+
 NLONG = "$numberLong"
 
+# the columns of each table that records are generated for, in the order of the
+# values of SqlRecords
+TABLE_COLUMNS = {
+    "users": (
+        "id", "name", "screen_name", "description", "verified",
+        "statuses_count", "followers_count", "friends_count", "time_zone",
+        "lang", "location"
+    ),
+    "places": (
+        "id", "country", "full_name", "min_lon", "min_lat", "max_lon",
+        "max_lat"
+    ),
+    "tweets": (
+        "id", "user_id", "place_id", "created_at", "timestamp", "lang",
+        "quoted_status_id", "in_reply_to_status_id", "in_reply_to_user_id",
+        "lat", "lon", "text"
+    ),
+    "urls": ("tweet_id", "url", "shortened_url"),
+    "media": ("tweet_id", "type", "url", "shortened_url"),
+    "hashtags": ("tweet_id", "text"),
+    "mentions": ("tweet_id", "user_id")
+}
+
+# prefix of the staging tables that --bulk loads records into; see
+# `create_staging_tables`
+STAGING_PREFIX = "staging_"
+
+# the number of records of a table to collect before inserting them at once
+DEFAULT_BATCH_SIZE = 10000
+
+# the number of users and places that UpsertCache remembers by default
+DEFAULT_UPSERT_CACHE_SIZE = 100000
+
+# the number of batches that each parser process can send ahead of the writer
+# with --jobs
+DEFAULT_QUEUE_SIZE = 8
+
 def convert_nlong(nlong: dict) -> int:
     """ Extract numberLong from a Mongo value if necessary. """
 
@@ -113,13 +429,15 @@ class SqlRecord(): # pylint: disable=too-few-public-methods
     Attributes:
         table_name: The name of the table containing this record / where this
             record will be inserted.
-        data: The values of this record, represented as a dict. The keys are
-            column names and the values are the corresponding values.
+        values: The values of this record, as a tuple in the order of the
+            table's columns in `TABLE_COLUMNS`.
     """
 
+    __slots__ = ("table_name", "values")
+
     def __init__(self,
                  table_name: str,
-                 data: typing.Dict[str, typing.Union[str, int, float, None]]
+                 values: typing.Tuple[typing.Union[str, int, float, None], ...]
                  ):
         """ Initialize SqlRecord class.
 
@@ -128,7 +446,14 @@ class SqlRecord(): # pylint: disable=too-few-public-methods
         """
 
         self.table_name = table_name
-        self.data = data
+        self.values = values
+
+    @property
+    def data(self) -> typing.Dict[str, typing.Union[str, int, float, None]]:
+        """ The values of this record, as a dict where keys are column names
+        and values are the corresponding values. """
+
+        return dict(zip(TABLE_COLUMNS[self.table_name], self.values))
 
     def __repr__(self):
         return "{}(table_name={}, data={})".format(
@@ -145,20 +470,13 @@ class SqlRecord(): # pylint: disable=too-few-public-methods
             replace: If True, insert or replace; if False, only insert.
         """
 
-        if replace:
-            replace_str = "OR REPLACE "
-        else:
-            replace_str = ""
-
-        sql = "INSERT {}INTO {}({}) VALUES({})".format(
-            replace_str,
-            self.table_name,
-            ",".join(self.data.keys()),
-            ",".join("?" * len(self.data))
-        )
-
         try:
-            target_db.execute(sql, tuple(self.data.values()))
+            target_db.execute(
+                insert_statement(
+                    self.table_name, "REPLACE" if replace else None
+                ),
+                self.values
+            )
         except sqlite3.IntegrityError:
             # duplicate data
             pass
@@ -166,221 +484,1971 @@ class SqlRecord(): # pylint: disable=too-few-public-methods
             print(self)
             raise error
 
-def snowflake2utc(snowflake):
-    """ Convert a Twitter snowflake ID into a milliscond-resolution UTC
-    timestamp.
-
-    Source: Nick Galbreath @ngalbreath nickg@client9.com
-    Url: https://github.com/client9/snowflake2time/
+def insert_statement(table_name: str,
+                     on_conflict: str = None,
+                     staging: bool = False,
+                     interned: bool = False) -> str:
+    """ Build the INSERT statement for a table, with one parameter for each of
+    its columns in `TABLE_COLUMNS`.
 
     Args:
-        snowflake: An integer generated by snowflake, e.g. a tweet ID
-
-    Returns:
-        The Unix timestamp, in UTC, in milliseconds.
+        table_name: The name of the table.
+        on_conflict: The conflict resolution, e.g. "IGNORE" or "REPLACE", or
+            None to fail on conflicts.
+        staging: If True, insert into the table's staging table instead; see
+            `create_staging_tables`.
+        interned: If True, insert into the table of the interned schema that
+            stores the table, whose interned columns take the IDs of their
+            values; see `Interner`.
     """
-    return ((snowflake >> 22) + 1288834974657) / 1000.0
 
-def generate_records(tweet_str: str) -> typing.List[SqlRecord]:
-    """ Generate SqlRecord objects for a tweet.
+    columns = TABLE_COLUMNS[table_name]
+    if staging:
+        table_name = STAGING_PREFIX + table_name
+    elif interned and table_name in INTERNED_COLUMNS:
+        columns = tuple(
+            column + INTERNED_COLUMN_SUFFIX
+            if column in INTERNED_COLUMNS[table_name] else column
+            for column in columns
+        )
+        table_name += INTERNED_TABLE_SUFFIX
+    return "INSERT {}INTO {}({}) VALUES({})".format(
+        "OR {} ".format(on_conflict) if on_conflict else "",
+        table_name,
+        ",".join(columns),
+        ",".join("?" * len(columns))
+    )
 
-    Args:
-        tweet_str: The JSON data of a tweet, as a string.
+class UpsertCache():
+    """ Bounded LRU cache of the users and places written during an import,
+    used to skip records that would not change the database before they reach
+    SQLite.
 
-    Returns:
-        A list of SqlRecord objects.
+    Heavy users post thousands of tweets, each of which generates the same
+    users record, and mostly the same places record. The cache maps the ID of
+    each recently written user and place to a hash of the values that were
+    written. A record is skipped if its ID is cached and, when keeping the
+    latest profiles, if its values hash to the cached hash as well; when
+    keeping the first profiles, the database would ignore any later version
+    anyway.
+
+    Attributes:
+        max_size: The number of users and places to remember.
+        latest: If True, later versions of users and places replace earlier
+            ones, and are only skipped if they are unchanged.
+        entries: An OrderedDict where keys are (table name, ID) tuples and
+            values are hashes of the values last written, least recently used
+            first.
+        lookups: The number of records that were checked.
+        hits: The number of records that were skipped.
     """
-    #pylint: disable=too-many-locals
 
-    records = []
+    TABLES = ("users", "places")
 
-    tweet = json.loads(tweet_str)
-    tweet_id = int(convert_nlong(tweet["id"])) # mongoDB
-    entities = tweet["entities"]
+    def __init__(self,
+                 max_size: int = DEFAULT_UPSERT_CACHE_SIZE,
+                 latest: bool = False):
+        """ Initialize UpsertCache class.
 
-    user = tweet["user"]
-    user_id = int(convert_nlong(user["id"])) # mongoDB
-    records.append(SqlRecord(
-        table_name="users",
-        data={
-            "id": user_id,
-            "verified": int(user["verified"]), # type conversion here
-            **{ # leave everything else as is
-                key: user[key]
-                for key in [
-                    "name", "screen_name", "description",
-                    "statuses_count", "followers_count", "friends_count",
-                    "time_zone", "lang", "location"
-                ]
-            }
+        For definitions of args, see the attribute definitions in the docstring
+        of this class.
+        """
+
+        self.max_size = max_size
+        self.latest = latest
+        self.entries = collections.OrderedDict(
+        ) # type: typing.OrderedDict[typing.Tuple[str, typing.Any], int]
+        self.lookups = 0
+        self.hits = 0
+
+    def should_write(self, table_name: str, values: tuple) -> bool:
+        """ Check if a users or places record needs to be written, and
+        remember it if so.
+
+        Args:
+            table_name: "users" or "places".
+            values: The values of the record; the first value is the ID.
+        """
+
+        key = (table_name, values[0])
+        digest = hash(values)
+        self.lookups += 1
+        cached = self.entries.get(key)
+        if cached is not None and (not self.latest or cached == digest):
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return False
+        self.entries[key] = digest
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+        return True
+
+    def clear(self) -> None:
+        """ Forget every user and place, e.g. because the transaction that
+        wrote them was rolled back. """
+
+        self.entries.clear()
+
+    def stats(self) -> typing.Dict[str, float]:
+        """ Get the number of lookups and hits and the hit rate. """
+
+        return {
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": self.hits / self.lookups if self.lookups else 0.0
         }
-    ))
 
-    place = tweet["place"]
-    place_id = None
-    if place:
-        place_id = place["id"]
-        try:
-            # GeoJSON polygon
-            place_bbox = place["bounding_box"]["coordinates"][0]
-            (min_lon, min_lat) = place_bbox[0]
-            (max_lon, max_lat) = place_bbox[2]
-        except:
-            (min_lon, min_lat, max_lon, max_lat) = (None, None, None, None)
-        records.append(SqlRecord(
-            table_name="places",
-            data={
-                "id": place_id,
-                "country": place["country"],
-                "full_name": place["full_name"],
-                "min_lon": min_lon,
-                "min_lat": min_lat,
-                "max_lon": max_lon,
-                "max_lat": max_lat
-            }
-        ))
+def combine_upsert_cache_stats(
+        stats_list: typing.Iterable[typing.Optional[typing.Dict[str, float]]]
+    ) -> typing.Optional[typing.Dict[str, float]]:
+    """ Combine the statistics of several UpsertCaches, ignoring Nones.
 
-    (tweet_lon, tweet_lat) = tweet["coordinates"]["coordinates"]
-    # MongoDB
-    converted_ids = {
-        key: tweet.get(key)
-        for key in [
-            "quoted_status_id", "in_reply_to_status_id", "in_reply_to_user_id"
-        ]
+    Returns:
+        The combined statistics, or None if there were none.
+    """
+
+    stats_list = [stats for stats in stats_list if stats is not None]
+    if not stats_list:
+        return None
+    lookups = sum(stats["lookups"] for stats in stats_list)
+    hits = sum(stats["hits"] for stats in stats_list)
+    return {
+        "lookups": lookups,
+        "hits": hits,
+        "hit_rate": hits / lookups if lookups else 0.0
     }
-    for (key, value) in converted_ids.items():
-        if value:
-            converted_ids[key] = int(convert_nlong(value))
-    records.append(SqlRecord(
-        table_name="tweets",
-        data={
-            "id": tweet_id,
-            "user_id": user_id,
-            "place_id": place_id,
-            "created_at": tweet["created_at"],
-            "timestamp": snowflake2utc(tweet_id),
-            "lang": tweet.get("lang"),
-            "quoted_status_id": converted_ids["quoted_status_id"],
-            "in_reply_to_status_id": converted_ids["in_reply_to_status_id"],
-            "in_reply_to_user_id": converted_ids["in_reply_to_user_id"],
-            "lat": tweet_lat,
-            "lon": tweet_lon,
-            "text": tweet["text"]
-        }
+
+def report_upsert_cache(stats: typing.Dict[str, float]) -> None:
+    """ Print the statistics of an UpsertCache. """
+
+    print("user/place cache: {:.1f}% hit rate; {} of {} rows skipped".format(
+        100 * stats["hit_rate"], stats["hits"], stats["lookups"]
     ))
 
-    for url in entities.get("urls", []):
-        records.append(SqlRecord(
-            table_name="urls",
-            data={
-                "tweet_id": tweet_id,
-                "url": url["expanded_url"],
-                "shortened_url": url["url"]
-            }
-        ))
+def encode_hex_id(id_: typing.Optional[str]) -> typing.Union[str, int, None]:
+    """ Convert an ID of 16 lowercase hexadecimal digits, such as the ID of a
+    place, into a signed 64-bit integer, leaving other IDs as they are. The
+    views of the compact schema convert them back with printf("%016x"). """
 
-    for media in entities.get("media", []):
-        records.append(SqlRecord(
-            table_name="media",
-            data={
-                "tweet_id": tweet_id,
-                "type": media["type"],
-                "url": media["media_url"],
-                "shortened_url": media["url"]
-            }
-        ))
+    if id_ is None or not HEX_ID_PATTERN.fullmatch(id_):
+        return id_
+    value = int(id_, 16)
+    return value - (1 << 64) if value >= 1 << 63 else value
 
-    for hashtag in entities.get("hashtags", []):
-        records.append(SqlRecord(
-            table_name="hashtags",
-            data={
-                "tweet_id": tweet_id,
-                "text": hashtag["text"]
-            }
-        ))
+def format_created_at(timestamp: typing.Optional[float]) -> typing.Optional[str]:
+    """ Format a Unix timestamp, as stored in tweets.timestamp, the way that
+    Twitter formats created_at, e.g. "Tue Jan 09 12:00:00 +0000 2020". The
+    timestamp is rounded to the millisecond and then truncated to the second,
+    as SQLite does in the views of the compact schema; see
+    `sql_created_at`. """
 
-    for mention in entities.get("mentions", []):
-        records.append(SqlRecord(
-            table_name="mentions",
-            data={
-                "tweet_id": tweet_id,
-                "user_id": mention["id"]
-            }
-        ))
+    if timestamp is None:
+        return None
+    utc = time.gmtime(round(timestamp * 1000) // 1000)
+    return "{} {} {:02d} {:02d}:{:02d}:{:02d} +0000 {}".format(
+        WEEKDAY_NAMES[utc.tm_wday], MONTH_NAMES[utc.tm_mon - 1], utc.tm_mday,
+        utc.tm_hour, utc.tm_min, utc.tm_sec, utc.tm_year
+    )
 
-    return records
+def sql_created_at(timestamp: str) -> str:
+    """ Build an SQL expression formatting a Unix timestamp as
+    `format_created_at` does.
 
-def main():
-    """ Start importing files. """
+    Args:
+        timestamp: An SQL expression for the timestamp.
+    """
 
-    parser = argparse.ArgumentParser(
-        description="import tweets into an SQLite3 database"
-    )
-    parser.add_argument(
-        "inputs", nargs="+",
-        help="paths to compressed tweet JSON data"
-    )
-    parser.add_argument(
-        "-d", "--db", required=True,
-        help="the path to the database where tweets will be imported"
-    )
-    parser.add_argument(
-        "-H", "--high-throughput", action="store_true",
-        help="enable pragmas for higher-throughput importing. if the importing"
-             " fails while this is enabled, the entire database may become"
-             " corrupted."
+    return (
+        "substr('SunMonTueWedThuFriSat',"
+        " 1 + 3 * strftime('%w', {0}, 'unixepoch'), 3)"
+        " || ' ' || substr('{1}',"
+        " 3 * strftime('%m', {0}, 'unixepoch') - 2, 3)"
+        " || strftime(' %d %H:%M:%S +0000 %Y', {0}, 'unixepoch')"
+    ).format(timestamp, "".join(MONTH_NAMES))
+
+def sql_encode_hex_id(id_: str) -> str:
+    """ Build an SQL expression converting an ID as `encode_hex_id` does.
+
+    Args:
+        id_: An SQL expression for the ID.
+    """
+
+    return "CASE WHEN {0} GLOB '{1}' THEN {2} ELSE {0} END".format(
+        id_,
+        "[0-9a-f]" * 16,
+        " | ".join(
+            "((instr('0123456789abcdef', substr({}, {}, 1)) - 1) << {})"
+            .format(id_, i + 1, 60 - 4 * i)
+            for i in range(16)
+        )
     )
-    args = parser.parse_args()
 
-    with sqlite3.connect(args.db) as db:
-        db.executescript(SQL_INIT_SCHEMA)
-        if args.high_throughput:
-            db.executescript(SQL_HIGH_THROUGHPUT_PRAGMAS)
+def sql_decode_hex_id(id_: str) -> str:
+    """ Build an SQL expression reverting `encode_hex_id`.
 
-    for tweets_path in tqdm.tqdm(
-            args.inputs,
-            desc="importing files",
-            position=0
-        ):
-        with sqlite3.connect(args.db) as db: # atomicity on per-file basis
-            full_path = os.path.abspath(tweets_path)
-            last_modified = os.stat(full_path).st_mtime
+    Args:
+        id_: An SQL expression for the stored ID.
+    """
 
-            try:
-                (existing_last_modified,) = next(db.execute(
-                    "SELECT last_modified FROM imported_files WHERE full_path = ?",
-                    (full_path,)
-                ))
-                print("skipping {}".format(tweets_path))
-                if existing_last_modified < last_modified:
-                    print(
-                        "WARNING: newer version of {} exists. consider"
-                        " rebuilding the database.".format(tweets_path)
-                    )
-                continue
-            except StopIteration:
-                pass
-
-            with gzip.open(tweets_path, "rt") as input_fp:
-                for row in tqdm.tqdm(
-                        input_fp,
-                        desc=os.path.basename(tweets_path),
-                        position=1,
-                        leave=None
-                    ):
-                    for record in generate_records(row):
-                        record.insert_into(db)
+    return "CASE WHEN typeof({0}) = 'integer' THEN printf('%016x', {0})" \
+        " ELSE {0} END".format(id_)
 
-            db.execute(
-                "INSERT INTO imported_files(full_path, last_modified) VALUES (?, ?)",
-                (full_path, last_modified)
-            )
+class Interner():
+    """ Class interning the values of the columns in `INTERNED_COLUMNS` into
+    the lookup tables of the interned and compact schemas, with an in-memory
+    dict of the values seen so far and their IDs. For the compact schema, it
+    also encodes hexadecimal IDs and leaves out created_at where it can be
+    derived.
+
+    The lookup tables are the source of truth, so values are looked up there
+    before they are added, and interned values written by other connections
+    or by the triggers of the views are reused.
+
+    Attributes:
+        schema: "interned" or "compact".
+        ids: A dict where keys are lookup tables and values are dicts mapping
+            values to their IDs.
+        positions: A dict where keys are table names and values are lists of
+            (column index, lookup table) tuples of their interned columns.
+        hex_id_positions: A dict where keys are table names and values are
+            the indexes of their columns in `HEX_ID_COLUMNS`, for the compact
+            schema.
+        created_at_positions: The indexes of the created_at and timestamp
+            columns of tweets, for the compact schema, or None.
+    """
+
+    def __init__(self, schema: str = "interned"):
+        """ Initialize Interner class.
+
+        For definitions of args, see the attribute definitions in the docstring
+        of this class.
+        """
+
+        self.schema = schema
+        self.ids = {
+            lookup_table: {}
+            for columns in INTERNED_COLUMNS.values()
+            for lookup_table in columns.values()
+        } # type: typing.Dict[str, typing.Dict[str, int]]
+        self.positions = {
+            table_name: [
+                (TABLE_COLUMNS[table_name].index(column), lookup_table)
+                for (column, lookup_table) in columns.items()
+            ]
+            for (table_name, columns) in INTERNED_COLUMNS.items()
+        }
+        self.hex_id_positions = {
+            table_name: [
+                TABLE_COLUMNS[table_name].index(column) for column in columns
+            ]
+            for (table_name, columns) in HEX_ID_COLUMNS.items()
+        } if schema == "compact" else {}
+        self.created_at_positions = (
+            TABLE_COLUMNS["tweets"].index("created_at"),
+            TABLE_COLUMNS["tweets"].index("timestamp")
+        ) if schema == "compact" else None
+
+    def intern(self,
+               target_db: typing.Union[sqlite3.Connection, sqlite3.Cursor],
+               lookup_table: str,
+               value: typing.Optional[str]) -> typing.Optional[int]:
+        """ Get the ID of a value in a lookup table, adding it if necessary.
+
+        Args:
+            target_db: The database connection or cursor to intern into.
+            lookup_table: The lookup table.
+            value: The value, or None.
+
+        Returns:
+            The ID of the value, or None if the value is None.
+        """
+
+        if value is None:
+            return None
+        ids = self.ids[lookup_table]
+        id_ = ids.get(value)
+        if id_ is None:
+            row = target_db.execute(
+                "SELECT id FROM {} WHERE value = ?".format(lookup_table),
+                (value,)
+            ).fetchone()
+            if row is None:
+                id_ = target_db.execute(
+                    "INSERT INTO {}(value) VALUES (?)".format(lookup_table),
+                    (value,)
+                ).lastrowid
+            else:
+                (id_,) = row
+            ids[value] = id_
+        return id_
+
+    def encode(self,
+               target_db: typing.Union[sqlite3.Connection, sqlite3.Cursor],
+               table_name: str,
+               rows: typing.List[tuple]) -> typing.List[tuple]:
+        """ Replace the values of the interned columns of a table with their
+        IDs.
+
+        Args:
+            target_db: The database connection or cursor to intern into.
+            table_name: The name of the table.
+            rows: The values of records, in the order of `TABLE_COLUMNS`.
+
+        Returns:
+            The values of the records, with IDs in place of interned values.
+        """
+
+        positions = self.positions[table_name]
+        hex_id_positions = self.hex_id_positions.get(table_name, ())
+        created_at_positions = self.created_at_positions \
+            if table_name == "tweets" else None
+        encoded_rows = []
+        for values in rows:
+            values = list(values)
+            for (i, lookup_table) in positions:
+                values[i] = self.intern(target_db, lookup_table, values[i])
+            for i in hex_id_positions:
+                values[i] = encode_hex_id(values[i])
+            if created_at_positions is not None:
+                (created_at, timestamp) = created_at_positions
+                if values[created_at] == format_created_at(values[timestamp]):
+                    values[created_at] = None
+            encoded_rows.append(tuple(values))
+        return encoded_rows
+
+    def clear(self) -> None:
+        """ Forget every value, e.g. because the transaction that added them
+        to the lookup tables was rolled back. """
+
+        for ids in self.ids.values():
+            ids.clear()
+
+class ImportStats():
+    """ Class measuring the throughput of each stage of an import, to tell
+    what an import is bound by.
+
+    The wall and CPU time of each stage in `STAGES` is measured in the process
+    that runs it; with --jobs, reading, parsing and generating records happen
+    in the parser processes, which send their measurements along with each
+    batch, and the writer measures how long it waits for them. Records are
+    counted per table as they are inserted: rows that were ignored because of
+    a uniqueness constraint are counted as duplicates, and rows skipped by an
+    UpsertCache as skipped. Records loaded into staging tables are not
+    deduplicated until the end, so they have no duplicates. The hit ratio of
+    SQLite's page cache is not measured, because the sqlite3 module doesn't
+    expose the page cache counters of a connection.
+
+    Attributes:
+        interval: The number of seconds between summaries printed by
+            `maybe_report`, or 0 to print none.
+        wall: A dict where keys are stages and values are wall times.
+        cpu: A dict where keys are stages and values are CPU times of the
+            measuring process.
+        lines: The number of lines read.
+        rows: A Counter of the records inserted into each table, including
+            duplicates.
+        inserted: A Counter of the records that changed each table.
+        skipped: A Counter of the records of each table skipped by an
+            UpsertCache.
+        start_time: The time.perf_counter() at which measuring started.
+        last_report: The time.perf_counter() of the last summary.
+    """
+
+    def __init__(self, interval: float = 0.0):
+        """ Initialize ImportStats class.
+
+        For definitions of args, see the attribute definitions in the docstring
+        of this class.
+        """
+
+        self.interval = interval
+        self.wall = dict.fromkeys(STAGES, 0.0)
+        self.cpu = dict.fromkeys(STAGES, 0.0)
+        self.lines = 0
+        self.rows = collections.Counter() # type: typing.Counter[str]
+        self.inserted = collections.Counter() # type: typing.Counter[str]
+        self.skipped = collections.Counter() # type: typing.Counter[str]
+        self.start_time = time.perf_counter()
+        self.last_report = self.start_time
+
+    @staticmethod
+    def clock() -> typing.Tuple[float, float]:
+        """ Get the current wall and CPU time, to be passed to `add`. """
+
+        return (time.perf_counter(), time.process_time())
+
+    def add(self,
+            stage: str,
+            since: typing.Tuple[float, float]) -> typing.Tuple[float, float]:
+        """ Add the time since a `clock` to a stage.
+
+        Returns:
+            The current `clock`, so that consecutive stages can be measured
+            without reading the clock twice.
+        """
+
+        now = (time.perf_counter(), time.process_time())
+        self.wall[stage] += now[0] - since[0]
+        self.cpu[stage] += now[1] - since[1]
+        return now
+
+    def timed(self, stage: str, iterable: typing.Iterable) -> typing.Iterator:
+        """ Add the time spent getting each item of an iterable to a stage. """
+
+        iterator = iter(iterable)
+        while True:
+            since = self.clock()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add(stage, since)
+                return
+            self.add(stage, since)
+            yield item
+
+    def count_rows(self, table_name: str, rows: int, inserted: int) -> None:
+        """ Count records of a table that were inserted, of which `inserted`
+        changed the table. """
+
+        self.rows[table_name] += rows
+        self.inserted[table_name] += inserted
+
+    def take(self) -> "ImportStats":
+        """ Take the measurements so far, e.g. to send them to another
+        process, and start measuring from zero. """
+
+        taken = ImportStats()
+        taken.merge(self)
+        for stage in STAGES:
+            self.wall[stage] = 0.0
+            self.cpu[stage] = 0.0
+        self.lines = 0
+        self.rows.clear()
+        self.inserted.clear()
+        self.skipped.clear()
+        return taken
+
+    def merge(self, other: "ImportStats") -> None:
+        """ Add the measurements of another ImportStats, e.g. of a shard, to
+        this one. Times are summed across processes. """
+
+        for stage in STAGES:
+            self.wall[stage] += other.wall[stage]
+            self.cpu[stage] += other.cpu[stage]
+        self.lines += other.lines
+        self.rows.update(other.rows)
+        self.inserted.update(other.inserted)
+        self.skipped.update(other.skipped)
+
+    def report(self) -> dict:
+        """ Get the measurements as a JSON-serializable dict. """
+
+        elapsed = time.perf_counter() - self.start_time
+        return {
+            "elapsed": elapsed,
+            "lines": self.lines,
+            "lines_per_second": self.lines / elapsed if elapsed else None,
+            "stages": {
+                stage: {"wall": self.wall[stage], "cpu": self.cpu[stage]}
+                for stage in STAGES
+            },
+            "tables": {
+                table_name: {
+                    "rows": self.rows[table_name],
+                    "inserted": self.inserted[table_name],
+                    "duplicates":
+                        self.rows[table_name] - self.inserted[table_name],
+                    "skipped": self.skipped[table_name],
+                    "rows_per_second":
+                        self.rows[table_name] / elapsed if elapsed else None
+                }
+                for table_name in TABLE_COLUMNS
+            }
+        }
+
+    def summary(self) -> str:
+        """ Format the measurements as a few lines of text. """
+
+        report = self.report()
+        lines = ["{:.0f} s".format(report["elapsed"])]
+        if report["lines"]:
+            lines[0] += ", {} lines ({:.0f}/s)".format(
+                report["lines"], report["lines_per_second"]
+            )
+        lines.append("  stages: " + ", ".join(
+            "{} {:.1f}s wall/{:.1f}s cpu".format(stage, times["wall"],
+                                                 times["cpu"])
+            for (stage, times) in report["stages"].items()
+            if times["wall"] or times["cpu"]
+        ))
+        lines.append("  tables: " + ", ".join(
+            "{} {:.0f}/s ({} dup, {} skipped)".format(
+                table_name, table["rows_per_second"] or 0,
+                table["duplicates"], table["skipped"]
+            )
+            for (table_name, table) in report["tables"].items()
+            if table["rows"] or table["skipped"]
+        ))
+        return "\n".join(lines)
+
+    def maybe_report(self) -> None:
+        """ Print a summary if `interval` seconds passed since the last
+        one. """
+
+        if not self.interval \
+                or time.perf_counter() - self.last_report < self.interval:
+            return
+        tqdm.tqdm.write(self.summary())
+        self.last_report = time.perf_counter()
+
+class BatchInserter():
+    """ Class collecting records into batches, one per table, and inserting
+    each batch with a single `executemany` call. This avoids the overhead of
+    formatting and running a separate statement for every record.
+
+    Duplicate records are handled as `SqlRecord.insert_into` handles them:
+    records that would violate a uniqueness constraint are skipped one by one
+    (INSERT OR IGNORE), so the first version of a duplicate record is kept,
+    and the rest of the batch is still inserted.
+
+    Attributes:
+        target_db: The database connection or cursor to insert records into.
+        batch_size: The number of records of a table at which they are
+            inserted.
+        replace: If True, insert or replace into every table; if a collection
+            of table names, insert or replace into those tables only; if
+            False, only insert.
+        staging: If True, insert records into the staging tables, where
+            duplicates are kept until `finalize_staging_tables`.
+        cache: If given, the UpsertCache used to skip users and places that
+            would not change the database. It is cleared if the transaction
+            of the inserter is rolled back.
+        stats: If given, the ImportStats to measure inserting with.
+        interner: If given, insert into the tables of the interned schema,
+            interning values with this Interner. It is cleared if the
+            transaction of the inserter is rolled back. Staging tables are
+            not interned.
+        statements: A dict where keys are table names and values are the
+            INSERT statements for them, built once.
+        batches: A dict where keys are table names and values are lists of
+            the values of the records waiting to be inserted.
+        inserted: The number of records that were inserted.
+    """
+
+    def __init__(self,
+                 target_db: typing.Union[sqlite3.Connection, sqlite3.Cursor],
+                 batch_size: int = DEFAULT_BATCH_SIZE,
+                 replace: typing.Union[bool, typing.Collection[str]] = False,
+                 staging: bool = False,
+                 cache: UpsertCache = None,
+                 stats: ImportStats = None,
+                 interner: Interner = None):
+        """ Initialize BatchInserter class.
+
+        For definitions of args, see the attribute definitions in the docstring
+        of this class.
+        """
+
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+
+        self.target_db = target_db
+        self.batch_size = batch_size
+        self.replace = replace
+        self.staging = staging
+        self.cache = cache
+        self.stats = stats
+        self.interner = None if staging else interner
+        if isinstance(replace, bool):
+            replace = TABLE_COLUMNS if replace else ()
+        self.statements = {
+            table_name: insert_statement(
+                table_name,
+                None if staging
+                else "REPLACE" if table_name in replace else "IGNORE",
+                staging,
+                self.interner is not None
+            )
+            for table_name in TABLE_COLUMNS
+        }
+        self.batches = {
+            table_name: [] for table_name in TABLE_COLUMNS
+        } # type: typing.Dict[str, typing.List[tuple]]
+        self.inserted = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        # a failed import is rolled back, so there is no use in flushing it,
+        # and the cached users, places and interned values may not be in the
+        # database
+        if exc_type is None:
+            self.flush()
+            return
+        if self.cache is not None:
+            self.cache.clear()
+        if self.interner is not None:
+            self.interner.clear()
+
+    def add(self, record: SqlRecord) -> None:
+        """ Add a record to the batch of its table, inserting the batch if it
+        is full. """
+
+        if self.cache is not None and record.table_name in UpsertCache.TABLES \
+                and not self.cache.should_write(
+                    record.table_name, record.values
+                ):
+            if self.stats is not None:
+                self.stats.skipped[record.table_name] += 1
+            return
+        batch = self.batches[record.table_name]
+        batch.append(record.values)
+        if len(batch) >= self.batch_size:
+            self.flush_batch(record.table_name)
+
+    def add_rows(self, table_name: str, rows: typing.List[tuple]) -> None:
+        """ Add the values of several records of a table to its batch,
+        inserting the batch if it is full. """
+
+        if self.cache is not None and table_name in UpsertCache.TABLES:
+            kept_rows = [
+                values for values in rows
+                if self.cache.should_write(table_name, values)
+            ]
+            if self.stats is not None:
+                self.stats.skipped[table_name] += len(rows) - len(kept_rows)
+            rows = kept_rows
+        batch = self.batches[table_name]
+        batch.extend(rows)
+        if len(batch) >= self.batch_size:
+            self.flush_batch(table_name)
+
+    def flush_batch(self, table_name: str) -> None:
+        """ Insert the batch of a table. """
+
+        batch = self.batches[table_name]
+        if batch:
+            if self.stats is not None:
+                since = self.stats.clock()
+            rows = batch
+            if self.interner is not None and table_name in INTERNED_COLUMNS:
+                rows = self.interner.encode(self.target_db, table_name, batch)
+            cursor = self.target_db.executemany(
+                self.statements[table_name], rows
+            )
+            if self.stats is not None:
+                self.stats.add("sqlite", since)
+                self.stats.count_rows(table_name, len(batch), cursor.rowcount)
+            self.inserted += len(batch)
+            batch.clear()
+
+    def flush(self) -> None:
+        """ Insert the batches of all tables. """
+
+        for table_name in self.batches:
+            self.flush_batch(table_name)
+
+def create_staging_tables(db: sqlite3.Connection) -> None:
+    """ Create a staging table for each table in `TABLE_COLUMNS`, with the
+    same columns but without types, keys or indexes.
+
+    Inserting into the real tables places every record at the position of its
+    primary key in the table's B-tree, which is random for users and places
+    and far from sequential for tweets arriving from different files. Staging
+    tables are only ever appended to, and their records are moved into the
+    real tables in order of their primary keys by `finalize_staging_tables`.
+
+    Staging tables are ordinary tables, so records loaded into them are as
+    durable as records loaded into the real tables.
+    """
+
+    for (table_name, columns) in TABLE_COLUMNS.items():
+        db.execute("CREATE TABLE IF NOT EXISTS {}{}({})".format(
+            STAGING_PREFIX, table_name, ",".join(columns)
+        ))
+
+def finalize_staging_tables(db: sqlite3.Connection,
+                            latest: bool = False) -> int:
+    """ Move the records in the staging tables into the real tables, then
+    drop the staging tables, in a single transaction.
+
+    Records are inserted in order of the first column of their table, i.e.
+    the primary key of users, places and tweets and the tweet ID of the other
+    tables, so that the B-trees of the tables only grow at their ends. Among
+    duplicate records, the record that was loaded first is kept, and records
+    that are already in the real tables are skipped, as with a direct import.
+
+    Indexes on the real tables, such as the ones created by
+    tweets-to-sqlite-postprocessing.py, are dropped during the insert and
+    recreated afterwards, which is faster than updating them record by
+    record.
+
+    Args:
+        db: The database connection.
+        latest: If True, the users and places that were loaded last replace
+            earlier versions instead; see `UpsertCache`.
+
+    Returns:
+        The number of records that were in the staging tables, including
+        duplicates that were skipped.
+    """
+
+    staging_tables = set(
+        name for (name,) in db.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'"
+            " AND name LIKE ?", (STAGING_PREFIX + "%",)
+        )
+    )
+    if not staging_tables:
+        return 0
+
+    # the tables of the interned schema store some tables under other names
+    table_names = list(TABLE_COLUMNS) + [
+        table_name + INTERNED_TABLE_SUFFIX for table_name in INTERNED_COLUMNS
+    ]
+    indexes = db.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index'"
+        " AND sql IS NOT NULL AND tbl_name IN ({})".format(
+            ",".join("?" * len(table_names))
+        ),
+        table_names
+    ).fetchall()
+
+    moved = 0
+    with db:
+        # schema changes would otherwise be committed immediately
+        db.execute("BEGIN")
+        for (name, _) in indexes:
+            db.execute("DROP INDEX {}".format(name))
+        for (table_name, columns) in TABLE_COLUMNS.items():
+            if STAGING_PREFIX + table_name not in staging_tables:
+                continue
+            # the rowcount of inserts into the views of the interned schema is
+            # always 0, so the staged records are counted instead
+            (staged,) = db.execute("SELECT count(*) FROM {}{}".format(
+                STAGING_PREFIX, table_name
+            )).fetchone()
+            moved += staged
+            db.execute(
+                "INSERT OR {conflict} INTO {table}({columns})"
+                " SELECT {columns} FROM {staging}{table}"
+                " ORDER BY {key}, rowid".format(
+                    conflict="REPLACE"
+                    if latest and table_name in UpsertCache.TABLES
+                    else "IGNORE",
+                    table=table_name, columns=",".join(columns),
+                    staging=STAGING_PREFIX, key=columns[0]
+                )
+            )
+            db.execute("DROP TABLE {}{}".format(STAGING_PREFIX, table_name))
+        for (_, sql) in indexes:
+            db.execute(sql)
+    return moved
+
+def convert_optional_id(value: typing.Any) -> typing.Optional[int]:
+    """ Convert an optional ID, which may be a Mongo numberLong, into an int,
+    leaving missing IDs as they are. """
+
+    if value:
+        return int(convert_nlong(value))
+    return value
+
+def snowflake2utc(snowflake):
+    """ Convert a Twitter snowflake ID into a milliscond-resolution UTC
+    timestamp.
+
+    Source: Nick Galbreath @ngalbreath nickg@client9.com
+    Url: https://github.com/client9/snowflake2time/
+
+    Args:
+        snowflake: An integer generated by snowflake, e.g. a tweet ID
+
+    Returns:
+        The Unix timestamp, in UTC, in milliseconds.
+    """
+    return ((snowflake >> 22) + 1288834974657) / 1000.0
+
+def generate_records(tweet_str: typing.Union[str, bytes],
+                     predicate: tweetio.TweetPredicate = None,
+                     sampler: tweetio.TweetSampler = None,
+                     stats: ImportStats = None
+                     ) -> typing.List[SqlRecord]:
+    """ Generate SqlRecord objects for a tweet.
+
+    Args:
+        tweet_str: The JSON data of a tweet, as a string or as raw bytes.
+        predicate: If given, no records are generated for tweets that don't
+            match this predicate.
+        sampler: If given, no records are generated for tweets that are not
+            in this sample. This is checked before the tweet is parsed.
+        stats: If given, the ImportStats to measure parsing and generating
+            records with.
+
+    Returns:
+        A list of SqlRecord objects.
+    """
+
+    if sampler is not None:
+        if isinstance(tweet_str, str):
+            tweet_str = tweet_str.encode("utf-8")
+        if not sampler.keeps_raw(tweet_str):
+            return []
+
+    if stats is None:
+        return tweet_records(json.loads(tweet_str), predicate)
+
+    since = stats.clock()
+    tweet = json.loads(tweet_str)
+    since = stats.add("parse", since)
+    records = tweet_records(tweet, predicate)
+    stats.add("records", since)
+    return records
+
+def tweet_records(tweet: dict,
+                  predicate: tweetio.TweetPredicate = None
+                  ) -> typing.List[SqlRecord]:
+    """ Generate SqlRecord objects for a parsed tweet; see
+    `generate_records`. """
+    #pylint: disable=too-many-locals
+
+    records = [] # type: typing.List[SqlRecord]
+
+    if predicate is not None and not predicate.matches(tweet):
+        return records
+    tweet_id = int(convert_nlong(tweet["id"])) # mongoDB
+    entities = tweet["entities"]
+
+    # values are given in the order of TABLE_COLUMNS
+    user = tweet["user"]
+    user_id = int(convert_nlong(user["id"])) # mongoDB
+    records.append(SqlRecord("users", (
+        user_id,
+        user["name"],
+        user["screen_name"],
+        user["description"],
+        int(user["verified"]), # type conversion here
+        user["statuses_count"],
+        user["followers_count"],
+        user["friends_count"],
+        user["time_zone"],
+        user["lang"],
+        user["location"]
+    )))
+
+    place = tweet["place"]
+    place_id = None
+    if place:
+        place_id = place["id"]
+        try:
+            # GeoJSON polygon
+            place_bbox = place["bounding_box"]["coordinates"][0]
+            (min_lon, min_lat) = place_bbox[0]
+            (max_lon, max_lat) = place_bbox[2]
+        except:
+            (min_lon, min_lat, max_lon, max_lat) = (None, None, None, None)
+        records.append(SqlRecord("places", (
+            place_id,
+            place["country"],
+            place["full_name"],
+            min_lon,
+            min_lat,
+            max_lon,
+            max_lat
+        )))
+
+    (tweet_lon, tweet_lat) = tweet["coordinates"]["coordinates"]
+    records.append(SqlRecord("tweets", (
+        tweet_id,
+        user_id,
+        place_id,
+        tweet["created_at"],
+        snowflake2utc(tweet_id),
+        tweet.get("lang"),
+        convert_optional_id(tweet.get("quoted_status_id")),
+        convert_optional_id(tweet.get("in_reply_to_status_id")),
+        convert_optional_id(tweet.get("in_reply_to_user_id")),
+        tweet_lat,
+        tweet_lon,
+        tweet["text"]
+    )))
+
+    for url in entities.get("urls", []):
+        records.append(SqlRecord("urls", (
+            tweet_id, url["expanded_url"], url["url"]
+        )))
+
+    for media in entities.get("media", []):
+        records.append(SqlRecord("media", (
+            tweet_id, media["type"], media["media_url"], media["url"]
+        )))
+
+    for hashtag in entities.get("hashtags", []):
+        records.append(SqlRecord("hashtags", (tweet_id, hashtag["text"])))
+
+    for mention in entities.get("mentions", []):
+        records.append(SqlRecord("mentions", (tweet_id, mention["id"])))
+
+    return records
+
+def connect(db_path: str,
+            high_throughput: bool = False,
+            wal: bool = False,
+            cache_size: int = 0,
+            mmap_size: int = 0) -> sqlite3.Connection:
+    """ Connect to a database, applying the pragmas chosen on the command line.
+
+    Most pragmas only apply to the connection that sets them, so every
+    connection used for importing must be opened with this.
+
+    Args:
+        db_path: The path to the database.
+        high_throughput: If True, apply `SQL_HIGH_THROUGHPUT_PRAGMAS`.
+        wal: If True, apply `SQL_WAL_PRAGMAS`.
+        cache_size: The size of the page cache in MiB, or 0 for the default.
+        mmap_size: The amount of the database to memory-map in MiB, or 0 for
+            none.
+
+    Returns:
+        The database connection.
+    """
+
+    db = sqlite3.connect(db_path)
+    if high_throughput:
+        db.executescript(SQL_HIGH_THROUGHPUT_PRAGMAS)
+    if wal:
+        db.executescript(SQL_WAL_PRAGMAS)
+    if cache_size:
+        # negative sizes are in KiB rather than pages
+        db.execute("PRAGMA cache_size = {:d}".format(-cache_size * 1024))
+    if mmap_size:
+        db.execute("PRAGMA mmap_size = {:d}".format(mmap_size * 1024 * 1024))
+    return db
+
+def sql_view_column(schema: str, table_name: str, column: str) -> str:
+    """ Build the expression of a column in a view of the interned or compact
+    schema; see `interned_views_sql`. Interned columns are selected from the
+    lookup table joined under the name of the column. """
+
+    if column in INTERNED_COLUMNS[table_name]:
+        return "{0}.value AS {0}".format(column)
+    stored = "{}{}.{}".format(table_name, INTERNED_TABLE_SUFFIX, column)
+    if schema == "compact":
+        if column in HEX_ID_COLUMNS.get(table_name, ()):
+            return "{} AS {}".format(sql_decode_hex_id(stored), column)
+        if table_name == "tweets" and column == "created_at":
+            return "coalesce({}, {}) AS {}".format(
+                stored,
+                sql_created_at(
+                    "{}{}.timestamp".format(table_name, INTERNED_TABLE_SUFFIX)
+                ),
+                column
+            )
+    return stored
+
+def sql_trigger_value(schema: str, table_name: str, column: str) -> str:
+    """ Build the expression of the value of a column that the INSTEAD OF
+    trigger of a view of the interned or compact schema stores; see
+    `interned_views_sql`. """
+
+    if column in INTERNED_COLUMNS[table_name]:
+        return "(SELECT id FROM {} WHERE value = NEW.{})".format(
+            INTERNED_COLUMNS[table_name][column], column
+        )
+    if schema == "compact":
+        if column in HEX_ID_COLUMNS.get(table_name, ()):
+            return sql_encode_hex_id("NEW." + column)
+        if table_name == "tweets" and column == "created_at":
+            return "nullif(NEW.{}, {})".format(
+                column, sql_created_at("NEW.timestamp")
+            )
+    return "NEW." + column
+
+def interned_views_sql(schema: str = "interned") -> str:
+    """ Build the views and triggers of the interned or compact schema.
+
+    For each table in `INTERNED_COLUMNS`, a view with the name and columns of
+    the table in the standard schema joins the table that stores it with the
+    lookup tables of its interned columns, so that queries written for the
+    standard schema work unchanged; in the compact schema, the view also
+    decodes hexadecimal IDs and derives missing created_at values. An
+    INSTEAD OF trigger on the view encodes records inserted through it in the
+    same way as `Interner`, so that shards and staging tables, which use the
+    standard schema, can be moved into the database with the same statements;
+    an ON CONFLICT clause of the INSERT applies to the table that stores the
+    records.
+
+    Args:
+        schema: "interned" or "compact".
+    """
+
+    statements = []
+    for (table_name, interned_columns) in INTERNED_COLUMNS.items():
+        columns = TABLE_COLUMNS[table_name]
+        data_table = table_name + INTERNED_TABLE_SUFFIX
+        statements.append(
+            "CREATE VIEW IF NOT EXISTS {view} AS SELECT {columns}"
+            " FROM {data_table}{joins}".format(
+                view=table_name,
+                columns=", ".join(
+                    sql_view_column(schema, table_name, column)
+                    for column in columns
+                ),
+                data_table=data_table,
+                joins="".join(
+                    " LEFT JOIN {lookup} AS {column}"
+                    " ON {column}.id = {data_table}.{column}{suffix}".format(
+                        lookup=lookup_table, column=column,
+                        data_table=data_table, suffix=INTERNED_COLUMN_SUFFIX
+                    )
+                    for (column, lookup_table) in interned_columns.items()
+                )
+            )
+        )
+        statements.append(
+            "CREATE TRIGGER IF NOT EXISTS insert_{view} INSTEAD OF INSERT"
+            " ON {view} BEGIN {interns} INSERT INTO {data_table}({columns})"
+            " VALUES ({values}); END".format(
+                view=table_name,
+                interns=" ".join(
+                    "INSERT INTO {lookup}(value) SELECT NEW.{column}"
+                    " WHERE NEW.{column} IS NOT NULL AND NOT EXISTS"
+                    " (SELECT 1 FROM {lookup} WHERE value = NEW.{column});"
+                    .format(lookup=lookup_table, column=column)
+                    for (column, lookup_table) in interned_columns.items()
+                ),
+                data_table=data_table,
+                columns=",".join(
+                    column + INTERNED_COLUMN_SUFFIX
+                    if column in interned_columns else column
+                    for column in columns
+                ),
+                values=",".join(
+                    sql_trigger_value(schema, table_name, column)
+                    for column in columns
+                )
+            )
+        )
+    return ";\n".join(statements) + ";\n"
+
+def schema_of(db: sqlite3.Connection) -> typing.Optional[str]:
+    """ Get the name of the schema in `SCHEMAS` that a database was created
+    with, from its user_version, or None if the database is empty. """
+
+    if db.execute("SELECT count(*) FROM sqlite_master").fetchone()[0] == 0:
+        return None
+    (user_version,) = db.execute("PRAGMA user_version").fetchone()
+    for (name, (_, version)) in SCHEMAS.items():
+        if version == user_version:
+            return name
+    raise ValueError("unknown schema version {}".format(user_version))
+
+def init_schema(db: sqlite3.Connection, schema: str = "standard") -> None:
+    """ Create the tables of a schema in `SCHEMAS` if they don't exist, and
+    upgrade them; see `upgrade_schema`.
+
+    Args:
+        db: The database connection.
+        schema: The name of the schema.
+    """
+
+    (sql, version) = SCHEMAS[schema]
+    db.executescript(sql)
+    if schema != "standard":
+        db.executescript(interned_views_sql(schema))
+    db.execute("PRAGMA user_version = {:d}".format(version))
+    upgrade_schema(db)
+
+def upgrade_schema(db: sqlite3.Connection) -> None:
+    """ Add the columns that were added to `imported_files` to databases
+    created by older versions of this script. Files recorded by older versions
+    were imported completely. """
+
+    existing_columns = {
+        row[1] for row in db.execute("PRAGMA table_info(imported_files)")
+    }
+    for (column, column_type) in IMPORTED_FILES_NEW_COLUMNS:
+        if column not in existing_columns:
+            db.execute("ALTER TABLE imported_files ADD COLUMN {} {}".format(
+                column, column_type
+            ))
+
+def is_imported(db: sqlite3.Connection, tweets_path: str) -> bool:
+    """ Check if a file was already imported into a database, warning if it
+    was modified since.
+
+    Args:
+        db: The database connection.
+        tweets_path: The path to the file.
+    """
+
+    full_path = os.path.abspath(tweets_path)
+    last_modified = os.stat(full_path).st_mtime
+
+    try:
+        (existing_last_modified,) = next(db.execute(
+            "SELECT last_modified FROM imported_files"
+            " WHERE full_path = ? AND complete",
+            (full_path,)
+        ))
+        print("skipping {}".format(tweets_path))
+        if existing_last_modified < last_modified:
+            print(
+                "WARNING: newer version of {} exists. consider"
+                " rebuilding the database.".format(tweets_path)
+            )
+        return True
+    except StopIteration:
+        return False
+
+def import_progress(db: sqlite3.Connection,
+                    tweets_path: str) -> typing.Tuple[int, int]:
+    """ Get how far an interrupted import of a file got, warning if the file
+    was modified since.
+
+    Args:
+        db: The database connection.
+        tweets_path: The path to the file.
+
+    Returns:
+        A tuple of (the number of lines read, the uncompressed offset to
+        resume reading from), which is (0, 0) if the import was not started.
+    """
+
+    full_path = os.path.abspath(tweets_path)
+    try:
+        (existing_last_modified, lines, position) = next(db.execute(
+            "SELECT last_modified, lines, position FROM imported_files"
+            " WHERE full_path = ? AND NOT complete",
+            (full_path,)
+        ))
+    except StopIteration:
+        return (0, 0)
+
+    print("resuming {} at line {}".format(tweets_path, lines))
+    if existing_last_modified < os.stat(full_path).st_mtime:
+        print(
+            "WARNING: {} was modified since it was partially imported."
+            " consider rebuilding the database.".format(tweets_path)
+        )
+    return (lines, position)
+
+def interrupted_imports(db: sqlite3.Connection) -> typing.Set[str]:
+    """ Get the full paths of the files whose import was interrupted after
+    some of it was committed; see `import_file`. """
+
+    return {
+        full_path for (full_path,) in db.execute(
+            "SELECT full_path FROM imported_files WHERE NOT complete"
+        )
+    }
+
+def record_imported(db: sqlite3.Connection,
+                    tweets_path: str,
+                    lines: int = None,
+                    position: int = None,
+                    complete: bool = True) -> None:
+    """ Record that a file was imported into a database, or how far its import
+    got, replacing any earlier record of it.
+
+    Args:
+        db: The database connection.
+        tweets_path: The path to the file.
+        lines: The number of lines read, if known.
+        position: The uncompressed offset to resume reading from, if known.
+        complete: If False, record an unfinished import, to be resumed by
+            `import_file`.
+    """
+
+    full_path = os.path.abspath(tweets_path)
+    db.execute("DELETE FROM imported_files WHERE full_path = ?", (full_path,))
+    db.execute(
+        "INSERT INTO imported_files"
+        "(full_path, last_modified, lines, position, complete)"
+        " VALUES (?, ?, ?, ?, ?)",
+        (full_path, os.stat(full_path).st_mtime, lines, position,
+         int(complete))
+    )
+
+def commit(db: sqlite3.Connection, stats: ImportStats = None) -> None:
+    """ Commit the current transaction of a database, measuring how long it
+    takes if `stats` is given. """
+
+    if stats is None:
+        db.commit()
+    else:
+        since = stats.clock()
+        db.commit()
+        stats.add("commit", since)
+
+def import_file(db: sqlite3.Connection,
+                tweets_path: str,
+                predicate: tweetio.TweetPredicate = None,
+                sampler: tweetio.TweetSampler = None,
+                batch_size: int = DEFAULT_BATCH_SIZE,
+                position: int = 1,
+                staging: bool = False,
+                cache: UpsertCache = None,
+                latest: bool = False,
+                commit_every: int = 0,
+                stats: ImportStats = None,
+                interner: Interner = None) -> None:
+    """ Import a file into a database, and record it in `imported_files`.
+
+    By default, the file is imported in a single transaction. With
+    `commit_every`, the import is committed every so many lines along with
+    its progress, and an interrupted import is resumed where it was last
+    committed.
+
+    Args:
+        db: The database connection.
+        tweets_path: The file to import.
+        predicate: Passed to `generate_records`.
+        sampler: Passed to `generate_records`.
+        batch_size: Passed to `BatchInserter`.
+        position: The position of the progress bar.
+        staging: Passed to `BatchInserter`.
+        cache: Passed to `BatchInserter`.
+        latest: If True, later versions of users and places replace earlier
+            ones; see `UpsertCache`.
+        commit_every: The number of lines after which to commit, or 0 to
+            commit once at the end.
+        stats: If given, the ImportStats to measure the import with.
+        interner: Passed to `BatchInserter`.
+    """
+
+    (lines, offset) = (0, 0)
+    if commit_every:
+        (lines, offset) = import_progress(db, tweets_path)
+
+    rows = tweetio.read_tweets_from(tweets_path, predicate, offset)
+    if stats is not None:
+        rows = stats.timed("read", rows)
+
+    with db: # atomicity on per-file or per-checkpoint basis
+        # sorted chunks are only read within the predicate's ID range. the
+        # last batches are inserted when leaving the inserter, before the file
+        # is marked as imported
+        with BatchInserter(
+                db, batch_size,
+                replace=UpsertCache.TABLES if latest else False,
+                staging=staging, cache=cache, stats=stats, interner=interner
+            ) as inserter:
+            for (offset, row) in tqdm.tqdm(
+                    rows,
+                    desc=os.path.basename(tweets_path),
+                    position=position,
+                    initial=lines,
+                    leave=None
+                ):
+                for record in generate_records(row, predicate, sampler, stats):
+                    inserter.add(record)
+                lines += 1
+                if stats is not None:
+                    stats.lines += 1
+                    stats.maybe_report()
+                if commit_every and lines % commit_every == 0:
+                    inserter.flush()
+                    record_imported(
+                        db, tweets_path, lines, offset, complete=False
+                    )
+                    commit(db, stats)
+
+        record_imported(db, tweets_path, lines, offset)
+        commit(db, stats)
+
+def build_shard(shard_path: str,
+                inputs: typing.List[str],
+                predicate: tweetio.TweetPredicate = None,
+                sampler: tweetio.TweetSampler = None,
+                batch_size: int = DEFAULT_BATCH_SIZE,
+                position: int = 1,
+                cache_size: int = 0,
+                latest: bool = False,
+                instrument: bool = False
+                ) -> typing.Tuple[str,
+                                  typing.Optional[typing.Dict[str, float]],
+                                  typing.Optional[ImportStats]]:
+    """ Import files into a new shard database, to be merged into the target
+    database with `merge_shard`. This is run by the processes of
+    `import_shards`.
+
+    Shards are temporary, so they are written without journaling or syncing.
+
+    Args:
+        shard_path: The path to the shard database.
+        inputs: The files to import into the shard.
+        predicate: Passed to `generate_records`.
+        sampler: Passed to `generate_records`.
+        batch_size: Passed to `BatchInserter`.
+        position: The position of the progress bar.
+        cache_size: The size of the UpsertCache of the shard, or 0 for none.
+        latest: Passed to `import_file`.
+        instrument: If True, measure the import with an ImportStats.
+
+    Returns:
+        A tuple of (the path to the shard database, the statistics of its
+        UpsertCache or None, its ImportStats or None).
+    """
+
+    cache = UpsertCache(cache_size, latest) if cache_size > 0 else None
+    stats = ImportStats() if instrument else None
+    db = sqlite3.connect(shard_path)
+    try:
+        db.executescript(SQL_INIT_SCHEMA)
+        db.executescript(SQL_HIGH_THROUGHPUT_PRAGMAS)
+        for tweets_path in inputs:
+            import_file(
+                db, tweets_path, predicate, sampler, batch_size, position,
+                cache=cache, latest=latest, stats=stats
+            )
+    finally:
+        db.close()
+    return (shard_path, cache.stats() if cache is not None else None, stats)
+
+def merge_shard(db: sqlite3.Connection,
+                shard_path: str,
+                staging: bool = False,
+                latest: bool = False) -> None:
+    """ Merge a shard database into the target database in a single
+    transaction, including its `imported_files`.
+
+    Duplicate records are skipped as they are when importing directly, so the
+    first version of a duplicate user, place or tweet is kept if shards are
+    merged in the order of their inputs. Shards use the standard schema; in
+    an interned database, records are merged through the views of the
+    interned schema, whose triggers intern them.
+
+    Args:
+        db: The connection to the target database.
+        shard_path: The path to the shard database.
+        staging: If True, append the records to the staging tables instead;
+            see `create_staging_tables`.
+        latest: If True, the users and places of the shard replace earlier
+            versions; see `UpsertCache`.
+    """
+
+    # attaching is not possible within a transaction
+    db.execute("ATTACH DATABASE ? AS shard", (shard_path,))
+    try:
+        with db:
+            for (table_name, columns) in TABLE_COLUMNS.items():
+                db.execute(
+                    "INSERT OR {conflict} INTO main.{target}({columns})"
+                    " SELECT {columns} FROM shard.{table} ORDER BY rowid"
+                    .format(
+                        conflict="REPLACE"
+                        if latest and table_name in UpsertCache.TABLES
+                        and not staging else "IGNORE",
+                        target=STAGING_PREFIX + table_name if staging
+                        else table_name,
+                        table=table_name, columns=",".join(columns)
+                    )
+                )
+            db.execute(
+                "INSERT INTO main.imported_files"
+                "(full_path, last_modified, lines, position, complete)"
+                " SELECT full_path, last_modified, lines, position, complete"
+                " FROM shard.imported_files"
+            )
+    finally:
+        db.execute("DETACH DATABASE shard")
+
+def import_shards(db: sqlite3.Connection,
+                  inputs: typing.List[str],
+                  jobs: int,
+                  files_per_shard: int = 1,
+                  shard_directory: str = None,
+                  predicate: tweetio.TweetPredicate = None,
+                  sampler: tweetio.TweetSampler = None,
+                  batch_size: int = DEFAULT_BATCH_SIZE,
+                  staging: bool = False,
+                  cache_size: int = 0,
+                  latest: bool = False,
+                  stats: ImportStats = None
+                  ) -> typing.Optional[typing.Dict[str, float]]:
+    """ Import files in parallel into separate shard databases, then merge
+    the shards into the target database one by one, in order.
+
+    Each process has a database of its own to write to, so parsing scales
+    with the number of processes, and each merge is a single bulk INSERT ...
+    SELECT per table. Shards are merged as soon as they and the shards before
+    them are done, while later shards are still being built.
+
+    Args:
+        db: The connection to the target database.
+        inputs: The files to import, none of which are imported yet.
+        jobs: The number of processes building shards.
+        files_per_shard: The number of files to import into each shard.
+        shard_directory: The directory to create a temporary directory for
+            the shards in, or None for the system's temporary directory. It
+            should have room for a copy of the imported data.
+        predicate: Passed to `generate_records`.
+        sampler: Passed to `generate_records`.
+        batch_size: Passed to `BatchInserter`.
+        staging: Passed to `merge_shard`.
+        cache_size: Passed to `build_shard`; each shard has its own cache.
+        latest: Passed to `build_shard` and `merge_shard`.
+        stats: If given, the ImportStats to add the measurements of the
+            shards and of merging them to.
+
+    Returns:
+        The combined statistics of the UpsertCaches of the shards, or None if
+        they had none.
+    """
+
+    temp_directory = tempfile.mkdtemp(
+        prefix="tweets-to-sqlite-shards-", dir=shard_directory
+    )
+
+    groups = [
+        inputs[i:i + files_per_shard]
+        for i in range(0, len(inputs), files_per_shard)
+    ]
+    shard_cache_stats = [] # type: typing.List[typing.Optional[dict]]
+    try:
+        with multiprocessing.pool.Pool(jobs) as pool:
+            shards = pool.imap(
+                _build_shard_star,
+                [
+                    (
+                        os.path.join(temp_directory, "shard{}.db".format(i)),
+                        group, predicate, sampler, batch_size, i % jobs + 1,
+                        cache_size, latest, stats is not None
+                    )
+                    for (i, group) in enumerate(groups)
+                ]
+            )
+            for (shard_path, cache_stats, shard_stats) in tqdm.tqdm(
+                    shards, total=len(groups), desc="merging shards",
+                    position=0
+                ):
+                if stats is not None:
+                    since = stats.clock()
+                merge_shard(db, shard_path, staging, latest)
+                if stats is not None:
+                    stats.add("merge", since)
+                    stats.merge(shard_stats)
+                    stats.maybe_report()
+                os.remove(shard_path)
+                shard_cache_stats.append(cache_stats)
+    finally:
+        shutil.rmtree(temp_directory, ignore_errors=True)
+
+    return combine_upsert_cache_stats(shard_cache_stats)
+
+def _build_shard_star(args: tuple) -> tuple:
+    """ Unpack arguments for `build_shard`, for use with `Pool.imap`. """
+
+    return build_shard(*args)
+
+def parse_ranges(input_queue: multiprocessing.Queue,
+                 output_queue: multiprocessing.Queue,
+                 predicate: tweetio.TweetPredicate = None,
+                 sampler: tweetio.TweetSampler = None,
+                 batch_size: int = DEFAULT_BATCH_SIZE,
+                 instrument: bool = False) -> None:
+    """ Parse ranges of files taken from a queue into batches of records. This
+    is run by the parser processes of `import_parallel`.
+
+    Args:
+        input_queue: A queue containing `tweetio.InputRange`s to parse, in the
+            order that the writer will take them in, followed by None.
+        output_queue: A bounded queue that the batches of each range are put
+            into, followed by None once the range is done. Batches are tuples
+            of (records, ImportStats or None), where records is a dict where
+            keys are table names and values are lists of the values of
+            records. If parsing fails, the exception is put into the queue
+            instead, and this process stops.
+        predicate: Passed to `generate_records`.
+        sampler: Passed to `generate_records`.
+        batch_size: The number of records in a batch.
+        instrument: If True, measure reading, parsing and generating records
+            with an ImportStats, and send the measurements since the last
+            batch along with each batch.
+    """
+
+    stats = ImportStats() if instrument else None
+    batch = collections.defaultdict(
+        list
+    ) # type: typing.DefaultDict[str, typing.List[tuple]]
+    def send_batch() -> None:
+        output_queue.put((
+            dict(batch), stats.take() if stats is not None else None
+        ))
+        batch.clear()
+
+    try:
+        for item in iter(input_queue.get, None):
+            # sorted chunks are only read within the predicate's ID range
+            if item.start == 0 and item.end is None:
+                lines = tweetio.read_tweets(item.path, predicate)
+            else:
+                lines = tweetio.read_range(item.path, item.start, item.end)
+            if stats is not None:
+                lines = stats.timed("read", lines)
+
+            batch_records = 0
+            for line in lines:
+                for record in generate_records(line, predicate, sampler,
+                                               stats):
+                    batch[record.table_name].append(record.values)
+                    batch_records += 1
+                if stats is not None:
+                    stats.lines += 1
+                if batch_records >= batch_size:
+                    send_batch()
+                    batch_records = 0
+            # the measurements of the rest of the range are sent even if no
+            # records are left
+            if batch or stats is not None:
+                send_batch()
+            output_queue.put(None)
+    except Exception as error: # pylint: disable=broad-except
+        output_queue.put(error)
+
+def take_batches(output_queue: multiprocessing.Queue,
+                 process: multiprocessing.Process) -> typing.Iterator[tuple]:
+    """ Take the batches of a range from the queue of a parser process of
+    `import_parallel`, until the None that ends the range.
+
+    Args:
+        output_queue: The queue that the parser puts batches into; see
+            `parse_ranges`.
+        process: The parser process.
+
+    Yields:
+        The batches of the range.
+
+    Raises:
+        Exception: The exception that the parser put into the queue.
+        RuntimeError: If the parser exited without finishing the range, e.g.
+            because it was killed.
+    """
+
+    while True:
+        try:
+            batch = output_queue.get(timeout=1)
+        except queue.Empty:
+            if process.exitcode is None:
+                continue
+            # everything the parser put into the queue before exiting is in it
+            try:
+                batch = output_queue.get(timeout=1)
+            except queue.Empty:
+                raise RuntimeError(
+                    "{} exited with code {} before finishing its range".format(
+                        process.name, process.exitcode
+                    )
+                ) from None
+        if batch is None:
+            return
+        if isinstance(batch, Exception):
+            raise batch
+        yield batch
+
+def schedule_ranges(inputs: typing.List[str],
+                    parts: int,
+                    predicate: tweetio.TweetPredicate = None
+                    ) -> typing.Iterator[typing.Tuple[tweetio.InputRange, bool]]:
+    """ Split files into ranges for `import_parallel`, lazily.
+
+    Args:
+        inputs: The files to import, in order.
+        parts: The number of ranges to split each file into, if possible.
+        predicate: If given, sorted chunks with an ID index are not split, so
+            that they are only read within the predicate's ID range.
+
+    Yields:
+        Tuples of (range, True if this is the last range of its file).
+    """
+
+    for path in inputs:
+        if predicate is not None and tweetio.load_id_index(path) is not None:
+            ranges = [tweetio.InputRange(path)]
+        else:
+            ranges = tweetio.split_input(path, parts)
+        for (i, input_range) in enumerate(ranges):
+            yield (input_range, i == len(ranges) - 1)
+
+def import_parallel(db: sqlite3.Connection,
+                    inputs: typing.List[str],
+                    jobs: int,
+                    predicate: tweetio.TweetPredicate = None,
+                    sampler: tweetio.TweetSampler = None,
+                    batch_size: int = DEFAULT_BATCH_SIZE,
+                    queue_size: int = DEFAULT_QUEUE_SIZE,
+                    staging: bool = False,
+                    cache: UpsertCache = None,
+                    latest: bool = False,
+                    stats: ImportStats = None,
+                    interner: Interner = None) -> None:
+    """ Import files using several parser processes that feed this process,
+    the only one writing to the database.
+
+    Files are split into ranges, which are handed out to the parsers in turn.
+    Each parser sends the batches of records of its ranges through its own
+    bounded queue, and the writer takes the ranges back in order, so that each
+    file is imported in its own transaction, together with its entry in
+    `imported_files`, as it is without parser processes. Parsers that get
+    ahead of the writer wait for it once their queue is full, which keeps
+    memory use bounded.
+
+    Args:
+        db: The database connection to import into.
+        inputs: The files to import, none of which are imported yet.
+        jobs: The number of parser processes.
+        predicate: Passed to `generate_records`.
+        sampler: Passed to `generate_records`.
+        batch_size: The number of records in a batch.
+        queue_size: The number of batches that each parser's queue can hold.
+        staging: Passed to `BatchInserter`.
+        cache: Passed to `BatchInserter`.
+        latest: Passed to `import_file`.
+        stats: If given, the ImportStats to measure the writer with. The
+            measurements of the parsers are added to it as well.
+        interner: Passed to `BatchInserter`.
+    """
+
+    input_queues = [multiprocessing.Queue() for _ in range(jobs)]
+    output_queues = [multiprocessing.Queue(queue_size) for _ in range(jobs)]
+    processes = [
+        multiprocessing.Process(
+            target=parse_ranges,
+            args=(
+                input_queue, output_queue, predicate, sampler, batch_size,
+                stats is not None
+            ),
+            daemon=True
+        )
+        for (input_queue, output_queue) in zip(input_queues, output_queues)
+    ]
+    for process in processes:
+        process.start()
+
+    # hand out ranges a few at a time, so that splitting files (which may
+    # require indexing them) is spread over the import
+    ranges = schedule_ranges(inputs, jobs, predicate)
+    job_numbers = itertools.cycle(range(jobs))
+    in_flight = collections.deque(
+    ) # type: typing.Deque[typing.Tuple[int, tweetio.InputRange, bool]]
+    def dispatch() -> None:
+        item = next(ranges, None)
+        if item is not None:
+            job_number = next(job_numbers)
+            input_queues[job_number].put(item[0])
+            in_flight.append((job_number, *item))
+
+    try:
+        for _ in range(2 * jobs):
+            dispatch()
+
+        progress = tqdm.tqdm(total=len(inputs), desc="importing files")
+        while in_flight:
+            # atomicity on per-file basis
+            with db:
+                with BatchInserter(
+                        db, batch_size,
+                        replace=UpsertCache.TABLES if latest else False,
+                        staging=staging, cache=cache, stats=stats,
+                        interner=interner
+                    ) as inserter:
+                    last = False
+                    while not last:
+                        (job_number, input_range, last) = in_flight.popleft()
+                        dispatch()
+                        batches = take_batches(
+                            output_queues[job_number], processes[job_number]
+                        )
+                        if stats is not None:
+                            batches = stats.timed("wait", batches)
+                        for (records, parser_stats) in batches:
+                            for (table_name, rows) in records.items():
+                                inserter.add_rows(table_name, rows)
+                            if stats is not None:
+                                stats.merge(parser_stats)
+                                stats.maybe_report()
+                record_imported(db, input_range.path)
+                commit(db, stats)
+            progress.update()
+        progress.close()
+    finally:
+        for input_queue in input_queues:
+            input_queue.put(None)
+        for process in processes:
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
+
+def main():
+    """ Start importing files. """
+
+    parser = argparse.ArgumentParser(
+        description="import tweets into an SQLite3 database"
+    )
+    parser.add_argument(
+        "inputs", nargs="+",
+        help="paths to tweet JSON data, compressed with any codec supported"
+             " by tweetio.py"
+    )
+    parser.add_argument(
+        "-d", "--db", required=True,
+        help="the path to the database where tweets will be imported"
+    )
+    pragma_group = parser.add_mutually_exclusive_group()
+    pragma_group.add_argument(
+        "-H", "--high-throughput", action="store_true",
+        help="enable pragmas for higher-throughput importing. if the importing"
+             " fails while this is enabled, the entire database may become"
+             " corrupted. see --wal for a safe alternative."
+    )
+    pragma_group.add_argument(
+        "-W", "--wal", action="store_true",
+        help="import with write-ahead logging and synchronous=NORMAL, a large"
+             " page cache and memory-mapped I/O, committing every"
+             " --commit-every lines. this is almost as fast as"
+             " --high-throughput, but a crash only loses the lines since the"
+             " last commit, and the next run resumes each file from there."
+    )
+    parser.add_argument(
+        "--commit-every", type=int, metavar="LINES",
+        help="commit after this many lines of each file, recording how far"
+             " the file was imported so that an interrupted import resumes"
+             " there; 0 commits once per file. default is {} with --wal and 0"
+             " otherwise. only applies to serial imports; with --jobs or"
+             " --shards, files are committed whole."
+             .format(DEFAULT_COMMIT_EVERY)
+    )
+    parser.add_argument(
+        "--cache-size", type=int, metavar="MIB",
+        help="the size of SQLite's page cache; default is {} MiB with --wal"
+             " and SQLite's default otherwise.".format(DEFAULT_WAL_CACHE_SIZE)
+    )
+    parser.add_argument(
+        "--mmap-size", type=int, metavar="MIB",
+        help="the amount of the database to memory-map; default is {} MiB"
+             " with --wal and none otherwise.".format(DEFAULT_WAL_MMAP_SIZE)
+    )
+    parser.add_argument(
+        "-b", "--batch-size", default=DEFAULT_BATCH_SIZE, type=int,
+        help="the number of records of each table to insert at once; default"
+             " is {}.".format(DEFAULT_BATCH_SIZE)
+    )
+    parser.add_argument(
+        "-j", "--jobs", default=1, type=int,
+        help="the number of processes to parse tweets with. this process then"
+             " only writes to the database. files are split into ranges"
+             " that are parsed concurrently, which requires GZIP files to be"
+             " indexed in a single pass first; see tweetio.py."
+    )
+    parser.add_argument(
+        "--queue-size", default=DEFAULT_QUEUE_SIZE, type=int,
+        help="with --jobs, the number of batches that each parsing process"
+             " can get ahead of the database; default is {}."
+             .format(DEFAULT_QUEUE_SIZE)
+    )
+    parser.add_argument(
+        "-s", "--shards", action="store_true",
+        help="import files in parallel, using --jobs processes, into"
+             " temporary shard databases, which are then merged into the"
+             " database one by one. this scales better than --jobs alone, but"
+             " temporarily needs room for a second copy of the imported data."
+    )
+    parser.add_argument(
+        "--files-per-shard", default=1, type=int,
+        help="with --shards, the number of files to import into each shard;"
+             " default is 1. larger shards are merged less often."
+    )
+    parser.add_argument(
+        "--shard-directory",
+        help="with --shards, the directory to write shards in; default is"
+             " the directory of the database."
+    )
+    parser.add_argument(
+        "-B", "--bulk", action="store_true",
+        help="load records into staging tables without keys or indexes"
+             " first, then move them into the real tables in order of their"
+             " primary keys at the end, dropping and recreating indexes"
+             " around the move. this is faster for large imports, but"
+             " temporarily needs room for a second copy of the imported data."
+             " an interrupted bulk load is finished by the next run."
+    )
+    parser.add_argument(
+        "--schema", choices=list(SCHEMAS),
+        help="the schema to create the database with; default is standard."
+             " the interned schema stores the hashtags, the languages of"
+             " tweets and users, the time zones of users and the countries"
+             " of places once each, in lookup tables, and refers to them by"
+             " integer IDs, which makes databases smaller and grouping by"
+             " these columns faster. the compact schema also stores the child"
+             " tables of tweets clustered by tweet ID without rowids, skipping"
+             " exact duplicates, stores the IDs of places as integers, and"
+             " only stores created_at where it differs from the time derived"
+             " from the tweet ID. views expose the columns of the standard"
+             " schema. an existing database keeps its schema."
+    )
+    parser.add_argument(
+        "--stats-report", metavar="PATH",
+        help="measure the wall and CPU time of each stage of the import"
+             " (reading, parsing, generating records, inserting, committing),"
+             " the rows per second, duplicates and cache-skipped rows of each"
+             " table, and write them to this JSON file at the end. the hit"
+             " ratio of SQLite's page cache is not measured."
+    )
+    parser.add_argument(
+        "--stats-interval", type=float, metavar="SECONDS",
+        help="measure the import as with --stats-report, and print a summary"
+             " every this many seconds; default is {:g} with --stats-report."
+             .format(DEFAULT_STATS_INTERVAL)
+    )
+    parser.add_argument(
+        "--upsert-cache-size", default=DEFAULT_UPSERT_CACHE_SIZE, type=int,
+        help="the number of recently written users and places to remember,"
+             " so that records that would not change them are skipped before"
+             " they reach the database; 0 disables the cache. default is {}."
+             .format(DEFAULT_UPSERT_CACHE_SIZE)
+    )
+    parser.add_argument(
+        "--latest-profiles", action="store_true",
+        help="keep the latest version of each user and place instead of the"
+             " first; later versions replace earlier ones unless they are"
+             " unchanged."
+    )
+    tweetio.add_predicate_arguments(parser)
+    tweetio.add_sample_arguments(parser)
+    args = parser.parse_args()
+
+    # skip chunks that cannot contain matching tweets, according to the
+    # manifests written by chunker.py
+    predicate = tweetio.predicate_from_args(args)
+    sampler = tweetio.sampler_from_args(args, parser)
+    inputs = tweetio.prune_inputs(args.inputs, predicate)
+    if len(inputs) < len(args.inputs):
+        print("skipping {} of {} files that cannot match".format(
+            len(args.inputs) - len(inputs), len(args.inputs)
+        ))
+
+    def default(value, wal_default, other_default=0):
+        return value if value is not None \
+            else wal_default if args.wal else other_default
+    connection_kwargs = {
+        "high_throughput": args.high_throughput,
+        "wal": args.wal,
+        "cache_size": default(args.cache_size, DEFAULT_WAL_CACHE_SIZE),
+        "mmap_size": default(args.mmap_size, DEFAULT_WAL_MMAP_SIZE)
+    }
+    commit_every = default(args.commit_every, DEFAULT_COMMIT_EVERY)
+
+    with connect(args.db, **connection_kwargs) as db:
+        try:
+            schema = schema_of(db)
+        except ValueError as error:
+            parser.error("{}: {}".format(args.db, error))
+        if schema is None:
+            schema = args.schema or "standard"
+        elif args.schema not in (None, schema):
+            parser.error("{} was created with the {} schema".format(
+                args.db, schema
+            ))
+        init_schema(db, schema)
+    interner = Interner(schema) if schema != "standard" else None
+
+    with connect(args.db, **connection_kwargs) as db:
+        inputs = [
+            tweets_path for tweets_path in inputs
+            if not is_imported(db, tweets_path)
+        ]
+        # interrupted imports can only be resumed serially, so they are
+        # finished before the others are imported in parallel
+        resumed = interrupted_imports(db)
+    serial_inputs = inputs
+    if args.shards or args.jobs > 1:
+        serial_inputs = [
+            tweets_path for tweets_path in inputs
+            if os.path.abspath(tweets_path) in resumed
+        ]
+        inputs = [
+            tweets_path for tweets_path in inputs
+            if tweets_path not in serial_inputs
+        ]
+
+    # records left in the staging tables by an interrupted bulk load are
+    # finalized by the next bulk load, or now
+    db = connect(args.db, **connection_kwargs)
+    if args.bulk:
+        create_staging_tables(db)
+    elif finalize_staging_tables(db, args.latest_profiles):
+        print("finished an interrupted bulk load")
+    db.close()
+
+    cache = UpsertCache(args.upsert_cache_size, args.latest_profiles) \
+        if args.upsert_cache_size > 0 else None
+    cache_stats = None
+    stats = None
+    if args.stats_report is not None or args.stats_interval is not None:
+        stats = ImportStats(
+            DEFAULT_STATS_INTERVAL if args.stats_interval is None
+            else args.stats_interval
+        )
+
+    db = connect(args.db, **connection_kwargs)
+    for tweets_path in tqdm.tqdm(
+            serial_inputs,
+            desc="importing files",
+            position=0
+        ):
+        import_file(
+            db, tweets_path, predicate, sampler, args.batch_size,
+            staging=args.bulk, cache=cache, latest=args.latest_profiles,
+            commit_every=commit_every, stats=stats, interner=interner
+        )
+    db.close()
+
+    if args.shards and inputs:
+        db = connect(args.db, **connection_kwargs)
+        cache_stats = import_shards(
+            db, inputs, args.jobs, args.files_per_shard,
+            args.shard_directory or os.path.dirname(os.path.abspath(args.db)),
+            predicate, sampler, args.batch_size, args.bulk,
+            args.upsert_cache_size, args.latest_profiles, stats
+        )
+        db.close()
+    elif args.jobs > 1 and inputs:
+        with connect(args.db, **connection_kwargs) as db:
+            import_parallel(
+                db, inputs, args.jobs, predicate, sampler, args.batch_size,
+                args.queue_size, args.bulk, cache, args.latest_profiles, stats,
+                interner
+            )
+    cache_stats = combine_upsert_cache_stats([
+        cache_stats, cache.stats() if cache is not None else None
+    ])
+    if cache_stats is not None:
+        report_upsert_cache(cache_stats)
+
+    if args.bulk:
+        print("moving records from the staging tables")
+        db = connect(args.db, **connection_kwargs)
+        if stats is not None:
+            since = stats.clock()
+        finalize_staging_tables(db, args.latest_profiles)
+        if stats is not None:
+            stats.add("finalize", since)
+        db.close()
+
+    if stats is not None:
+        print(stats.summary())
+        if args.stats_report is not None:
+            report = stats.report()
+            report["upsert_cache"] = cache_stats
+            tweetio.write_json_atomic(args.stats_report, report)
 
-    if args.high_throughput:
+    # leaving WAL mode checkpoints the WAL into the database
+    if args.high_throughput or args.wal:
         with sqlite3.connect(args.db) as db:
             db.executescript(SQL_NORMAL_PRAGMAS)
 
 if __name__ == "__main__":
     import argparse
-    import os
     main()